@@ -0,0 +1,159 @@
+import asyncio
+import math
+from collections import deque
+from contextlib import asynccontextmanager
+from time import perf_counter as timer
+
+from api.metrics import Counter, record
+
+# Admission control in front of the two expensive stages of /ask: retrieval (encode +
+# scoring) and generation (the LLM call). Each stage admits at most `limit` requests at a
+# time; the rest wait in a bounded FIFO queue. A request is turned away instead of queued
+# when the queue is full or when its estimated wait (requests ahead of it x the stage's
+# recent service time / limit) is over the stage's wait budget, and it gives up its place
+# when it has waited longer than the queue timeout. Turned-away requests raise Overloaded,
+# which the API answers with 429 (rejected up front) or 503 (queue deadline passed) and a
+# Retry-After, or, for generation, with a retrieval-only response (ADMISSION_DEGRADE=1).
+# Everything runs on the event loop, so there is no locking.
+
+ADMITTED = Counter("rag_admission_admitted_total", "Requests admitted per stage", ("stage",))
+SHED = Counter("rag_admission_shed_total", "Requests turned away per stage and reason", ("stage", "reason"))
+
+# reason -> HTTP status: rejected before queueing is "slow down" (429), a queued request
+# that ran out of time is "unavailable" (503)
+SHED_STATUS = {"queue_full": 429, "wait_budget": 429, "queue_timeout": 503}
+
+# weight of the newest sample in the service time estimate
+_EWMA_ALPHA = 0.2
+
+
+class Overloaded(Exception):
+    def __init__(self, stage, reason, retry_after):
+        self.stage = stage
+        self.reason = reason
+        self.status = SHED_STATUS[reason]
+        # whole seconds, as the Retry-After header wants them
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"{stage} is overloaded ({reason}), retry in {self.retry_after}s")
+
+
+class AdmissionStage:
+    def __init__(self, name, limit, max_queue, queue_timeout_ms, max_wait_ms=0):
+        """
+        Args:
+            name: Stage label in metrics and errors ("retrieval", "generation")
+            limit: Requests in the stage at once; 0 admits everything (no control)
+            max_queue: Requests allowed to wait for a slot
+            queue_timeout_ms: Longest a request waits for a slot before it is shed
+            max_wait_ms: Shed at arrival when the estimated wait is longer (0 = only the queue bounds apply)
+        """
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout_ms / 1000.0
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._in_flight = 0
+        self._waiters = deque()
+        self._service_seconds = None
+        self._admitted = 0
+        self._shed = {reason: 0 for reason in SHED_STATUS}
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def estimated_wait(self):
+        """Seconds a request arriving now would wait for a slot (0 until a service time has been seen)."""
+        if self.limit <= 0 or (self._in_flight < self.limit and not self._waiters):
+            return 0.0
+        return (len(self._waiters) + 1) * (self._service_seconds or 0.0) / self.limit
+
+    def _reject(self, reason, retry_after):
+        self._shed[reason] += 1
+        SHED.inc(stage=self.name, reason=reason)
+        return Overloaded(self.name, reason, retry_after)
+
+    async def acquire(self):
+        """Wait for a slot; returns the time it was granted (pass it to release). Raises Overloaded."""
+        arrived = timer()
+        if self.limit <= 0 or (self._in_flight < self.limit and not self._waiters):
+            self._in_flight += 1
+            return self._admit(arrived)
+
+        estimate = self.estimated_wait()
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("queue_full", estimate or self.queue_timeout)
+        if self.max_wait and estimate > self.max_wait:
+            raise self._reject("wait_budget", estimate)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # the slot may have been handed over just as the deadline passed
+            if not waiter.done() or waiter.cancelled():
+                raise self._reject("queue_timeout", self.estimated_wait() or self.queue_timeout)
+        except asyncio.CancelledError:
+            # the client went away; pass on a slot that was already handed to us
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        return self._admit(arrived)
+
+    def _admit(self, arrived):
+        admitted = timer()
+        self._admitted += 1
+        ADMITTED.inc(stage=self.name)
+        record(f"{self.name}_queue", admitted - arrived)
+        return admitted
+
+    def release(self, admitted):
+        """Give the slot back (to the longest waiting request, if any)."""
+        seconds = timer() - admitted
+        self._service_seconds = seconds if self._service_seconds is None else \
+            _EWMA_ALPHA * seconds + (1 - _EWMA_ALPHA) * self._service_seconds
+        if self.limit > 0:
+            self._release_slot()
+        else:
+            self._in_flight -= 1
+
+    def _release_slot(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # the slot passes straight to the waiter, in_flight stays the same
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    @asynccontextmanager
+    async def admit(self):
+        admitted = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(admitted)
+
+    def stats(self):
+        """Limits, occupancy and shed counts for /health."""
+        return {
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+            "max_queue": self.max_queue,
+            "queue_timeout_ms": self.queue_timeout * 1000,
+            "max_wait_ms": self.max_wait * 1000,
+            "service_ms": round(self._service_seconds * 1000, 3) if self._service_seconds is not None else None,
+            "estimated_wait_ms": round(self.estimated_wait() * 1000, 3),
+            "admitted": self._admitted,
+            "shed": dict(self._shed),
+        }
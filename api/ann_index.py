@@ -0,0 +1,448 @@
+import os
+import json
+import numpy as np
+
+from api.config import IVF_NPROBE, QUANT_RESCORE
+from api.log import get_logger
+from api.metrics import span
+
+log = get_logger("ann_index")
+
+# Nearest-neighbour index layer used by retriever.search.
+#   flat: exact dot-product scan over the whole matrix (the original behaviour)
+#   ivf:  inverted-file index in pure NumPy. Vectors are clustered with spherical
+#         k-means at build time; a query only scans the `nprobe` closest clusters.
+#   sq8:  int8 scalar-quantized codes (1/4 of float32) scored in a first pass, then
+#         the best `rescore * k` candidates are rescored exactly against the float matrix.
+#   binary: 1 bit per dimension (1/32 of float32), Hamming distance first pass + exact rescoring.
+# The quantized indexes keep only the codes in RAM; the float matrix stays memory-mapped
+# and only the shortlisted rows are read from it.
+# Both are built offline (build_embeddings.py / build_index.py) and persisted next
+# to the binary store, so the API only memory-maps them at startup.
+
+INDEX_META_FILE = "index.json"
+IVF_CENTROIDS_FILE = "ivf_centroids.npy"
+IVF_LIST_OFFSETS_FILE = "ivf_list_offsets.npy"
+IVF_LIST_IDS_FILE = "ivf_list_ids.npy"
+
+SQ8_MIN_FILE = "sq8_min.npy"
+SQ8_STEP_FILE = "sq8_step.npy"
+SQ8_CODES_FILE = "sq8_codes.npy"
+BINARY_CODES_FILE = "binary_codes.npy"
+
+DEFAULT_NPROBE = IVF_NPROBE
+DEFAULT_RESCORE = QUANT_RESCORE
+
+# number of set bits of every byte value, for Hamming distances over packed codes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _as_numpy(vectors):
+    # torch tensors (the loaded store) without importing torch for plain arrays
+    if not isinstance(vectors, np.ndarray) and hasattr(vectors, "numpy"):
+        return vectors.numpy()
+    return np.asarray(vectors)
+
+
+def _topk_rows(scores, k):
+    """Top-k (descending) of each row of a 2D score matrix, returns (values, indices)."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(scores.dtype), empty.astype(np.int64)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1)
+    return np.take_along_axis(part_scores, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+
+class FlatIndex:
+    """Exact search: score every vector."""
+
+    kind = "flat"
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, query_vectors, k, **params):
+        """
+        Args:
+            query_vectors: Array of shape (num_queries, dim)
+            k: Number of neighbours per query
+        Returns:
+            (scores, ids) arrays of shape (num_queries, k)
+        """
+        import torch
+
+        vectors = self.vectors
+        if not isinstance(vectors, torch.Tensor):
+            vectors = torch.from_numpy(np.asarray(vectors))
+        q = torch.as_tensor(np.asarray(query_vectors), dtype=vectors.dtype)
+        with span("score"):
+            scores = q @ vectors.T
+        with span("topk"):
+            top = torch.topk(scores, k=min(k, len(self)), dim=1)
+        return top.values.float().numpy(), top.indices.numpy()
+
+    def save(self, index_dir):
+        _write_meta(index_dir, {"kind": self.kind, "count": len(self)})
+
+
+class IVFIndex:
+    """Inverted-file index over spherical k-means clusters."""
+
+    kind = "ivf"
+
+    def __init__(self, vectors, centroids, list_offsets, list_ids, nprobe=DEFAULT_NPROBE):
+        self.vectors = _as_numpy(vectors)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, nlist=None, niter=20, train_size=None, seed=0, batch_size=65536):
+        """
+        Cluster the vectors with spherical k-means and bucket them by nearest centroid.
+
+        Args:
+            vectors: Array/tensor of shape (num_vectors, dim), L2-normalised
+            nlist: Number of clusters (default ~4*sqrt(N))
+            niter: k-means iterations
+            train_size: Number of vectors sampled for training (default 64 per cluster)
+        """
+        data = _as_numpy(vectors)
+        n = len(data)
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+
+        rng = np.random.default_rng(seed)
+        train_size = min(n, train_size or nlist * 64)
+        train = np.asarray(data[np.sort(rng.choice(n, train_size, replace=False))], dtype=np.float32)
+
+        centroids = train[rng.choice(train_size, nlist, replace=False)].copy()
+        for _ in range(niter):
+            assign = np.argmax(train @ centroids.T, axis=1)
+            counts = np.bincount(assign, minlength=nlist)
+            # per-cluster sums via sorted segments (much faster than np.add.at)
+            order = np.argsort(assign, kind="stable")
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            sums = np.zeros_like(centroids)
+            present = counts > 0
+            sums[present] = np.add.reduceat(train[order], starts[present], axis=0)
+            empty = counts == 0
+            # re-seed empty clusters from random training points
+            if empty.any():
+                sums[empty] = train[rng.choice(train_size, int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+
+        # assign the full matrix in batches so memory stays bounded
+        assign = np.empty(n, dtype=np.int64)
+        for start in range(0, n, batch_size):
+            block = np.asarray(data[start:start + batch_size], dtype=np.float32)
+            assign[start:start + batch_size] = np.argmax(block @ centroids.T, axis=1)
+
+        list_ids = np.argsort(assign, kind="stable").astype(np.int64)
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+
+        return cls(vectors, centroids, list_offsets, list_ids)
+
+    def search(self, query_vectors, k, nprobe=None, **params):
+        """
+        Args:
+            query_vectors: Array of shape (num_queries, dim)
+            k: Number of neighbours per query
+            nprobe: Clusters scanned per query. Higher = better recall, slower.
+        Returns:
+            (scores, ids) arrays of shape (num_queries, k); rows are padded with
+            -inf / -1 when the probed clusters hold fewer than k vectors
+        """
+        q = np.asarray(query_vectors, dtype=np.float32)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+
+        with span("score"):
+            centroid_scores = q @ self.centroids.T
+        with span("topk"):
+            _, probes = _topk_rows(centroid_scores, nprobe)
+
+        out_scores = np.full((len(q), k), -np.inf, dtype=np.float32)
+        out_ids = np.full((len(q), k), -1, dtype=np.int64)
+        for row, lists in enumerate(probes):
+            candidates = np.concatenate([
+                self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in lists
+            ])
+            if len(candidates) == 0:
+                continue
+            candidates.sort()  # sequential access into the memory-mapped matrix
+            with span("score"):
+                scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ q[row]
+            with span("topk"):
+                top_scores, top_pos = _topk_rows(scores[None, :], k)
+            found = top_scores.shape[1]
+            out_scores[row, :found] = top_scores[0]
+            out_ids[row, :found] = candidates[top_pos[0]]
+        return out_scores, out_ids
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, IVF_CENTROIDS_FILE), self.centroids)
+        np.save(os.path.join(index_dir, IVF_LIST_OFFSETS_FILE), self.list_offsets)
+        np.save(os.path.join(index_dir, IVF_LIST_IDS_FILE), self.list_ids)
+        _write_meta(index_dir, {"kind": self.kind, "count": len(self), "nlist": self.nlist})
+
+    @classmethod
+    def load(cls, index_dir, vectors, nprobe=DEFAULT_NPROBE):
+        return cls(
+            vectors,
+            np.load(os.path.join(index_dir, IVF_CENTROIDS_FILE)),
+            np.load(os.path.join(index_dir, IVF_LIST_OFFSETS_FILE), mmap_mode="r"),
+            np.load(os.path.join(index_dir, IVF_LIST_IDS_FILE), mmap_mode="r"),
+            nprobe=nprobe,
+        )
+
+
+class ShardedIndex:
+    """
+    Searches the per-document indexes of a corpus (api/corpus.py) and merges their
+    top-k. Each shard's ids are shifted by the shard's first row in the combined matrix.
+    """
+
+    kind = "sharded"
+
+    def __init__(self, shards, offsets):
+        self.shards = shards
+        self.offsets = offsets
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    @property
+    def shard_kinds(self):
+        return sorted({shard.kind for shard in self.shards})
+
+    def search(self, query_vectors, k, nprobe=None, **params):
+        all_scores, all_ids = [], []
+        for shard, offset in zip(self.shards, self.offsets):
+            scores, ids = shard.search(query_vectors, k, nprobe=nprobe)
+            all_scores.append(np.asarray(scores, dtype=np.float32))
+            all_ids.append(np.where(ids >= 0, ids + offset, -1))
+        with span("topk"):
+            scores = np.concatenate(all_scores, axis=1)
+            ids = np.concatenate(all_ids, axis=1)
+            top_scores, top_pos = _topk_rows(scores, k)
+        return top_scores, np.take_along_axis(ids, top_pos, axis=1)
+
+
+def _rescore(vectors, query, candidates, k):
+    """Exact float scores of a candidate shortlist; returns the top-k (scores, ids)."""
+    candidates = np.sort(candidates)  # sequential access into the memory-mapped matrix
+    with span("score"):
+        scores = np.asarray(vectors[candidates], dtype=np.float32) @ query
+    with span("topk"):
+        top_scores, top_pos = _topk_rows(scores[None, :], k)
+    return top_scores[0], candidates[top_pos[0]]
+
+
+class _QuantizedIndex:
+    """First pass over compact codes, exact rescoring of a shortlist against the float vectors."""
+
+    # binary codes lose much more than int8 ones, so they need a longer shortlist
+    default_rescore = 4
+
+    def __init__(self, vectors, rescore=None):
+        self.vectors = _as_numpy(vectors)
+        self.rescore = rescore or DEFAULT_RESCORE or self.default_rescore
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def approximate_scores(self, queries, start, stop):
+        """(num_queries, stop - start) first-pass scores of rows [start, stop), higher is better."""
+        raise NotImplementedError
+
+    def search(self, query_vectors, k, rescore=None, batch_size=16384, **params):
+        """
+        Args:
+            query_vectors: Array of shape (num_queries, dim)
+            k: Number of neighbours per query
+            rescore: Shortlist size as a multiple of k (higher = better recall, slower)
+        Returns:
+            (scores, ids) arrays of shape (num_queries, k) with exact float scores
+        """
+        q = np.asarray(query_vectors, dtype=np.float32)
+        n = len(self)
+        k = min(k, n)
+        shortlist = min(n, k * (rescore or self.rescore))
+
+        # first pass in row blocks, keeping a running shortlist per query
+        best_scores = np.full((len(q), 0), -np.inf, dtype=np.float32)
+        best_ids = np.empty((len(q), 0), dtype=np.int64)
+        for start in range(0, n, batch_size):
+            stop = min(start + batch_size, n)
+            with span("score"):
+                scores = self.approximate_scores(q, start, stop)
+            with span("topk"):
+                scores = np.concatenate([best_scores, scores], axis=1)
+                ids = np.concatenate([best_ids, np.broadcast_to(np.arange(start, stop), (len(q), stop - start))],
+                                     axis=1)
+                best_scores, pos = _topk_rows(scores, shortlist)
+                best_ids = np.take_along_axis(ids, pos, axis=1)
+
+        out_scores = np.empty((len(q), k), dtype=np.float32)
+        out_ids = np.empty((len(q), k), dtype=np.int64)
+        for row in range(len(q)):
+            out_scores[row], out_ids[row] = _rescore(self.vectors, q[row], best_ids[row], k)
+        return out_scores, out_ids
+
+
+class SQ8Index(_QuantizedIndex):
+    """int8 scalar quantization with a per-dimension min / step."""
+
+    kind = "sq8"
+
+    def __init__(self, vectors, minimum, step, codes, rescore=None):
+        super().__init__(vectors, rescore)
+        self.minimum = np.asarray(minimum, dtype=np.float32)
+        self.step = np.asarray(step, dtype=np.float32)
+        self.codes = codes
+
+    @classmethod
+    def build(cls, vectors, batch_size=65536, **params):
+        data = _as_numpy(vectors)
+        minimum = np.full(data.shape[1], np.inf, dtype=np.float32)
+        maximum = np.full(data.shape[1], -np.inf, dtype=np.float32)
+        for start in range(0, len(data), batch_size):
+            block = np.asarray(data[start:start + batch_size], dtype=np.float32)
+            minimum = np.minimum(minimum, block.min(axis=0))
+            maximum = np.maximum(maximum, block.max(axis=0))
+        step = np.maximum(maximum - minimum, 1e-12) / 255.0
+
+        codes = np.empty(data.shape, dtype=np.int8)
+        for start in range(0, len(data), batch_size):
+            block = np.asarray(data[start:start + batch_size], dtype=np.float32)
+            codes[start:start + batch_size] = (np.rint((block - minimum) / step) - 128).astype(np.int8)
+        return cls(vectors, minimum, step, codes)
+
+    def approximate_scores(self, queries, start, stop):
+        # x ~= minimum + (code + 128) * step, so q.x ~= q.(minimum + 128 * step) + (q * step).code
+        bias = queries @ (self.minimum + 128 * self.step)
+        return (queries * self.step) @ np.asarray(self.codes[start:stop], dtype=np.float32).T + bias[:, None]
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, SQ8_MIN_FILE), self.minimum)
+        np.save(os.path.join(index_dir, SQ8_STEP_FILE), self.step)
+        np.save(os.path.join(index_dir, SQ8_CODES_FILE), self.codes)
+        _write_meta(index_dir, {"kind": self.kind, "count": len(self)})
+
+    @classmethod
+    def load(cls, index_dir, vectors, rescore=None):
+        return cls(
+            vectors,
+            np.load(os.path.join(index_dir, SQ8_MIN_FILE)),
+            np.load(os.path.join(index_dir, SQ8_STEP_FILE)),
+            # codes are read on every query; load them into RAM rather than paging through a mmap
+            np.load(os.path.join(index_dir, SQ8_CODES_FILE)),
+            rescore=rescore,
+        )
+
+
+class BinaryIndex(_QuantizedIndex):
+    """1-bit sign quantization, packed 8 dimensions per byte, ranked by Hamming distance."""
+
+    kind = "binary"
+    default_rescore = 32
+
+    def __init__(self, vectors, codes, rescore=None):
+        super().__init__(vectors, rescore)
+        self.codes = codes
+
+    @staticmethod
+    def encode(vectors):
+        return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+    @classmethod
+    def build(cls, vectors, batch_size=65536, **params):
+        data = _as_numpy(vectors)
+        codes = np.concatenate([
+            cls.encode(data[start:start + batch_size]) for start in range(0, len(data), batch_size)
+        ]) if len(data) else np.empty((0, (data.shape[1] + 7) // 8), dtype=np.uint8)
+        return cls(vectors, codes)
+
+    def approximate_scores(self, queries, start, stop):
+        query_codes = self.encode(queries)
+        codes = np.asarray(self.codes[start:stop])
+        scores = np.empty((len(queries), stop - start), dtype=np.float32)
+        for row, query_code in enumerate(query_codes):
+            # negative Hamming distance: fewer differing bits = more similar
+            scores[row] = -_POPCOUNT[codes ^ query_code].sum(axis=1, dtype=np.int32)
+        return scores
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, BINARY_CODES_FILE), self.codes)
+        _write_meta(index_dir, {"kind": self.kind, "count": len(self)})
+
+    @classmethod
+    def load(cls, index_dir, vectors, rescore=None):
+        return cls(vectors, np.load(os.path.join(index_dir, BINARY_CODES_FILE)), rescore=rescore)
+
+
+INDEX_KINDS = {
+    FlatIndex.kind: FlatIndex,
+    IVFIndex.kind: IVFIndex,
+    SQ8Index.kind: SQ8Index,
+    BinaryIndex.kind: BinaryIndex,
+}
+
+
+def _write_meta(index_dir, meta):
+    os.makedirs(index_dir, exist_ok=True)
+    tmp_path = os.path.join(index_dir, INDEX_META_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, os.path.join(index_dir, INDEX_META_FILE))
+
+
+def build_index(vectors, kind="flat", **build_params):
+    """Build an index of the given kind over the embedding matrix."""
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind {kind!r}, expected one of {list(INDEX_KINDS)}")
+    if kind == FlatIndex.kind:
+        return FlatIndex(vectors)
+    return INDEX_KINDS[kind].build(vectors, **build_params)
+
+
+def load_index(index_dir, vectors):
+    """
+    Load the index persisted in index_dir for the given vectors.
+    Falls back to a flat index when none was built.
+    """
+    meta_path = os.path.join(index_dir, INDEX_META_FILE)
+    if not os.path.exists(meta_path):
+        return FlatIndex(vectors)
+
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    if meta.get("count") != len(vectors):
+        log.warning("Index in %s was built for %s vectors, store has %d. Using exact search until it is rebuilt.",
+                    index_dir, meta.get("count"), len(vectors))
+        return FlatIndex(vectors)
+
+    if meta["kind"] in (IVFIndex.kind, SQ8Index.kind, BinaryIndex.kind):
+        return INDEX_KINDS[meta["kind"]].load(index_dir, vectors)
+    return FlatIndex(vectors)
@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
+from time import time
+
+import numpy as np
+
+from api.generator import NO_CHUNKS_MESSAGE, SAFETY_BLOCKED_MESSAGE, RECITATION_BLOCKED_MESSAGE
+from api.log import get_logger
+
+log = get_logger("answer_cache")
+
+# Two-level answer cache in front of the LLM.
+#   exact:    normalized query + retrieved chunk ids + model -> answer (LRU)
+#   semantic: reuse an answer when the new query's embedding is within a cosine
+#             threshold of a cached query AND their retrieved chunks mostly overlap,
+#             so paraphrases ("what is the hydraulic system?" / "explain hydraulic
+#             system") skip the LLM round trip without answering from other context.
+# Both tiers share one LRU of entries, so TTL / size eviction applies to both.
+
+_UNCACHEABLE = (NO_CHUNKS_MESSAGE, SAFETY_BLOCKED_MESSAGE, RECITATION_BLOCKED_MESSAGE)
+
+
+def normalize_query(query):
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip("?!. ")
+
+
+def is_cacheable(answer):
+    """Errors and blocked responses must not be served again from the cache."""
+    return bool(answer) and not answer.startswith("Error") and answer not in _UNCACHEABLE
+
+
+class AnswerCache:
+    def __init__(self, max_size=1000, ttl_seconds=86400, semantic_threshold=0.92,
+                 min_chunk_overlap=0.6, path=None):
+        """
+        Args:
+            max_size: Maximum cached answers (least recently used are evicted)
+            ttl_seconds: Answers older than this are dropped (0 = never expire)
+            semantic_threshold: Minimum cosine similarity for a semantic hit (None/0 disables the tier)
+            min_chunk_overlap: Fraction of the new query's chunk ids that must be in the cached entry's
+            path: Optional .npz file the cache is loaded from / saved to, so it survives restarts
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        self.min_chunk_overlap = min_chunk_overlap
+        self.path = path
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # semantic tier: embedding matrix over the current entries, rebuilt lazily
+        self._matrix = None
+        self._matrix_keys = []
+        self._dirty = True
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(query, chunk_ids, model):
+        return f"{model}\x1f{normalize_query(query)}\x1f{','.join(map(str, chunk_ids))}"
+
+    def _expired(self, entry, now):
+        return self.ttl_seconds and now - entry["created"] > self.ttl_seconds
+
+    def get(self, query, query_vector, chunk_ids, model):
+        """
+        Returns:
+            (answer, tier) where tier is "exact" or "semantic", or (None, None) on a miss
+        """
+        now = time()
+        key = self._key(query, chunk_ids, model)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry["answer"], "exact"
+
+            if self.semantic_threshold and query_vector is not None:
+                hit = self._semantic_lookup(np.asarray(query_vector, dtype=np.float32), chunk_ids, model, now)
+                if hit is not None:
+                    self._entries.move_to_end(hit)
+                    self.semantic_hits += 1
+                    return self._entries[hit]["answer"], "semantic"
+
+            self.misses += 1
+            return None, None
+
+    def _semantic_lookup(self, query_vector, chunk_ids, model, now):
+        if self._dirty:
+            self._rebuild_matrix()
+        if self._matrix is None:
+            return None
+
+        norm = np.linalg.norm(query_vector)
+        if norm == 0:
+            return None
+        sims = self._matrix @ (query_vector / norm)
+
+        wanted = set(chunk_ids)
+        # best candidates first; stop at the first one that also passes the overlap check
+        for row in np.argsort(-sims):
+            if sims[row] < self.semantic_threshold:
+                break
+            key = self._matrix_keys[row]
+            entry = self._entries[key]
+            if entry["model"] != model or self._expired(entry, now):
+                continue
+            overlap = len(wanted & set(entry["chunk_ids"])) / max(1, len(wanted))
+            if overlap >= self.min_chunk_overlap:
+                return key
+        return None
+
+    def _rebuild_matrix(self):
+        keys = [k for k, e in self._entries.items() if e["embedding"] is not None]
+        if keys:
+            matrix = np.stack([self._entries[k]["embedding"] for k in keys]).astype(np.float32)
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            self._matrix, self._matrix_keys = matrix, keys
+        else:
+            self._matrix, self._matrix_keys = None, []
+        self._dirty = False
+
+    def put(self, query, query_vector, chunk_ids, model, answer):
+        if not is_cacheable(answer):
+            return
+        key = self._key(query, chunk_ids, model)
+        with self._lock:
+            self._entries[key] = {
+                "query": query,
+                "model": model,
+                "chunk_ids": list(chunk_ids),
+                "embedding": None if query_vector is None else np.asarray(query_vector, dtype=np.float32),
+                "answer": answer,
+                "created": time(),
+            }
+            self._entries.move_to_end(key)
+            self._evict()
+            self._dirty = True
+
+    def _evict(self):
+        now = time()
+        if self.ttl_seconds:
+            for key in [k for k, e in self._entries.items() if self._expired(e, now)]:
+                del self._entries[key]
+                self.evictions += 1
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def stats(self):
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+    def save(self, path=None):
+        """Persist entries to an .npz file (embeddings as an array, the rest as JSON)."""
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            entries = list(self._entries.values())
+        dim = next((len(e["embedding"]) for e in entries if e["embedding"] is not None), 0)
+        embeddings = np.zeros((len(entries), dim), dtype=np.float32)
+        meta = []
+        for i, e in enumerate(entries):
+            if e["embedding"] is not None:
+                embeddings[i] = e["embedding"]
+            item = {k: e[k] for k in ("query", "model", "chunk_ids", "answer", "created")}
+            item["has_embedding"] = e["embedding"] is not None
+            meta.append(item)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, embeddings=embeddings, entries=np.array(json.dumps(meta)))
+        os.replace(tmp_path, path)
+        log.info("Saved %d cached answers to %s", len(entries), path)
+
+    def load(self, path=None):
+        """Load entries saved by save(); expired ones are skipped."""
+        path = path or self.path
+        if not path or not os.path.exists(path):
+            return
+        with np.load(path, allow_pickle=False) as data:
+            embeddings = data["embeddings"]
+            meta = json.loads(str(data["entries"]))
+        now = time()
+        with self._lock:
+            for i, e in enumerate(meta):
+                entry = dict(e, embedding=embeddings[i] if e.pop("has_embedding") else None)
+                if self._expired(entry, now):
+                    continue
+                self._entries[self._key(entry["query"], entry["chunk_ids"], entry["model"])] = entry
+            self._evict()
+            self._dirty = True
+        log.info("Loaded %d cached answers from %s", len(self._entries), path)
@@ -0,0 +1,194 @@
+import asyncio
+import json
+from time import perf_counter as timer
+
+from api.corpus import SearchFilter
+from api.retriever import pages_from_results
+from api.answer_cache import normalize_query
+from api.generator import NO_CHUNKS_MESSAGE
+from api.config import BATCH_QA_CONCURRENCY, BATCH_QA_BLOCK_SIZE
+from api.log import get_logger
+
+# Batch question answering, shared by POST /ask/batch and batch_ask.py.
+# Input is JSONL, one question per line: {"id": "q1", "query": "...", "top_k": 5,
+# "model": ..., "doc": ..., "chapter": ..., "page_start": ..., "page_end": ...} (or just a
+# JSON string). Work is done in three overlapping steps:
+#   retrieval  - BATCH_QA_BLOCK_SIZE questions at a time: one batched encode and one
+#                matrix-matrix product per block (the score matrix stays block x chunks)
+#   context    - built once per distinct set of retrieved chunks
+#   LLM        - at most `concurrency` calls in flight; questions that normalize to the
+#                same text over the same context share one call
+# Results are yielded as they complete (JSON-able dicts with the item's index and id, so
+# the caller can match them up) with per-item timings in milliseconds.
+
+log = get_logger("batch_qa")
+
+FILTER_FIELDS = ("doc", "chapter", "page_start", "page_end")
+
+
+def parse_items(lines, default_top_k=5, default_model=None):
+    """
+    JSONL lines -> list of item dicts with 'index', 'id', 'query', 'top_k', 'model' and 'filter'.
+    Lines that can't be used get an 'error' instead of failing the batch; blank lines are skipped.
+    """
+    items = []
+    for line in lines:
+        if not line.strip():
+            continue
+        item = {"index": len(items), "id": len(items)}
+        items.append(item)
+        try:
+            raw = json.loads(line)
+            raw = {"query": raw} if isinstance(raw, str) else raw
+            if not isinstance(raw, dict):
+                raise ValueError("expected a JSON object or string")
+            item["id"] = raw.get("id", item["index"])
+            item["query"] = str(raw.get("query") or "").strip()
+            if not item["query"]:
+                raise ValueError("query cannot be empty")
+            item["top_k"] = int(raw["top_k"] if raw.get("top_k") is not None else default_top_k)
+            if item["top_k"] <= 0:
+                raise ValueError("top_k must be positive")
+            item["model"] = raw.get("model") or default_model
+            item["filter"] = SearchFilter.from_params(*(raw.get(f) for f in FILTER_FIELDS))
+        except (ValueError, TypeError) as e:
+            item["error"] = f"Invalid item: {e}"
+    return items
+
+
+def _chunk_keys(chunks):
+    return tuple(f"{c['doc_id']}:{c['chunk_id']}" if "doc_id" in c else str(c["chunk_id"]) for c in chunks)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+class _LLMCall:
+    """One (possibly shared) LLM call, started when the first item needing it arrives."""
+
+    def __init__(self, answer_fn, query, passages, model, semaphore):
+        self.timings = {}
+        self.task = asyncio.get_running_loop().create_task(self._run(answer_fn, query, passages, model, semaphore))
+
+    async def _run(self, answer_fn, query, passages, model, semaphore):
+        waited = timer()
+        async with semaphore:
+            started = timer()
+            self.timings["llm_wait"] = _ms(started - waited)
+            answer = await answer_fn(query, passages, model)
+            self.timings["llm"] = _ms(timer() - started)
+        return answer
+
+
+async def run_batch(items, retrieve_fn, context_fn, answer_fn, concurrency=BATCH_QA_CONCURRENCY,
+                    block_size=BATCH_QA_BLOCK_SIZE, cached_answer=None, cache_answer=None, resolve_filter=None):
+    """
+    Async generator of result dicts, in completion order.
+
+    Args:
+        items: From parse_items
+        retrieve_fn: async (queries, top_ks, filters) -> one (chunks, query_vector) pair per query
+        context_fn: (chunks) -> (passages, context stats)
+        answer_fn: async (query, passages, model) -> answer text
+        cached_answer: Optional (query, query_vector, chunks, model) -> (answer or None, cache tier)
+        cache_answer: Optional (query, query_vector, chunks, model, answer), called once per LLM call
+        resolve_filter: Optional callable raising ValueError for filters that can't be served
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results = asyncio.Queue()
+    contexts, calls = {}, {}
+    batch_started = timer()
+
+    def emit(item, **fields):
+        result = {"index": item["index"], "id": item["id"], "query": item.get("query")}
+        result.update(fields)
+        results.put_nowait(result)
+
+    async def answer_item(item, chunks, query_vector, timings, block_started):
+        try:
+            started = timer()
+            key = _chunk_keys(chunks)
+            if key not in contexts:
+                contexts[key] = context_fn(chunks)
+                timings["context_build"] = _ms(timer() - started)
+            passages, context_stats = contexts[key]
+
+            answer, cached = (cached_answer(item["query"], query_vector, chunks, item["model"])
+                              if cached_answer else (None, None))
+            call_key = (normalize_query(item["query"]), item["model"], key)
+            deduplicated = answer is None and call_key in calls
+            if answer is None:
+                if call_key not in calls:
+                    calls[call_key] = _LLMCall(answer_fn, item["query"], passages, item["model"], semaphore)
+                call = calls[call_key]
+                answer = await call.task
+                if not deduplicated:
+                    timings.update(call.timings)
+                    if cache_answer:
+                        cache_answer(item["query"], query_vector, chunks, item["model"], answer)
+            timings["total"] = _ms(timer() - block_started)
+            emit(item,
+                 answer=answer,
+                 pages=pages_from_results(chunks),
+                 documents=sorted({c["doc_id"] for c in chunks if "doc_id" in c}),
+                 top_scores=[f"{c['score']:.4f}" for c in chunks],
+                 model_used=item["model"],
+                 filter=item["filter"].to_dict() if item["filter"] else None,
+                 context=context_stats,
+                 cached=cached,
+                 deduplicated=deduplicated,
+                 timings_ms=timings,
+                 # LLM failures come back as "Error..." answers; flag them so a job can retry them
+                 error=answer if answer.startswith("Error") else None)
+        except Exception as e:
+            emit(item, answer=None, error=f"Error processing query: {e}", timings_ms=timings)
+
+    async def produce():
+        tasks = []
+        runnable = []
+        for item in items:
+            if "error" not in item and item["filter"] is not None and resolve_filter is not None:
+                try:
+                    resolve_filter(item["filter"])
+                except ValueError as e:
+                    item["error"] = str(e)
+            if "error" in item:
+                emit(item, answer=None, error=item["error"])
+            else:
+                runnable.append(item)
+
+        for start in range(0, len(runnable), block_size):
+            block = runnable[start:start + block_size]
+            started = timer()
+            try:
+                retrieved = await retrieve_fn([i["query"] for i in block], [i["top_k"] for i in block],
+                                              [i["filter"] for i in block])
+            except Exception as e:
+                for item in block:
+                    emit(item, answer=None, error=f"Error processing query: {e}")
+                continue
+            # the block shares one encode + scoring pass; every item reports its duration
+            retrieve_ms = _ms(timer() - started)
+            for item, (chunks, query_vector) in zip(block, retrieved):
+                timings = {"retrieve": retrieve_ms}
+                if not chunks:
+                    timings["total"] = retrieve_ms
+                    emit(item, answer=NO_CHUNKS_MESSAGE, pages=[], top_scores=[], model_used=item["model"], timings_ms=timings, error=None)
+                    continue
+                tasks.append(asyncio.get_running_loop().create_task(
+                    answer_item(item, chunks, query_vector, timings, started)))
+        await asyncio.gather(*tasks)
+
+    producer = asyncio.get_running_loop().create_task(produce())
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+        await producer
+    finally:
+        # the consumer went away (client disconnected): stop retrieval and the LLM calls
+        producer.cancel()
+        for call in calls.values():
+            call.task.cancel()
+    log.info("Batch of %d questions done in %.2fs (%d distinct contexts, %d LLM calls)",
+             len(items), timer() - batch_started, len(contexts), len(calls))
@@ -0,0 +1,151 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter as timer
+
+from api.metrics import STAGE_SECONDS, collect_timings, current_timings
+
+# Micro-batching in front of the query encoder.
+# Concurrent /ask requests submit their query here instead of encoding it alone.
+# The batcher waits up to `max_wait_ms` (or until `max_batch_size` queries are
+# queued), then encodes the whole batch in one forward pass and scores it with one
+# matrix-matrix product via retriever.search_batch, and hands each request its rows.
+# Stage timings of a batch (encode, score, ...) are added to the timings of every
+# request in it (api/metrics.py), together with the request's own queue wait.
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class QueryBatcher:
+    def __init__(self, search_batch_fn, max_batch_size=32, max_wait_ms=5.0, max_samples=1000):
+        """
+        Args:
+            search_batch_fn: Callable(queries, top_ks, nprobes, filters) -> list of result lists.
+                Runs on a dedicated worker thread, never on the event loop.
+            max_batch_size: Upper bound on queries per forward pass
+            max_wait_ms: How long the first query of a batch waits for company
+        """
+        self.search_batch_fn = search_batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = None
+        self._task = None
+        # one thread: batches are already the unit of parallelism, and torch uses its own threads
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-batcher")
+
+        self._batches = 0
+        self._queries = 0
+        self._batch_size_counts = {b: 0 for b in BATCH_SIZE_BUCKETS}
+        self._queue_delays = deque(maxlen=max_samples)
+        self._batch_seconds = deque(maxlen=max_samples)
+
+    def start(self):
+        """Start the batching loop on the running event loop (call from a startup hook)."""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    async def search(self, query, top_k=5, nprobe=None, search_filter=None):
+        """Queue one query and wait for its results (search_filter: optional api.corpus.SearchFilter)."""
+        if self._task is None:
+            raise RuntimeError("QueryBatcher.start() has not been called")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, top_k, nprobe, search_filter, current_timings(), future, timer()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # drain anything that arrived while the window closed, up to the cap
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            await self._process(batch)
+
+    async def _process(self, batch):
+        started = timer()
+        for *_, enqueued in batch:
+            self._queue_delays.append(started - enqueued)
+
+        queries = [item[0] for item in batch]
+        top_ks = [item[1] for item in batch]
+        nprobes = [item[2] for item in batch]
+        filters = [item[3] for item in batch]
+
+        try:
+            results, batch_timings = await asyncio.get_running_loop().run_in_executor(
+                self._executor, collect_timings, self.search_batch_fn, queries, top_ks, nprobes, filters
+            )
+        except Exception as e:
+            for *_, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._record_batch(len(batch), timer() - started)
+
+        for *_, timings, _, enqueued in batch:
+            STAGE_SECONDS.observe(started - enqueued, stage="queue_wait")
+            if timings is not None:
+                timings["queue_wait"] = timings.get("queue_wait", 0.0) + started - enqueued
+                for stage, seconds in batch_timings.items():
+                    timings[stage] = timings.get(stage, 0.0) + seconds
+
+        for (*_, future, _), result in zip(batch, results):
+            # the waiting request may have been cancelled (client disconnected)
+            if not future.done():
+                future.set_result(result)
+
+    def _record_batch(self, size, seconds):
+        self._batches += 1
+        self._queries += size
+        self._batch_seconds.append(seconds)
+        for bucket in BATCH_SIZE_BUCKETS:
+            if size <= bucket:
+                self._batch_size_counts[bucket] += 1
+                break
+        else:
+            self._batch_size_counts[BATCH_SIZE_BUCKETS[-1]] += 1
+
+    def metrics(self):
+        """Batch-size and queueing-delay figures for /health."""
+        delays = sorted(self._queue_delays)
+        batch_seconds = sorted(self._batch_seconds)
+
+        def pct(values, p):
+            if not values:
+                return 0.0
+            return round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 3)
+
+        return {
+            "batches": self._batches,
+            "queries": self._queries,
+            "mean_batch_size": round(self._queries / self._batches, 2) if self._batches else 0.0,
+            "batch_size_le": {str(b): c for b, c in self._batch_size_counts.items()},
+            "queue_delay_ms": {"p50": pct(delays, 0.50), "p95": pct(delays, 0.95), "p99": pct(delays, 0.99)},
+            "batch_compute_ms": {"p50": pct(batch_seconds, 0.50), "p95": pct(batch_seconds, 0.95)},
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
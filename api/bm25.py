@@ -0,0 +1,230 @@
+import os
+import re
+import json
+from collections import Counter
+
+import numpy as np
+
+from api.log import get_logger
+
+log = get_logger("bm25")
+
+# BM25 lexical index over the chunk texts, for the exact identifiers dense
+# embeddings match poorly ("NP.21.3", panel names, switch positions).
+# Built at ingestion time next to the embedding store, in CSR form:
+#   bm25_terms.txt     vocabulary, one term per line (line number = term id)
+#   bm25_offsets.npy   int64, postings of term t are [offsets[t], offsets[t + 1])
+#   bm25_docs.npy      int32 row numbers of the postings, sorted within a term
+#   bm25_weights.npy   float32 tf / length-normalised term weight of each posting
+#   bm25_idf.npy       float32 idf of each term
+#   bm25.json          k1, b, average length and row count
+# The tf normalisation is precomputed, so a query is a gather + bincount over the
+# postings of its terms; nothing is proportional to the corpus size.
+
+BM25_META_FILE = "bm25.json"
+BM25_TERMS_FILE = "bm25_terms.txt"
+BM25_OFFSETS_FILE = "bm25_offsets.npy"
+BM25_DOCS_FILE = "bm25_docs.npy"
+BM25_WEIGHTS_FILE = "bm25_weights.npy"
+BM25_IDF_FILE = "bm25_idf.npy"
+
+# lowercase words / numbers, keeping dotted, dashed and slashed identifiers together
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[./\-][a-z0-9]+)*")
+_SPLIT_RE = re.compile(r"[./\-]")
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were
+will with what which when where who how do does can should would if then than there these those
+""".split())
+
+
+def tokenize(text):
+    """
+    Terms of a text. Compound identifiers are kept whole and also split into
+    their parts, so "NP.21.3" matches both "NP.21.3" and "NP 21".
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(p for p in _SPLIT_RE.split(token) if p and p not in STOPWORDS)
+    return tokens
+
+
+def _in_ranges(rows, ranges):
+    """Boolean mask of rows that fall inside any (start, stop) range (ranges sorted, disjoint)."""
+    starts = np.fromiter((r[0] for r in ranges), dtype=np.int64, count=len(ranges))
+    stops = np.fromiter((r[1] for r in ranges), dtype=np.int64, count=len(ranges))
+    pos = np.searchsorted(starts, rows, side="right") - 1
+    return (pos >= 0) & (rows < stops[np.maximum(pos, 0)])
+
+
+class BM25Index:
+    kind = "bm25"
+
+    def __init__(self, terms, offsets, docs, weights, idf, count, k1=1.2, b=0.75, avgdl=0.0):
+        self.terms = terms
+        self.vocab = {t: i for i, t in enumerate(terms)}
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self.idf = idf
+        self.count = count
+        self.k1 = k1
+        self.b = b
+        self.avgdl = avgdl
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def build(cls, texts, k1=1.2, b=0.75):
+        """
+        Args:
+            texts: Iterable of chunk texts, in store row order
+            k1, b: BM25 term-frequency saturation and length normalisation
+        """
+        vocab = {}
+        term_ids, doc_ids, tfs, lengths = [], [], [], []
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(row)
+                tfs.append(tf)
+
+        count = len(lengths)
+        lengths = np.asarray(lengths, dtype=np.float32)
+        avgdl = float(lengths.mean()) if count else 0.0
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+
+        # CSR by term; the stable sort keeps rows ascending inside each postings list
+        order = np.argsort(term_ids, kind="stable")
+        df = np.bincount(term_ids, minlength=len(vocab))
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(df)
+
+        docs = doc_ids[order]
+        tf = tfs[order]
+        norm = k1 * (1 - b + b * lengths[docs] / max(avgdl, 1e-9))
+        weights = (tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+        idf = np.log(1 + (count - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        terms = [None] * len(vocab)
+        for term, i in vocab.items():
+            terms[i] = term
+        return cls(terms, offsets, docs, weights, idf, count, k1=k1, b=b, avgdl=avgdl)
+
+    def search(self, query, k, ranges=None):
+        """
+        Args:
+            query: Query string
+            k: Number of rows to return
+            ranges: Optional (start, stop) row ranges to restrict the search to
+        Returns:
+            (scores, ids) 1D arrays, best first (fewer than k when few rows match)
+        """
+        term_ids = sorted({self.vocab[t] for t in tokenize(query) if t in self.vocab})
+        if not term_ids or (ranges is not None and not ranges):
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        docs = np.concatenate([self.docs[self.offsets[t]:self.offsets[t + 1]] for t in term_ids])
+        contrib = np.concatenate([
+            self.weights[self.offsets[t]:self.offsets[t + 1]] * self.idf[t] for t in term_ids
+        ])
+        if ranges is not None:
+            keep = _in_ranges(docs, ranges)
+            docs, contrib = docs[keep], contrib[keep]
+            if len(docs) == 0:
+                return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        # accumulate per matching row only (not over the whole corpus)
+        rows, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=contrib).astype(np.float32)
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return scores[top], rows[top].astype(np.int64)
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        with open(os.path.join(index_dir, BM25_TERMS_FILE), "w", encoding="utf-8") as f:
+            f.write("\n".join(self.terms))
+        np.save(os.path.join(index_dir, BM25_OFFSETS_FILE), self.offsets)
+        np.save(os.path.join(index_dir, BM25_DOCS_FILE), self.docs)
+        np.save(os.path.join(index_dir, BM25_WEIGHTS_FILE), self.weights)
+        np.save(os.path.join(index_dir, BM25_IDF_FILE), self.idf)
+        # meta last: its presence marks a complete index
+        tmp_path = os.path.join(index_dir, BM25_META_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"count": self.count, "terms": len(self.terms), "postings": int(len(self.docs)),
+                       "k1": self.k1, "b": self.b, "avgdl": self.avgdl}, f, indent=2)
+        os.replace(tmp_path, os.path.join(index_dir, BM25_META_FILE))
+
+    @classmethod
+    def load(cls, index_dir):
+        with open(os.path.join(index_dir, BM25_META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(index_dir, BM25_TERMS_FILE), "r", encoding="utf-8") as f:
+            text = f.read()
+        terms = text.split("\n") if text else []
+        return cls(
+            terms,
+            np.load(os.path.join(index_dir, BM25_OFFSETS_FILE), mmap_mode="r"),
+            np.load(os.path.join(index_dir, BM25_DOCS_FILE), mmap_mode="r"),
+            np.load(os.path.join(index_dir, BM25_WEIGHTS_FILE), mmap_mode="r"),
+            np.load(os.path.join(index_dir, BM25_IDF_FILE)),
+            meta["count"], k1=meta["k1"], b=meta["b"], avgdl=meta["avgdl"],
+        )
+
+
+class ShardedBM25:
+    """Per-document BM25 indexes of a corpus (api/corpus.py), searched together."""
+
+    kind = "bm25-sharded"
+
+    def __init__(self, shards, offsets):
+        self.shards = shards
+        self.offsets = offsets
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def search(self, query, k, ranges=None):
+        all_scores, all_ids = [], []
+        for shard, offset in zip(self.shards, self.offsets):
+            local = None
+            if ranges is not None:
+                end = offset + len(shard)
+                local = [(max(a, offset) - offset, min(b, end) - offset) for a, b in ranges if a < end and b > offset]
+                if not local:
+                    continue
+            scores, ids = shard.search(query, k, ranges=local)
+            all_scores.append(scores)
+            all_ids.append(ids + offset)
+        if not all_scores:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        scores, ids = np.concatenate(all_scores), np.concatenate(all_ids)
+        top = np.argsort(-scores, kind="stable")[:k]
+        return scores[top], ids[top]
+
+
+def bm25_exists(index_dir):
+    return os.path.exists(os.path.join(index_dir, BM25_META_FILE))
+
+
+def load_bm25(index_dir, count=None):
+    """BM25 index persisted in index_dir, or None when it wasn't built (or is stale)."""
+    if not bm25_exists(index_dir):
+        return None
+    index = BM25Index.load(index_dir)
+    if count is not None and len(index) != count:
+        log.warning("BM25 index in %s was built for %d chunks, store has %d. "
+                    "Lexical search disabled until it is rebuilt.", index_dir, len(index), count)
+        return None
+    return index
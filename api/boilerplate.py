@@ -0,0 +1,69 @@
+import re
+from collections import Counter
+
+# Recurring page boilerplate (copyright lines, document numbers like "D6-27370-TBC",
+# running headers / footers). Detected at ingestion time as short lines near the top
+# or bottom of a page that show up on a large share of the PDF's pages, stored in the store's meta.json, and stripped
+# from excerpts when the LLM context is assembled.
+# Digit runs are normalised to "#", so "Page 3.10.5" and "Page 3.10.6" count as one line.
+
+MIN_LINE_CHARS = 8
+MAX_LINE_CHARS = 120
+# only this many non-empty lines at each end of a page are candidates, so body text
+# that happens to repeat (a standard caution, a checklist step) is left alone
+MARGIN_LINES = 4
+
+
+def normalize_line(line):
+    line = re.sub(r"\s+", " ", line).strip()
+    return re.sub(r"\d+", "#", line)
+
+
+def page_lines(raw_text):
+    """Distinct normalised short header / footer lines of one page's raw text (newlines intact)."""
+    candidates = [line for line in raw_text.splitlines() if line.strip()]
+    if len(candidates) > 2 * MARGIN_LINES:
+        candidates = candidates[:MARGIN_LINES] + candidates[-MARGIN_LINES:]
+    lines = set()
+    for line in candidates:
+        line = normalize_line(line)
+        # lines that are nothing but numbers / punctuation (page numbers) are left to the chunker
+        if MIN_LINE_CHARS <= len(line) <= MAX_LINE_CHARS and re.search(r"[A-Za-z]", line):
+            lines.add(line)
+    return sorted(lines)
+
+
+class BoilerplateDetector:
+    """Counts on how many pages each line appears while pages stream through ingestion."""
+
+    def __init__(self, min_fraction=0.3, min_pages=3):
+        self.min_fraction = min_fraction
+        self.min_pages = min_pages
+        self.pages = 0
+        self.counts = Counter()
+
+    def add(self, lines):
+        self.pages += 1
+        self.counts.update(lines)
+
+    def patterns(self):
+        threshold = max(self.min_pages, self.min_fraction * self.pages)
+        return sorted(line for line, count in self.counts.items() if count >= threshold)
+
+
+def compile_boilerplate(patterns):
+    """One regex matching any of the patterns ('#' = digits, any whitespace between words), or None."""
+    if not patterns:
+        return None
+    parts = []
+    # longest first, so a full footer wins over a shorter line contained in it
+    for pattern in sorted(patterns, key=len, reverse=True):
+        words = [r"\d+".join(re.escape(piece) for piece in word.split("#")) for word in pattern.split(" ")]
+        parts.append(r"\s+".join(words))
+    return re.compile("|".join(parts))
+
+
+def strip_boilerplate(text, regex):
+    if regex is None:
+        return text
+    return re.sub(r"\s{2,}", " ", regex.sub(" ", text)).strip()
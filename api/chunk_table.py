@@ -0,0 +1,157 @@
+from collections.abc import MutableMapping
+
+import numpy as np
+
+# Columnar chunk metadata.
+# Instead of one Python dict per chunk (chunk_id, page_number, text, ...), the
+# table keeps numpy columns for ids / pages / documents and one utf-8 blob with
+# byte offsets for the texts - a handful of objects for the whole corpus, so heap
+# size and GC pauses no longer grow with the number of chunks.
+# table[i] returns a ChunkView: a small dict-like handle that reads (and decodes)
+# fields only when they are accessed, and holds per-result fields such as 'score'.
+
+
+class ChunkTable:
+    def __init__(self, chunk_ids, page_numbers, text_offsets, text_blob, doc_index=None, doc_ids=None):
+        """
+        Args:
+            chunk_ids: int64 array, one per row
+            page_numbers: int32 array, one per row
+            text_offsets: int64 byte offsets into text_blob (num_rows + 1 entries)
+            text_blob: utf-8 texts concatenated back to back (bytes)
+            doc_index: Optional int array, row -> position in doc_ids (multi-document corpora)
+            doc_ids: Document id of each doc_index value
+        """
+        self.chunk_ids = chunk_ids
+        self.page_numbers = page_numbers
+        self.text_offsets = text_offsets
+        self.text_blob = text_blob
+        self.doc_index = doc_index
+        self.doc_ids = list(doc_ids or [])
+        # build lineage of the store the rows came from (set by api/index_state.py); chunk ids
+        # are only comparable within a lineage, so caches keyed on them include it
+        self.lineage_id = None
+
+    @classmethod
+    def from_columns(cls, chunk_ids, page_numbers, texts):
+        """Build a table from Python sequences (CSV loading, tests, benchmarks)."""
+        encoded = [t.encode("utf-8") for t in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            offsets[1:] = np.cumsum([len(b) for b in encoded])
+        return cls(np.asarray(chunk_ids, dtype=np.int64), np.asarray(page_numbers, dtype=np.int32),
+                   offsets, b"".join(encoded))
+
+    @classmethod
+    def from_records(cls, chunks):
+        """Build a table from a list of chunk dicts."""
+        return cls.from_columns([c["chunk_id"] for c in chunks], [c["page_number"] for c in chunks],
+                                [c["text"] for c in chunks])
+
+    @classmethod
+    def concat(cls, tables, doc_ids):
+        """One table over several documents' tables, in order; rows remember their document."""
+        offsets, position = [np.zeros(1, dtype=np.int64)], 0
+        for table in tables:
+            offsets.append(np.asarray(table.text_offsets[1:], dtype=np.int64) + position)
+            position += int(table.text_offsets[-1])
+        doc_index = np.concatenate([np.full(len(t), i, dtype=np.int32) for i, t in enumerate(tables)]) \
+            if tables else np.empty(0, dtype=np.int32)
+        return cls(
+            np.concatenate([np.asarray(t.chunk_ids, dtype=np.int64) for t in tables]),
+            np.concatenate([np.asarray(t.page_numbers, dtype=np.int32) for t in tables]),
+            np.concatenate(offsets),
+            b"".join(bytes(t.text_blob) for t in tables),
+            doc_index=doc_index,
+            doc_ids=doc_ids,
+        )
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(f"chunk row {row} out of range")
+        return ChunkView(self, row)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield ChunkView(self, row)
+
+    def text(self, row):
+        return bytes(self.text_blob[self.text_offsets[row]:self.text_offsets[row + 1]]).decode("utf-8")
+
+    def doc_id(self, row):
+        return self.doc_ids[self.doc_index[row]] if self.doc_index is not None else None
+
+    def nbytes(self):
+        """Memory held by the columns (memory-mapped columns count too)."""
+        columns = [self.chunk_ids, self.page_numbers, self.text_offsets]
+        if self.doc_index is not None:
+            columns.append(self.doc_index)
+        return sum(np.asarray(c).nbytes for c in columns) + len(self.text_blob)
+
+
+class ChunkView(MutableMapping):
+    """
+    Lazily materialised chunk: reads its fields from the table on access. Values
+    set on it (score, ...) are kept on the view only, so copies are cheap and the
+    table is never modified.
+    """
+
+    __slots__ = ("_table", "_row", "_extra")
+
+    def __init__(self, table, row, extra=None):
+        self._table = table
+        self._row = row
+        self._extra = extra if extra is not None else {}
+
+    @property
+    def row(self):
+        return self._row
+
+    @property
+    def lineage_id(self):
+        return self._table.lineage_id
+
+    def _fields(self):
+        return ("chunk_id", "page_number", "text", "doc_id") if self._table.doc_index is not None \
+            else ("chunk_id", "page_number", "text")
+
+    def __getitem__(self, key):
+        if key in self._extra:
+            return self._extra[key]
+        if key == "chunk_id":
+            return int(self._table.chunk_ids[self._row])
+        if key == "page_number":
+            return int(self._table.page_numbers[self._row])
+        if key == "text":
+            return self._table.text(self._row)
+        if key == "doc_id" and self._table.doc_index is not None:
+            return self._table.doc_id(self._row)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self._extra[key] = value
+
+    def __delitem__(self, key):
+        del self._extra[key]
+
+    def __iter__(self):
+        fields = self._fields()
+        yield from fields
+        for key in self._extra:
+            if key not in fields:
+                yield key
+
+    def __len__(self):
+        fields = self._fields()
+        return len(fields) + sum(1 for key in self._extra if key not in fields)
+
+    def copy(self):
+        return ChunkView(self._table, self._row, dict(self._extra))
+
+    def __repr__(self):
+        return f"ChunkView(row={self._row}, chunk_id={self['chunk_id']}, page_number={self['page_number']})"
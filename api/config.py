@@ -1,6 +1,7 @@
 # config.py
 
 import os
+from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,34 +13,243 @@ load_dotenv()
 PROJECT_ROOT = Path(__file__).parent.parent
 
 # Load .env from project root
-env
+load_dotenv(PROJECT_ROOT / ".env")
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 PDF_PATH = os.getenv("PDF_PATH", os.path.join(PROJECT_ROOT, "data", "manual.pdf"))
 
 EMBED_CSV_PATH = os.getenv("EMBED_CSV_PATH", os.path.join(PROJECT_ROOT, "embeddings", "chunks.csv"))
+# Binary memory-mapped store (see api/store.py), preferred over the CSV when present;
+# float16 halves its size on disk and in RAM
+EMBED_STORE_DIR = os.getenv("EMBED_STORE_DIR", os.path.join(PROJECT_ROOT, "embeddings", "store"))
+EMBED_STORE_DTYPE = os.getenv("EMBED_STORE_DTYPE", "float32")
+
+# Multi-document corpus (see api/corpus.py): when CORPUS_MANIFEST exists the API serves
+# one shard per listed document from EMBED_SHARDS_DIR instead of the single store
+CORPUS_MANIFEST = os.getenv("CORPUS_MANIFEST", os.path.join(PROJECT_ROOT, "corpus.json"))
+EMBED_SHARDS_DIR = os.getenv("EMBED_SHARDS_DIR", os.path.join(PROJECT_ROOT, "embeddings", "shards"))
 
 # OLLAMA_URL = os.getenv("OLLAMA_URL", "https://mathewmanoj13--ollama-rag-fastapi-app.modal.run")
 
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
 
-if not GEMINI_API_KEY:
-    print("[WARNING] GEMINI_API_KEY not set. Gemini model calls will fail.")
-    print("[INFO] Set it in a .env file or your environment variables.")
+# LLM backend answering /ask (see api/llm_backends.py): gemini | openai | ollama
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+# Base URL of the Gemini REST API. Point it at a local stand-in
+# (benchmarks/fake_llm_server.py) for load testing without spending quota.
+DEFAULT_GEMINI_API_ENDPOINT = "https://generativelanguage.googleapis.com"
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT", DEFAULT_GEMINI_API_ENDPOINT).rstrip("/")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# OpenAI-compatible chat completions server (Ollama by default)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", OLLAMA_URL.rstrip("/") + "/v1")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "llama3.1")
+# Per-backend HTTP pool, timeout and concurrency limit
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+# retries of 429 / 5xx / connection errors, full-jitter backoff from LLM_RETRY_BASE_SECONDS
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "8"))
+# Routing across models (see api/llm_router.py): routes tried after the primary, as
+# "backend:model" separated by commas, e.g. "gemini:gemini-2.0-flash-lite,openai:llama3.1"
+LLM_FALLBACK_ROUTES = os.getenv("LLM_FALLBACK_ROUTES", "")
+# start the next route when the primary has no first token by its LLM_HEDGE_PERCENTILE
+# time-to-first-token (once LLM_HEDGE_MIN_SAMPLES are observed; before that after
+# LLM_HEDGE_DEFAULT_SECONDS, 0 = don't hedge until then)
+LLM_HEDGE = os.getenv("LLM_HEDGE", "1") == "1"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_DEFAULT_SECONDS = float(os.getenv("LLM_HEDGE_DEFAULT_SECONDS", "0"))
+LLM_HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", "0.05"))
+
+# Embedding model shared by the build and serving paths (see api/model_registry.py)
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "all-MiniLM-L6-v2")
+# float32 | float16 | bfloat16
+EMBED_MODEL_DTYPE = os.getenv("EMBED_MODEL_DTYPE", "float32")
+# torch intra-op threads per process, 0 keeps torch's default
+EMBED_NUM_THREADS = int(os.getenv("EMBED_NUM_THREADS", "0"))
+
+# Query encoding engine (see api/query_encoder.py): torch = the SentenceTransformer as loaded,
+# torchscript / onnx = its transformer exported once to QUERY_ENCODER_EXPORT_DIR (onnx needs onnx + onnxruntime)
+QUERY_ENCODER_ENGINE = os.getenv("QUERY_ENCODER_ENGINE", "torch")
+# dynamic int8 quantization of the exported engine's Linear layers
+QUERY_ENCODER_INT8 = os.getenv("QUERY_ENCODER_INT8", "0") == "1"
+QUERY_ENCODER_EXPORT_DIR = os.getenv("QUERY_ENCODER_EXPORT_DIR", os.path.join(PROJECT_ROOT, "embeddings", "encoder"))
+# an engine whose embeddings fall below this cosine similarity to the torch model's is not used
+QUERY_ENCODER_MIN_COSINE = float(os.getenv("QUERY_ENCODER_MIN_COSINE", "0.99"))
+# tokenized queries kept in an LRU, 0 disables the cache
+QUERY_TOKEN_CACHE_SIZE = int(os.getenv("QUERY_TOKEN_CACHE_SIZE", "10000"))
+# Nearest-neighbour index built next to the embedding store (see api/ann_index.py)
+# flat = exact scan, ivf = inverted-file approximate search,
+# sq8 / binary = int8 / 1-bit quantized first pass + exact rescoring (QUANT_RESCORE * k candidates)
+INDEX_KIND = os.getenv("INDEX_KIND", "flat")
+# IVF clusters, 0 picks ~4*sqrt(num_chunks)
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))
+# IVF clusters scanned per query unless the request sets nprobe (more = better recall, slower)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+# shortlist of the sq8 / binary indexes rescored exactly, as a multiple of k
+# (0 = per-kind default: 4 for sq8, 32 for binary)
+QUANT_RESCORE = int(os.getenv("QUANT_RESCORE", "0"))
+# Exact search split over SHARD_WORKERS processes that memory-map the store (see
+# api/shard_pool.py), in place of the in-process flat scan; 0 = in-process.
+# SHARD_COUNT row ranges (0 = one per worker), SHARD_THREADS BLAS threads per worker
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_THREADS = int(os.getenv("SHARD_THREADS", "1"))
+
+# BM25 lexical index built next to the store (see api/bm25.py) and hybrid retrieval.
+# RETRIEVAL_MODE is the /ask default: dense | lexical | hybrid
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+# rrf = reciprocal rank fusion, weighted = HYBRID_ALPHA * dense + (1 - alpha) * lexical (min-max scaled)
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf")
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.5"))
+# candidates taken from each retriever before fusing (at least top_k)
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+
+# LLM context assembly (see api/context_builder.py)
+# excerpts are packed into CONTEXT_TOKEN_BUDGET prompt tokens (estimated as chars / CHARS_PER_TOKEN);
+# excerpts with a cosine similarity >= CONTEXT_DEDUP_THRESHOLD to a kept one are dropped (1 = exact only)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.95"))
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "4"))
+# a line counts as boilerplate when it appears on this fraction of a document's pages
+BOILERPLATE_MIN_FRACTION = float(os.getenv("BOILERPLATE_MIN_FRACTION", "0.3"))
+
+# Chunking at ingestion (see api/document_processor.py)
+# tokens = sentences packed up to a token target, sentences = the original 10 sentences per page
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "tokens")
+# tokens per chunk, counted with the embedding model's tokenizer at ingestion; CHUNK_MAX_TOKENS
+# is capped at the model's max_seq_length less [CLS] / [SEP] (254 for all-MiniLM-L6-v2),
+# longer input would be truncated when embedded
+CHUNK_TARGET_TOKENS = int(os.getenv("CHUNK_TARGET_TOKENS", "180"))
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "256"))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "40"))
+# sentences repeated at the start of the next chunk
+CHUNK_OVERLAP_SENTENCES = int(os.getenv("CHUNK_OVERLAP_SENTENCES", "1"))
+# 1 = a chunk (or sentence) cut off by a page break continues on the next page
+CHUNK_CROSS_PAGE = os.getenv("CHUNK_CROSS_PAGE", "1") == "1"
+# dot leaders ("Hydraulics ........ 13.10"): collapse = strip them, drop = also skip
+# table-of-contents pages, off = keep the text as extracted
+CHUNK_TOC_MODE = os.getenv("CHUNK_TOC_MODE", "collapse")
+
+# Cross-encoder re-ranking (see api/reranker.py): retrieve RERANK_CANDIDATES chunks,
+# re-score them with the cross-encoder and keep the request's top_k. Scoring stops when
+# the request's RERANK_BUDGET_MS is used up; the rest keep their retrieval order.
+RERANK = os.getenv("RERANK", "0") == "1"
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "8"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+# (query, chunk) scores kept in an LRU, 0 disables the cache
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+
+# Micro-batching of concurrent /ask query encodes (see api/batcher.py)
+QUERY_BATCHING = os.getenv("QUERY_BATCHING", "1") == "1"
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
+# Threads dedicated to query encoding when batching is off (keeps it off the event loop)
+ENCODE_THREADS = int(os.getenv("ENCODE_THREADS", "2"))
+# 1 = await the LLM over the async HTTP client, 0 = blocking SDK call in the threadpool
+ASYNC_LLM = os.getenv("ASYNC_LLM", "1") == "1"
+
+# Batch question answering: POST /ask/batch and batch_ask.py (see api/batch_qa.py)
+# LLM calls in flight per batch job
+BATCH_QA_CONCURRENCY = int(os.getenv("BATCH_QA_CONCURRENCY", "8"))
+# questions encoded and scored together in one pass
+BATCH_QA_BLOCK_SIZE = int(os.getenv("BATCH_QA_BLOCK_SIZE", "256"))
+# largest request body POST /ask/batch accepts, in questions
+BATCH_QA_MAX_ITEMS = int(os.getenv("BATCH_QA_MAX_ITEMS", "10000"))
+
+# Answer cache (see api/answer_cache.py)
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+# cosine similarity for the semantic tier, 0 disables it
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+# fraction of retrieved chunk ids that must match the cached query's
+SEMANTIC_CACHE_MIN_OVERLAP = float(os.getenv("SEMANTIC_CACHE_MIN_OVERLAP", "0.6"))
+# .npz file the cache is restored from at startup and saved to at shutdown ("" = memory only)
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "")
+
+# Index hot-reload: POST /admin/reload (guarded by ADMIN_TOKEN when set), or poll the
+# store's build_id every INDEX_RELOAD_POLL_SECONDS (0 = off)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+INDEX_RELOAD_POLL_SECONDS = float(os.getenv("INDEX_RELOAD_POLL_SECONDS", "0"))
+
+# Serving-path logging (see api/log.py): level, and the fraction of per-request
+# messages (scores, context sizes, prompt previews) that are written
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+# Query log (see api/query_log.py): one JSON line per /ask request, appended by a background
+# thread every QUERY_LOG_FLUSH_SECONDS ("" = off). Up to QUERY_LOG_MAX_PENDING records wait
+# for the writer, more are dropped; past QUERY_LOG_MAX_MB the file is rotated to <path>.1 (0 = never)
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", os.path.join(PROJECT_ROOT, "logs", "queries.jsonl"))
+QUERY_LOG_FLUSH_SECONDS = float(os.getenv("QUERY_LOG_FLUSH_SECONDS", "1"))
+QUERY_LOG_MAX_PENDING = int(os.getenv("QUERY_LOG_MAX_PENDING", "10000"))
+QUERY_LOG_MAX_MB = float(os.getenv("QUERY_LOG_MAX_MB", "100"))
+# Startup pre-warm: once the index is loaded, retrieve the QUERY_LOG_PREWARM most frequent
+# queries of the log's last QUERY_LOG_PREWARM_HOURS (0 = the whole log); 0 = off. With
+# QUERY_LOG_PREWARM_ANSWERS=1 the ones missing from the answer cache are answered too (LLM calls)
+QUERY_LOG_PREWARM = int(os.getenv("QUERY_LOG_PREWARM", "100"))
+QUERY_LOG_PREWARM_HOURS = float(os.getenv("QUERY_LOG_PREWARM_HOURS", "24"))
+QUERY_LOG_PREWARM_ANSWERS = os.getenv("QUERY_LOG_PREWARM_ANSWERS", "0") == "1"
+
+# Load the index and model when api.main is imported, so a preloading parent (gunicorn
+# --preload) holds them and forked workers share them copy-on-write
+PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "0") == "1"
+
+# Admission control for /ask and /ask/stream (see api/admission.py), per stage: requests
+# in the stage at once (0 = unlimited), requests allowed to queue for it, the longest a
+# request may queue (ms), and the estimated wait above which it is shed on arrival (ms, 0 = off)
+RETRIEVAL_CONCURRENCY = int(os.getenv("RETRIEVAL_CONCURRENCY", "64"))
+RETRIEVAL_QUEUE = int(os.getenv("RETRIEVAL_QUEUE", "256"))
+RETRIEVAL_QUEUE_TIMEOUT_MS = float(os.getenv("RETRIEVAL_QUEUE_TIMEOUT_MS", "2000"))
+RETRIEVAL_MAX_WAIT_MS = float(os.getenv("RETRIEVAL_MAX_WAIT_MS", "1000"))
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", str(LLM_MAX_CONCURRENCY)))
+GENERATION_QUEUE = int(os.getenv("GENERATION_QUEUE", "64"))
+GENERATION_QUEUE_TIMEOUT_MS = float(os.getenv("GENERATION_QUEUE_TIMEOUT_MS", "10000"))
+GENERATION_MAX_WAIT_MS = float(os.getenv("GENERATION_MAX_WAIT_MS", "8000"))
+# 1 = a request shed by the generation stage gets the retrieved pages and excerpts
+# without an answer (200, "degraded"), 0 = it gets the 429 / 503
+ADMISSION_DEGRADE = os.getenv("ADMISSION_DEGRADE", "1") == "1"
+
+# Cold start: 1 = the API starts answering (GET /health/live) right away and loads the
+# index and model in the background, GET /health/ready turns 200 when they are in;
+# 0 = the server only starts accepting requests once both are loaded
+BACKGROUND_LOAD = os.getenv("BACKGROUND_LOAD", "1") == "1"
+
+
+def check_setup():
+    """Print warnings for a missing API key or input files (called when the API starts loading)."""
+    if not GEMINI_API_KEY and LLM_BACKEND == "gemini":
+        print("[WARNING] GEMINI_API_KEY not set. Gemini model calls will fail.")
+        print("[INFO] Set it in a .env file or your environment variables.")
+
+    # Validate paths exist
+    if not os.path.exists(PDF_PATH):
+        print(f"[WARNING] PDF file not found at {PDF_PATH}")
 
-# Validate paths exist
-if not os.path.exists(PDF_PATH):
-    print(f"[WARNING] PDF file not found at {PDF_PATH}")
+    if not os.path.exists(EMBED_CSV_PATH):
+        print(f"[WARNING] Embeddings file not found at {EMBED_CSV_PATH}")
+        print(f"[INFO] Run: python scripts/setup.py")
 
-if not os.path.exists(EMBED_CSV_PATH):
-    print(f"[WARNING] Embeddings file not found at {EMBED_CSV_PATH}")
-    print(f"[INFO] Run: python scripts/setup.py")
 
 # Print loaded config (for debugging)
 if __name__ == "__main__":
+    check_setup()
     print("Configuration:")
     print(f"  PROJECT_ROOT: {PROJECT_ROOT}")
     print(f"  PDF_PATH: {PDF_PATH}")
     print(f"  EMBED_CSV_PATH: {EMBED_CSV_PATH}")
-    # print(f"  OLLAMA_URL: {OLLAMA_URL}")
+    print(f"  EMBED_STORE_DIR: {EMBED_STORE_DIR} ({EMBED_STORE_DTYPE})")
+    print(f"  EMBED_MODEL_NAME: {EMBED_MODEL_NAME} ({EMBED_MODEL_DTYPE}, threads={EMBED_NUM_THREADS or 'default'})")
+    print(f"  INDEX_KIND: {INDEX_KIND} (IVF_NLIST={IVF_NLIST or 'auto'}, IVF_NPROBE={IVF_NPROBE}, "
+          f"QUANT_RESCORE={QUANT_RESCORE or 'per kind'})")
+    print(f"  LLM_BACKEND: {LLM_BACKEND} ({OPENAI_BASE_URL if LLM_BACKEND != 'gemini' else GEMINI_API_ENDPOINT})")
     print(f"  GEMINI_API_KEY: {'Set' if GEMINI_API_KEY else 'Not set'}")
\ No newline at end of file
@@ -0,0 +1,122 @@
+import re
+import hashlib
+
+import numpy as np
+
+from api.config import CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD, CHARS_PER_TOKEN
+from api.boilerplate import strip_boilerplate
+
+# Token-budgeted LLM context assembly.
+# The retrieved chunks used to go into the prompt verbatim: running headers and
+# copyright footers repeated in every excerpt, overlapping chunks of the same page
+# said the same thing twice, and top_k alone decided the prompt size. Here excerpts
+#   1. lose the boilerplate lines detected for their document at ingestion,
+#   2. are dropped when they duplicate a kept excerpt (same text, or stored
+#      embeddings with cosine >= dedup_threshold),
+#   3. are packed best score first until the token budget is used; the last one
+#      may be cut at a sentence boundary.
+# Tokens are estimated from characters (CHARS_PER_TOKEN), which is close enough for
+# budgeting and needs no tokenizer on the request path.
+
+EXCERPT_SEPARATOR = "\n\n---\n\n"
+# a passage is only truncated into the budget if at least this many tokens of it fit
+MIN_PARTIAL_TOKENS = 50
+
+
+def estimate_tokens(text):
+    return int(np.ceil(len(text) / CHARS_PER_TOKEN)) if text else 0
+
+
+def format_excerpt(number, chunk):
+    """One excerpt as it appears in the prompt (see generator.build_prompt)."""
+    return (f"[Excerpt {number} - Page {chunk.get('page_number', '?')} - Relevance: {chunk.get('score', 0):.2f}]\n"
+            f"{chunk.get('text', '').strip()}")
+
+
+def context_tokens(chunks):
+    """Estimated prompt tokens of the excerpts block for these chunks."""
+    parts = [format_excerpt(i, c) for i, c in enumerate(chunks, 1) if c.get("text", "").strip()]
+    return estimate_tokens(EXCERPT_SEPARATOR.join(parts))
+
+
+def _truncate(text, max_chars):
+    """Longest prefix of whole sentences within max_chars (falls back to a word boundary)."""
+    if len(text) <= max_chars:
+        return text
+    head = text[:max_chars]
+    ends = [m.end() for m in re.finditer(r"[.!?](?=\s)", head)]
+    if ends:
+        return head[:ends[-1]]
+    return head.rsplit(" ", 1)[0] + " ..."
+
+
+def _embedding(chunk, embeddings_tensor):
+    row = getattr(chunk, "row", None)
+    if row is None or embeddings_tensor is None or row >= len(embeddings_tensor):
+        return None
+    vector = embeddings_tensor[row].float().numpy()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+
+def build_context(chunks, token_budget=CONTEXT_TOKEN_BUDGET, layout=None, embeddings_tensor=None,
+                  dedup_threshold=CONTEXT_DEDUP_THRESHOLD):
+    """
+    Choose and trim the excerpts that go into the prompt.
+
+    Args:
+        chunks: Retrieved chunks (ChunkViews or dicts with 'text', 'page_number', 'score')
+        token_budget: Estimated prompt tokens the excerpts may use
+        layout: CorpusLayout, for each document's boilerplate lines
+        embeddings_tensor: Stored vectors, for near-duplicate detection by row
+        dedup_threshold: Cosine similarity at which an excerpt counts as a duplicate
+
+    Returns:
+        passages: Copies of the kept chunks with cleaned (possibly truncated) 'text', best first
+        stats: Dict with estimated 'tokens_before' (verbatim excerpts), 'tokens_after',
+            'tokens_saved', and what was dropped
+    """
+    stats = {"tokens_before": context_tokens(chunks), "tokens_after": 0, "tokens_saved": 0,
+             "token_budget": token_budget, "passages": 0, "dropped_duplicates": 0, "dropped_budget": 0,
+             "truncated": 0, "boilerplate_chars": 0}
+
+    passages, seen_hashes, kept_vectors = [], set(), []
+    remaining = token_budget
+    for chunk in sorted(chunks, key=lambda c: c.get("score", 0), reverse=True):
+        original = chunk.get("text", "").strip()
+        regex = layout.boilerplate_for(chunk.get("doc_id")) if layout is not None else None
+        text = strip_boilerplate(original, regex)
+        stats["boilerplate_chars"] += len(original) - len(text)
+        if not text:
+            continue
+
+        digest = hashlib.sha1(" ".join(text.lower().split()).encode("utf-8")).digest()
+        vector = _embedding(chunk, embeddings_tensor) if dedup_threshold < 1 else None
+        if digest in seen_hashes or (vector is not None and kept_vectors
+                                     and float(np.max(np.stack(kept_vectors) @ vector)) >= dedup_threshold):
+            stats["dropped_duplicates"] += 1
+            continue
+
+        passage = chunk.copy()
+        passage["text"] = text
+        # separator + excerpt header + text
+        cost = estimate_tokens(EXCERPT_SEPARATOR + format_excerpt(len(passages) + 1, passage))
+        if cost > remaining:
+            overhead = cost - estimate_tokens(text)
+            if remaining - overhead < MIN_PARTIAL_TOKENS:
+                stats["dropped_budget"] += 1
+                continue
+            passage["text"] = _truncate(text, int((remaining - overhead) * CHARS_PER_TOKEN))
+            cost = estimate_tokens(EXCERPT_SEPARATOR + format_excerpt(len(passages) + 1, passage))
+            stats["truncated"] += 1
+
+        remaining -= cost
+        seen_hashes.add(digest)
+        if vector is not None:
+            kept_vectors.append(vector)
+        passages.append(passage)
+
+    stats["passages"] = len(passages)
+    stats["tokens_after"] = context_tokens(passages)
+    stats["tokens_saved"] = stats["tokens_before"] - stats["tokens_after"]
+    return passages, stats
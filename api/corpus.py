@@ -0,0 +1,349 @@
+import os
+import json
+import hashlib
+import threading
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+
+from api.store import load_store, store_exists, read_meta, lineage_id
+from api.ann_index import load_index, ShardedIndex
+from api.bm25 import load_bm25, ShardedBM25
+from api.boilerplate import compile_boilerplate
+from api.chunk_table import ChunkTable
+from api.config import CORPUS_MANIFEST, EMBED_SHARDS_DIR
+from api.log import get_logger
+
+log = get_logger("corpus")
+
+# Multi-document corpus.
+# corpus.json lists the manuals served together, e.g.
+#   {"documents": [
+#       {"doc_id": "737-800-rev12", "pdf": "data/737-800-rev12.pdf", "title": "737-800 FCOM rev 12"},
+#       {"doc_id": "737-max8-rev3", "pdf": "data/737-max8-rev3.pdf"}
+#   ]}
+# build_embeddings.py --corpus builds one store ("shard") per document under
+# EMBED_SHARDS_DIR/<doc_id>/, each with its own index and chapter list in meta.json.
+# The API lays the shards out back to back and remembers each document's row range,
+# so a filter (documents, chapter, page range) resolves to a few contiguous row ranges
+# and only those rows are scored - filtered queries get cheaper, not more expensive.
+# The shards' vectors stay memory-mapped where they are (ShardedVectors): "back to back"
+# is only an addressing scheme, the matrices are never concatenated into one copy.
+
+DEFAULT_DOC_ID = "default"
+_RESOLVED_CACHE_SIZE = 256
+
+
+class SearchFilter(namedtuple("SearchFilter", ["doc_ids", "chapter", "page_start", "page_end"])):
+    """Restricts retrieval to some documents / one chapter / a page range. Hashable, so resolutions are cached."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_params(cls, doc=None, chapter=None, page_start=None, page_end=None):
+        """Build a filter from /ask parameters (doc is a comma separated list); None when nothing is set."""
+        doc_ids = tuple(sorted({d.strip() for d in doc.split(",") if d.strip()})) if doc else None
+        chapter = chapter.strip() if chapter and chapter.strip() else None
+        if not doc_ids and chapter is None and page_start is None and page_end is None:
+            return None
+        return cls(doc_ids or None, chapter, page_start, page_end)
+
+    def to_dict(self):
+        return {k: v for k, v in self._asdict().items() if v is not None}
+
+
+def corpus_exists(manifest_path=CORPUS_MANIFEST):
+    return bool(manifest_path) and os.path.exists(manifest_path)
+
+
+def load_corpus_manifest(manifest_path=CORPUS_MANIFEST):
+    """
+    Read corpus.json. PDF paths are resolved relative to the manifest.
+
+    Returns:
+        List of document dicts with 'doc_id', 'pdf' and 'title'
+    """
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    documents, seen = [], set()
+    for entry in manifest.get("documents", []):
+        doc_id = str(entry["doc_id"])
+        if doc_id in seen:
+            raise ValueError(f"Duplicate doc_id {doc_id!r} in {manifest_path}")
+        if not doc_id or os.sep in doc_id or doc_id.startswith("."):
+            raise ValueError(f"Invalid doc_id {doc_id!r} in {manifest_path}")
+        seen.add(doc_id)
+        documents.append({
+            "doc_id": doc_id,
+            "pdf": os.path.join(base, entry["pdf"]) if entry.get("pdf") else None,
+            "title": entry.get("title", doc_id),
+        })
+    return documents
+
+
+def shard_dir(doc_id, shards_dir=EMBED_SHARDS_DIR):
+    return os.path.join(shards_dir, doc_id)
+
+
+def corpus_build_id(manifest_path=CORPUS_MANIFEST, shards_dir=EMBED_SHARDS_DIR, lineage=False):
+    """
+    Combined build id of all shards; changes when any document is rebuilt. With lineage=True
+    the combined lineage id (see api/store.py), which only changes with a full rebuild.
+    """
+    parts = []
+    for doc in load_corpus_manifest(manifest_path):
+        path = shard_dir(doc["doc_id"], shards_dir)
+        if store_exists(path):
+            meta = read_meta(path)
+            parts.append(f"{doc['doc_id']}={lineage_id(meta) if lineage else meta.get('build_id')}")
+    if not parts:
+        return None
+    return hashlib.blake2b("\n".join(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _runs(rows):
+    """Sorted row numbers -> list of (start, stop) runs."""
+    if len(rows) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    stops = np.concatenate((breaks, [len(rows)]))
+    return [(int(rows[a]), int(rows[b - 1]) + 1) for a, b in zip(starts, stops)]
+
+
+def _merge(ranges):
+    """(start, stop) ranges -> sorted list with overlapping and touching ranges joined."""
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        elif stop > start:
+            merged.append((start, stop))
+    return merged
+
+
+class ShardedVectors:
+    """
+    The per-document vector tensors of a corpus addressed as one (num_chunks, dim) matrix,
+    without copying them into one: a row, or a slice within one document, is a view of that
+    shard's memory-mapped tensor. Shards of a different dtype are converted to float32 per
+    row / slice read.
+    """
+
+    def __init__(self, tensors):
+        import torch
+
+        self.tensors = tensors
+        self.offsets = np.cumsum([0] + [len(t) for t in tensors])
+        dtypes = {t.dtype for t in tensors}
+        self.dtype = dtypes.pop() if len(dtypes) == 1 else torch.float32
+        self.shape = torch.Size((int(self.offsets[-1]), tensors[0].shape[1]))
+        self.device = tensors[0].device
+
+    def __len__(self):
+        return self.shape[0]
+
+    def cpu(self):
+        return self
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise IndexError("ShardedVectors only supports contiguous slices")
+            pieces = [
+                t[max(start - offset, 0):max(min(stop - offset, len(t)), 0)].to(self.dtype)
+                for t, offset in zip(self.tensors, self.offsets)
+                if start < offset + len(t) and stop > offset
+            ]
+            if len(pieces) == 1:
+                return pieces[0]
+            import torch
+
+            # across a document boundary (resolved filters never are): only this slice is copied
+            return torch.cat(pieces) if pieces else self.tensors[0][:0].to(self.dtype)
+        row = int(key) + (len(self) if int(key) < 0 else 0)
+        if not 0 <= row < len(self):
+            raise IndexError(f"row {key} out of range for {len(self)} rows")
+        shard = int(np.searchsorted(self.offsets, row, side="right")) - 1
+        return self.tensors[shard][row - int(self.offsets[shard])].to(self.dtype)
+
+
+class CorpusLayout:
+    """
+    Where each document lives in the combined embedding matrix, plus what is needed
+    to turn a SearchFilter into row ranges without touching the vectors.
+    """
+
+    def __init__(self, documents):
+        """
+        Args:
+            documents: List of dicts with 'doc_id', 'title', 'start', 'stop' (row range),
+                'page_numbers' (one per row), 'chapters' (see table_of_contents) and
+                optionally 'boilerplate' (recurring lines found at ingestion)
+        """
+        self.documents = OrderedDict()
+        for doc in documents:
+            pages = np.asarray(doc["page_numbers"], dtype=np.int64)
+            self.documents[doc["doc_id"]] = dict(
+                doc,
+                page_numbers=pages,
+                # ingestion writes chunks in page order, so page windows are one searchsorted away
+                pages_sorted=bool(np.all(pages[1:] >= pages[:-1])) if len(pages) else True,
+                boilerplate_regex=compile_boilerplate(doc.get("boilerplate")),
+            )
+        self._resolved = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def single(cls, page_numbers, doc_id=DEFAULT_DOC_ID, title=None, chapters=None, boilerplate=None):
+        """Layout of the classic one-manual setup (page and chapter filters still work)."""
+        return cls([{"doc_id": doc_id, "title": title or doc_id, "start": 0, "stop": len(page_numbers),
+                     "page_numbers": page_numbers, "chapters": chapters or [], "boilerplate": boilerplate or []}])
+
+    @property
+    def doc_ids(self):
+        return list(self.documents)
+
+    def boilerplate_for(self, doc_id=None):
+        """Compiled boilerplate regex of a document (None = the only / first one), or None."""
+        doc = self.documents.get(doc_id) if doc_id is not None else next(iter(self.documents.values()), None)
+        return doc["boilerplate_regex"] if doc else None
+
+    def describe(self):
+        """Documents and their chapters, for /documents."""
+        return [
+            {"doc_id": doc_id, "title": doc["title"], "chunks": doc["stop"] - doc["start"],
+             "chapters": [c["title"] for c in doc["chapters"]]}
+            for doc_id, doc in self.documents.items()
+        ]
+
+    def resolve(self, search_filter):
+        """
+        Row ranges of the combined matrix that match a filter.
+
+        Returns:
+            Sorted list of (start, stop) ranges, or None when search_filter is None (no restriction)
+        Raises:
+            ValueError: For unknown document ids or an inverted page range
+        """
+        if search_filter is None:
+            return None
+        with self._lock:
+            cached = self._resolved.get(search_filter)
+            if cached is not None:
+                self._resolved.move_to_end(search_filter)
+                return cached
+
+        ranges = self._resolve(search_filter)
+        with self._lock:
+            self._resolved[search_filter] = ranges
+            if len(self._resolved) > _RESOLVED_CACHE_SIZE:
+                self._resolved.popitem(last=False)
+        return ranges
+
+    def _resolve(self, search_filter):
+        doc_ids, chapter, page_start, page_end = search_filter
+        unknown = [d for d in doc_ids or () if d not in self.documents]
+        if unknown:
+            raise ValueError(f"Unknown document(s) {unknown}, available: {self.doc_ids}")
+        if page_start is not None and page_end is not None and page_start > page_end:
+            raise ValueError("page_start must not be greater than page_end")
+
+        lo = page_start if page_start is not None else -np.inf
+        hi = page_end if page_end is not None else np.inf
+
+        ranges = []
+        for doc_id in doc_ids or self.doc_ids:
+            doc = self.documents[doc_id]
+            windows = [(lo, hi)]
+            if chapter is not None:
+                wanted = chapter.lower()
+                windows = [
+                    (max(lo, c["start_page"]), min(hi, c["end_page"]))
+                    for c in doc["chapters"] if wanted in c["title"].lower()
+                ]
+            doc_ranges = []
+            for a, b in windows:
+                if a <= b:
+                    doc_ranges.extend(self._page_window(doc, a, b))
+            # merged per document: a range never spans two shards, so it is a view of one
+            ranges.extend(_merge(doc_ranges))
+        return sorted(ranges)
+
+    @staticmethod
+    def _page_window(doc, lo, hi):
+        pages, offset = doc["page_numbers"], doc["start"]
+        if np.isinf(lo) and np.isinf(hi):
+            return [(doc["start"], doc["stop"])]
+        if doc["pages_sorted"]:
+            a = int(np.searchsorted(pages, lo, side="left"))
+            b = int(np.searchsorted(pages, hi, side="right"))
+            return [(offset + a, offset + b)] if b > a else []
+        rows = np.flatnonzero((pages >= lo) & (pages <= hi)) + offset
+        return _runs(rows)
+
+
+def load_corpus(manifest_path=CORPUS_MANIFEST, shards_dir=EMBED_SHARDS_DIR):
+    """
+    Load every shard listed in the manifest.
+
+    Returns:
+        chunks: ChunkTable of all documents (rows carry 'doc_id'), in row order
+        embeddings_tensor: The shard's tensor, or ShardedVectors over all shards' tensors
+        layout: CorpusLayout of the documents' row ranges
+        index: The shard's index, or a ShardedIndex over the per-document indexes
+        bm25: Lexical index over all shards, or None unless every shard has one
+    """
+    tables, tensors, documents, shard_dirs = [], [], [], []
+    rows = 0
+    for doc in load_corpus_manifest(manifest_path):
+        path = shard_dir(doc["doc_id"], shards_dir)
+        if not store_exists(path):
+            log.warning("No shard for %s at %s, skipping (run build_embeddings.py --corpus)", doc["doc_id"], path)
+            continue
+        shard_chunks, shard_tensor = load_store(path)
+        meta = read_meta(path)
+        start, rows = rows, rows + len(shard_chunks)
+        tables.append(shard_chunks)
+        tensors.append(shard_tensor)
+        shard_dirs.append(path)
+        documents.append({
+            "doc_id": doc["doc_id"],
+            "title": meta.get("title", doc["title"]),
+            "start": start,
+            "stop": rows,
+            "page_numbers": np.asarray(shard_chunks.page_numbers),
+            "chapters": meta.get("chapters", []),
+            "boilerplate": meta.get("boilerplate", []),
+        })
+        log.info("Shard %s: %d chunks", doc["doc_id"], len(shard_chunks))
+
+    if not tensors:
+        raise FileNotFoundError(f"No shards found in {shards_dir} for {manifest_path}")
+
+    # one columnar table over all documents; each row knows its doc_id
+    chunks = ChunkTable.concat(tables, [doc["doc_id"] for doc in documents])
+
+    # every shard stays memory-mapped: per-document indexes over each shard's own tensor
+    # (ids are shard-local, ShardedIndex shifts them by the document's first row)
+    layout = CorpusLayout(documents)
+    shard_indexes = [load_index(path, tensor) for path, tensor in zip(shard_dirs, tensors)]
+    if len(tensors) == 1:
+        embeddings_tensor, index = tensors[0], shard_indexes[0]
+    else:
+        embeddings_tensor = ShardedVectors(tensors)
+        index = ShardedIndex(shard_indexes, [doc["start"] for doc in documents])
+
+    bm25_shards = [load_bm25(path, count=doc["stop"] - doc["start"]) for path, doc in zip(shard_dirs, documents)]
+    if any(b is None for b in bm25_shards):
+        bm25 = None
+    elif len(bm25_shards) == 1:
+        bm25 = bm25_shards[0]
+    else:
+        bm25 = ShardedBM25(bm25_shards, [doc["start"] for doc in documents])
+
+    log.info("Loaded corpus of %d documents, %d chunks", len(documents), len(chunks))
+    return chunks, embeddings_tensor, layout, index, bm25
@@ -3,6 +3,12 @@ from tqdm import tqdm
 from spacy.lang.en import English
 import re
 
+from api.store import content_hash
+from api.boilerplate import page_lines
+from api.context_builder import estimate_tokens
+from api.config import (CHUNK_STRATEGY, CHUNK_TARGET_TOKENS, CHUNK_MAX_TOKENS, CHUNK_MIN_TOKENS,
+                        CHUNK_OVERLAP_SENTENCES, CHUNK_CROSS_PAGE, CHUNK_TOC_MODE)
+
 nlp = English()
 nlp.add_pipe("sentencizer")# this is to split whole text into sentences
 
@@ -51,3 +57,287 @@ def chunk_sentences(pages, max_size=10):
             })
 
     return chunks
+
+
+# dot leaders of contents pages and checklists ("Battery switch . . . . . ON")
+LEADER_RE = re.compile(r"(?:\s?[.·_]){4,}|(?:\s?…){2,}")
+# a contents entry: a leader followed by a page reference ("13.10.1", "3-12", "NP.21.3")
+TOC_ENTRY_RE = re.compile(r"(?:(?:\s?[.·_]){4,}|(?:\s?…){2,})\s*(?:[A-Z]{1,3}[.\-]?)?\d+(?:[.\-]\d+)*")
+# a page is a table of contents when it has this many entries, at most this many characters apart
+TOC_MIN_ENTRIES = 5
+TOC_MAX_CHARS_PER_ENTRY = 120
+# a page that ends with one of these doesn't end mid-sentence
+SENTENCE_END = ('.', '!', '?', ':', ';', ')', '"', "'")
+STRATEGIES = ("tokens", "sentences")
+TOC_MODES = ("collapse", "drop", "off")
+
+
+def is_toc_page(text):
+    """True for pages that are mostly table-of-contents entries."""
+    entries = len(TOC_ENTRY_RE.findall(text))
+    return entries >= TOC_MIN_ENTRIES and len(text) / entries <= TOC_MAX_CHARS_PER_ENTRY
+
+
+class Chunker:
+    """
+    Turns sentence-split pages into chunks, one page at a time (pages must arrive in order).
+
+      tokens     sentences are packed into chunks of about target_tokens (never more than
+                 max_tokens, longer sentences are split at word boundaries); the last
+                 `overlap` sentences of a chunk are repeated at the start of the next one.
+                 With cross_page, a chunk still short of min_tokens or ending mid-sentence
+                 at a page break continues on the next page, and a sentence cut by the
+                 break is joined back together. A chunk keeps the page it starts on
+                 ('page_end' is set on chunks that continue onto later pages).
+      sentences  the original fixed groups of `sentences_per_chunk` sentences per page.
+
+    toc_mode: collapse strips dot leaders, drop also skips table-of-contents pages,
+    off leaves the text alone. Tokens are estimated like the context builder does
+    (chars / CHARS_PER_TOKEN) until use_tokenizer() switches to the embedding model's
+    tokenizer, as ingestion does.
+    """
+
+    def __init__(self, strategy=CHUNK_STRATEGY, target_tokens=CHUNK_TARGET_TOKENS, max_tokens=CHUNK_MAX_TOKENS,
+                 min_tokens=CHUNK_MIN_TOKENS, overlap=CHUNK_OVERLAP_SENTENCES, cross_page=CHUNK_CROSS_PAGE,
+                 toc_mode=CHUNK_TOC_MODE, sentences_per_chunk=10):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown chunking strategy {strategy!r}, expected one of {list(STRATEGIES)}")
+        if toc_mode not in TOC_MODES:
+            raise ValueError(f"Unknown TOC mode {toc_mode!r}, expected one of {list(TOC_MODES)}")
+        if not 0 < min_tokens <= target_tokens <= max_tokens:
+            raise ValueError("Chunk sizes must satisfy 0 < min_tokens <= target_tokens <= max_tokens")
+        self.strategy = strategy
+        self.target_tokens = target_tokens
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+        self.overlap = max(0, overlap)
+        self.cross_page = cross_page and strategy == "tokens"
+        self.toc_mode = toc_mode
+        self.sentences_per_chunk = sentences_per_chunk
+        self.count_tokens = estimate_tokens
+        self.tokenizer = None
+
+        # sentences of the chunk being filled: [page_number, text, tokens, repeated from the previous chunk]
+        self._current = []
+        self.stats = {"toc_pages": 0, "leaders_removed": 0, "sentences_split": 0, "cross_page_chunks": 0}
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Build a chunker from 'strategy[:key=value,...]', e.g. 'tokens:target=128,overlap=0,toc=drop'.
+        Keys: target, max, min, overlap, cross_page (0/1), toc, sentences (per chunk).
+        """
+        strategy, _, options = spec.partition(":")
+        names = {"target": ("target_tokens", int), "max": ("max_tokens", int), "min": ("min_tokens", int),
+                 "overlap": ("overlap", int), "cross_page": ("cross_page", lambda v: v == "1"),
+                 "toc": ("toc_mode", str), "sentences": ("sentences_per_chunk", int)}
+        kwargs = {}
+        for option in filter(None, options.split(",")):
+            key, _, value = option.partition("=")
+            if key not in names:
+                raise ValueError(f"Unknown chunking option {key!r} in {spec!r}, expected one of {list(names)}")
+            kwargs[names[key][0]] = names[key][1](value)
+        if strategy == "tokens":
+            # a smaller target alone shouldn't trip the min <= target <= max check
+            target = kwargs.get("target_tokens", CHUNK_TARGET_TOKENS)
+            kwargs.setdefault("max_tokens", max(CHUNK_MAX_TOKENS, target))
+            kwargs.setdefault("min_tokens", min(CHUNK_MIN_TOKENS, target))
+        return cls(strategy, **kwargs)
+
+    def use_tokenizer(self, model):
+        """
+        Count tokens with the tokenizer of a SentenceTransformer embedding model instead of
+        estimating them, and lower max_tokens (and target / min with it) to the model's
+        max_seq_length less [CLS] and [SEP], so no chunk is truncated when it is embedded.
+        """
+        tokenizer = model.tokenizer
+        limit = model.max_seq_length - 2
+        # WordPiece splits at whitespace first, so counts of the pieces of a chunk add up
+        self.count_tokens = lambda text: len(tokenizer.tokenize(text))
+        self.tokenizer = getattr(tokenizer, "name_or_path", None) or type(tokenizer).__name__
+        self.max_tokens = min(self.max_tokens, limit)
+        self.target_tokens = min(self.target_tokens, self.max_tokens)
+        self.min_tokens = min(self.min_tokens, self.target_tokens)
+        return self
+
+    def describe(self):
+        """Settings, recorded in the store's meta.json."""
+        if self.strategy == "sentences":
+            return {"strategy": "sentences", "sentences_per_chunk": self.sentences_per_chunk,
+                    "toc_mode": self.toc_mode}
+        settings = {"strategy": "tokens", "target_tokens": self.target_tokens, "max_tokens": self.max_tokens,
+                    "min_tokens": self.min_tokens, "overlap": self.overlap, "cross_page": self.cross_page,
+                    "toc_mode": self.toc_mode}
+        if self.tokenizer:
+            settings["tokenizer"] = self.tokenizer
+        return settings
+
+    def _clean(self, page):
+        """Sentences of a page with dot leaders stripped; empty for dropped contents pages."""
+        sentences = page["sentences"]
+        if self.toc_mode == "off":
+            return sentences
+        if is_toc_page(page["text"]):
+            self.stats["toc_pages"] += 1
+            if self.toc_mode == "drop":
+                return []
+        cleaned = []
+        for sentence in sentences:
+            stripped, removed = LEADER_RE.subn(" ", sentence)
+            self.stats["leaders_removed"] += removed
+            stripped = re.sub(r"\s+", " ", stripped).strip()
+            # leader runs split by the sentencizer leave bare punctuation behind
+            if any(ch.isalnum() for ch in stripped):
+                cleaned.append(stripped)
+        return cleaned
+
+    def _pieces(self, sentence):
+        """A sentence, split at word boundaries when it alone is longer than max_tokens."""
+        if self.count_tokens(sentence) <= self.max_tokens:
+            return [sentence]
+        self.stats["sentences_split"] += 1
+        pieces, words = [], []
+        for word in sentence.split():
+            if words and self.count_tokens(" ".join(words + [word])) > self.max_tokens:
+                pieces.append(" ".join(words))
+                words = []
+            words.append(word)
+        if words:
+            pieces.append(" ".join(words))
+        return pieces
+
+    def _tokens(self, new_only=False):
+        return sum(s[2] for s in self._current if not (new_only and s[3]))
+
+    def _emit(self):
+        """Close the current chunk; its last sentences start the next one."""
+        new = [s for s in self._current if not s[3]]
+        joined = " ".join(s[1] for s in self._current)
+        chunk = {"page_number": new[0][0], "text": re.sub(r'\.([A-Z])', r'. \1', joined)}
+        if new[-1][0] != new[0][0]:
+            chunk["page_end"] = new[-1][0]
+            self.stats["cross_page_chunks"] += 1
+
+        carried = []
+        for sentence in reversed(self._current[-self.overlap:] if self.overlap else []):
+            # the repeated part stays well under the target, so every chunk adds new text
+            if sum(s[2] for s in carried) + sentence[2] > self.target_tokens // 2:
+                break
+            carried.insert(0, [sentence[0], sentence[1], sentence[2], True])
+        self._current = carried
+        return chunk
+
+    def add_page(self, page):
+        """Chunks completed by this page (with cross_page, its last chunk may only complete on the next one)."""
+        sentences = self._clean(page)
+        if self.strategy == "sentences":
+            return chunk_sentences([{"page_number": page["page_number"], "sentences": sentences}],
+                                   self.sentences_per_chunk)
+
+        chunks = []
+        page_number = page["page_number"]
+        if (self.cross_page and sentences and self._current and not self._current[-1][3]
+                and not self._current[-1][1].endswith(SENTENCE_END) and sentences[0][:1].islower()):
+            # a sentence cut by the page break: join it back together
+            last = self._current.pop()
+            sentences = [f"{last[1]} {sentences[0]}"] + sentences[1:]
+            page_number = last[0]
+
+        for sentence in sentences:
+            for piece in self._pieces(sentence):
+                tokens = self.count_tokens(piece)
+                current = self._tokens()
+                if self._tokens(new_only=True) and (current + tokens > self.max_tokens or
+                                                    (current + tokens > self.target_tokens
+                                                     and self._tokens(new_only=True) >= self.min_tokens)):
+                    chunks.append(self._emit())
+                if self._tokens() + tokens > self.max_tokens:
+                    # no room for the repeated sentences next to this one
+                    self._current = []
+                self._current.append([page_number, piece, tokens, False])
+            page_number = page["page_number"]
+
+        new_tokens = self._tokens(new_only=True)
+        if new_tokens and not (self.cross_page and (new_tokens < self.min_tokens
+                                                    or not self._current[-1][1].endswith(SENTENCE_END))):
+            chunks.append(self._emit())
+        if not self.cross_page:
+            # nothing is carried over a page break
+            self._current = []
+        return chunks
+
+    def flush(self):
+        """The last, still open chunk (call after the last page)."""
+        chunks = [self._emit()] if self._tokens(new_only=True) else []
+        self._current = []
+        return chunks
+
+    def chunk_pages(self, pages):
+        """Chunk a whole list of pages."""
+        chunks = []
+        for page in pages:
+            chunks.extend(self.add_page(page))
+        chunks.extend(self.flush())
+        return chunks
+
+
+def page_count(path):
+    """Number of pages in a PDF (cheap, doesn't extract any text)."""
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def process_page_range(path, start, stop, nlp_batch_size=32, skip_hashes=None):
+    """
+    Extract and sentence-split pages [start, stop) of a PDF.
+    Runs inside ingestion worker processes, so it opens its own document handle
+    (fitz documents can't be shared across processes) and sentencizes the whole
+    range with nlp.pipe instead of one nlp() call per page.
+
+    Args:
+        skip_hashes: Page hashes already indexed; those pages are returned with
+            'unchanged': True and no sentences (incremental builds reuse their chunks)
+
+    Returns:
+        List of page dicts with 'page_number', 'text', 'page_hash', 'lines' and 'sentences' keys
+    """
+    skip_hashes = skip_hashes or set()
+    with fitz.open(path) as doc:
+        pages = []
+        for idx in range(start, min(stop, doc.page_count)):
+            raw = doc[idx].get_text()
+            text = text_formatter(raw)
+            pages.append({"page_number": idx + 1, "text": text, "page_hash": content_hash(text),
+                          # short lines, counted across pages to detect headers / footers
+                          "lines": page_lines(raw)})
+
+    to_split = [item for item in pages if item["page_hash"] not in skip_hashes]
+    texts = (item["text"] for item in to_split)
+    for item, doc in zip(to_split, nlp.pipe(texts, batch_size=nlp_batch_size)):
+        item["sentences"] = [str(s).strip() for s in doc.sents]
+    for item in pages:
+        if "sentences" not in item:
+            item["unchanged"] = True
+            item["sentences"] = None
+    return pages
+
+
+def table_of_contents(path):
+    """
+    Top-level chapters from the PDF outline, used for chapter filters on /ask.
+
+    Returns:
+        List of dicts with 'title', 'start_page' and 'end_page' (1-based, inclusive);
+        empty when the PDF has no outline
+    """
+    with fitz.open(path) as doc:
+        toc = doc.get_toc(simple=True)
+        total = doc.page_count
+
+    # level-1 entries that point at a page, in page order
+    starts = sorted((page, title.strip()) for level, title, page in toc if level == 1 and page > 0)
+    chapters = []
+    for i, (page, title) in enumerate(starts):
+        end = starts[i + 1][0] - 1 if i + 1 < len(starts) else total
+        chapters.append({"title": title, "start_page": page, "end_page": max(page, end)})
+    return chapters
@@ -1,28 +1,25 @@
 import os
 import csv
 import numpy as np
-import torch
-from sentence_transformers import SentenceTransformer, util
+from api.store import write_store, load_store, store_exists
+from api.model_registry import get_embedding_model
+from api.ann_index import build_index
+from api.store import open_vectors, load_columns
+from api.config import INDEX_KIND, IVF_NLIST, BM25_K1, BM25_B
+from api.config import EMBED_STORE_DIR, EMBED_STORE_DTYPE
+from api.bm25 import BM25Index
+from api.chunk_table import ChunkTable
 
-MODEL_NAME = "all-MiniLM-L6-v2"
 EMBED_CSV_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "embeddings", "chunks.csv")
 
 
-_model = None
-
 def get_model():
-    """Lazy load the embedding model."""
-    global _model
-    if _model is None:
-        print(f"[INFO] Loading model: {MODEL_NAME}")
-        _model = SentenceTransformer(MODEL_NAME)
-        # Force model to CPU
-        _model = _model.to('cpu')
-    return _model
+    """Return the shared embedding model from the process-wide registry."""
+    return get_embedding_model()
 
 
-def compute_embeddings_csv(chunks):
-    """Compute embeddings and save to CSV file."""
+def encode_chunks(chunks):
+    """Encode chunk texts into a float32 numpy matrix on CPU."""
     model = get_model()
     texts = [c["text"] for c in chunks]
     
@@ -36,9 +33,11 @@ def compute_embeddings_csv(chunks):
         device='cpu'  # Force CPU
     )
     
-    # Convert to numpy for CSV storage
-    vectors_np = vectors.cpu().numpy()
+    return vectors.cpu().numpy()
 
+
+def write_embeddings_csv(chunks, vectors_np):
+    """Save chunks and their embeddings to the CSV file."""
     os.makedirs("embeddings", exist_ok=True)
 
     with open(EMBED_CSV_PATH, "w", newline="", encoding="utf-8") as f:
@@ -56,6 +55,54 @@ def compute_embeddings_csv(chunks):
     print(f"[INFO] Embeddings saved to {EMBED_CSV_PATH}")
 
 
+def write_embeddings_store(chunks, vectors_np, store_dir=EMBED_STORE_DIR, dtype=EMBED_STORE_DTYPE):
+    """Save chunks and their embeddings to the binary store."""
+    write_store(
+        store_dir,
+        vectors_np,
+        chunk_ids=list(range(len(chunks))),
+        page_numbers=[c["page_number"] for c in chunks],
+        texts=[c["text"] for c in chunks],
+        dtype=dtype,
+    )
+    print(f"[INFO] Embeddings saved to {store_dir} ({dtype})")
+
+
+def build_store_index(store_dir=EMBED_STORE_DIR, kind=INDEX_KIND, nlist=IVF_NLIST):
+    """Build the nearest-neighbour index over a store and persist it next to it."""
+    vectors = open_vectors(store_dir)
+    params = {"nlist": nlist or None} if kind == "ivf" else {}
+    print(f"[INFO] Building {kind} index over {len(vectors)} vectors...")
+    index = build_index(vectors, kind=kind, **params)
+    index.save(store_dir)
+    print(f"[INFO] Index saved to {store_dir}")
+    return index
+
+
+def build_bm25_index(store_dir=EMBED_STORE_DIR, k1=BM25_K1, b=BM25_B):
+    """Build the BM25 lexical index over a store's chunk texts and persist it next to it."""
+    _, _, offsets, blob = load_columns(store_dir)
+    texts = (blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1))
+    index = BM25Index.build(texts, k1=k1, b=b)
+    index.save(store_dir)
+    print(f"[INFO] BM25 index over {len(index)} chunks ({len(index.terms)} terms) saved to {store_dir}")
+    return index
+
+
+def compute_embeddings_csv(chunks):
+    """Compute embeddings and save to CSV file."""
+    vectors_np = encode_chunks(chunks)
+    write_embeddings_csv(chunks, vectors_np)
+
+
+def compute_embeddings_store(chunks, store_dir=EMBED_STORE_DIR, dtype=EMBED_STORE_DTYPE):
+    """Compute embeddings and save them to both the binary store and the CSV."""
+    vectors_np = encode_chunks(chunks)
+    write_embeddings_store(chunks, vectors_np, store_dir=store_dir, dtype=dtype)
+    # CSV is kept alongside for easy versioning / inspection
+    write_embeddings_csv(chunks, vectors_np)
+
+
 def load_embeddings_csv():
     """Load chunks + embeddings from CSV and return as torch tensors on CPU."""
 
@@ -68,7 +115,7 @@ def load_embeddings_csv():
             "Please run the embedding generation script first."
         )
     
-    chunks = []
+    chunk_ids, page_numbers, texts = [], [], []
     embeddings_list = []
     # Read CSV and make sure to handle spaces in embeddings so as to seperate the different values correctly
 
@@ -77,25 +124,67 @@ def load_embeddings_csv():
 
         for row in reader:
             emb_str = row["embedding"].replace(" ", ",")
-            emb = np.array([float(x) for x in emb_str.split(",")])
-
-            chunks.append({
-                "chunk_id": int(row["chunk_id"]),
-                "page_number": int(row["page_number"]),
-                "text": row["text"],
-                "embedding": emb
-            })
+            # the vector only lives in the matrix below, not also (as float64) in the chunk dict
+            emb = np.array(emb_str.split(","), dtype=np.float32)
+
+            chunk_ids.append(int(row["chunk_id"]))
+            page_numbers.append(int(row["page_number"]))
+            texts.append(row["text"])
             embeddings_list.append(emb)
 
+    chunks = ChunkTable.from_columns(chunk_ids, page_numbers, texts)
+
+    import torch
+
     # Convert to torch tensor and FORCE CPU because often loaded on GPU by default
-    embeddings_tensor = torch.tensor(
-        np.array(embeddings_list), 
-        dtype=torch.float32,
-        device='cpu'  # Explicitly set to CPU
-    )
+    embeddings_tensor = torch.from_numpy(np.stack(embeddings_list)).to(device='cpu')  # Explicitly set to CPU
+    del embeddings_list
     
     print(f"[INFO] Loaded {len(chunks)} chunks from CSV")
     print(f"[INFO] Embeddings shape: {embeddings_tensor.shape}")
     print(f"[INFO] Embeddings device: {embeddings_tensor.device}")
     
-    return chunks, embeddings_tensor
\ No newline at end of file
+    return chunks, embeddings_tensor
+
+
+def load_embeddings_store(store_dir=EMBED_STORE_DIR):
+    """Load chunks + memory-mapped embeddings from the binary store."""
+    print(f"[INFO] Looking for embedding store at: {store_dir}")
+
+    chunks, embeddings_tensor = load_store(store_dir)
+
+    print(f"[INFO] Loaded {len(chunks)} chunks from store")
+    print(f"[INFO] Embeddings shape: {embeddings_tensor.shape} ({embeddings_tensor.dtype})")
+
+    return chunks, embeddings_tensor
+
+
+def load_embeddings():
+    """Load from the binary store when it exists, otherwise fall back to the CSV."""
+    if store_exists(EMBED_STORE_DIR):
+        return load_embeddings_store(EMBED_STORE_DIR)
+    print("[INFO] No binary store found, falling back to CSV (run convert_embeddings.py to speed this up)")
+    return load_embeddings_csv()
+
+
+def convert_csv_to_store(csv_path=EMBED_CSV_PATH, store_dir=EMBED_STORE_DIR, dtype=EMBED_STORE_DTYPE):
+    """One-shot conversion of an existing chunks.csv into the binary store."""
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"Embeddings file not found at {csv_path}")
+
+    chunk_ids, page_numbers, texts, vectors = [], [], [], []
+
+    with open(csv_path, "r", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            emb_str = row["embedding"].replace(" ", ",")
+            chunk_ids.append(int(row["chunk_id"]))
+            page_numbers.append(int(row["page_number"]))
+            texts.append(row["text"])
+            vectors.append(np.array(emb_str.split(","), dtype=np.float32))
+
+    if not vectors:
+        raise ValueError(f"No rows found in {csv_path}")
+
+    write_store(store_dir, np.stack(vectors), chunk_ids, page_numbers, texts, dtype=dtype)
+    print(f"[INFO] Converted {len(chunk_ids)} chunks from {csv_path} to {store_dir} ({dtype})")
@@ -1,70 +1,59 @@
-import os
-import google.generativeai as genai
+from collections.abc import Mapping
+from time import perf_counter as timer
 
-# Configure Gemini API
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+from api.context_builder import format_excerpt, EXCERPT_SEPARATOR
+from api.llm_backends import get_backend, close_backends
+from api.llm_router import get_router
+from api.metrics import span, record
+from api.log import get_logger, SAMPLED
 
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    print("[INFO] Gemini API configured successfully")
-else:
-    print("[WARNING] GEMINI_API_KEY not set. Gemini model calls will fail.")
+log = get_logger("generator")
 
-_model = None
+# Prompt building and answer post-processing. The LLM call itself goes through the
+# configured backend (api/llm_backends.py: Gemini or an OpenAI-compatible server),
+# which handles connection pooling, concurrency limits, timeouts and retries. The async
+# paths go through the router (api/llm_router.py), which hedges and falls back across
+# LLM_FALLBACK_ROUTES. The calls are timed as the llm_total (and, streamed, llm_ttft)
+# stages of api/metrics.py.
 
-def get_gemini_model(model_name="gemini-1.5-flash"):
-    #load the gemini model
-    global _model
-    if _model is None:
-        print(f"[INFO] Loading Gemini model: {model_name}")
-        _model = genai.GenerativeModel(model_name)
-    return _model
+NO_CHUNKS_MESSAGE = "I couldn't find any relevant information in the manual to answer your question."
+SAFETY_BLOCKED_MESSAGE = "The response was blocked by content safety filters. This appears to be a false positive for technical aviation content. Please try rephrasing your question."
+RECITATION_BLOCKED_MESSAGE = "The response was blocked due to potential copyright concerns."
+NO_RESPONSE_MESSAGE = "Error: No response generated. The content may have been filtered."
+NO_TEXT_MESSAGE = "Error: Unable to extract text from response. Please try again."
 
 
-def answer_question(query, retrieved_chunks, model="gemini-1.5-flash"):
+def build_prompt(query, retrieved_chunks, model=None):
     """
-    Answer question based on retrieved chunks (max chunks would have equivalent
-      context length of 10 sentences) using Gemini.
-    
-    Args:
-        query: The user's question
-        retrieved_chunks: List of dicts with 'text', 'page_number', 'score' keys
-        model: Gemini model to use
+    Build the LLM prompt from the retrieved chunks.
+
+    Returns:
+        (prompt, None) on success, or (None, message) when there is nothing to
+        send and `message` should be returned to the user as the answer.
     """
-    
+
     # Validate input
     if not retrieved_chunks:
-        return "I couldn't find any relevant information in the manual to answer your question."
-    
+        return None, NO_CHUNKS_MESSAGE
+
     # Extract text from chunks
     context_parts = []
     for i, chunk in enumerate(retrieved_chunks, 1):
-        if isinstance(chunk, dict):
-            text = chunk.get('text', '').strip()
-            page = chunk.get('page_number', '?')
-            score = chunk.get('score', 0)
-            
-            if text:
-                context_parts.append(
-                    f"[Excerpt {i} - Page {page} - Relevance: {score:.2f}]\n{text}"
-                )
-    
-    context_text = "\n\n---\n\n".join(context_parts)
-    
+        # chunks are ChunkViews (or plain dicts), both Mappings
+        if isinstance(chunk, Mapping) and chunk.get('text', '').strip():
+            context_parts.append(format_excerpt(i, chunk))
+
+    context_text = EXCERPT_SEPARATOR.join(context_parts)
+
     # Verify we have actual content
     if not context_text or len(context_text.strip()) < 50:
-        return "Error: No valid context retrieved. Please check your retrieval system."
-    
-    # DEBUG: Print what we're sending to the model
-    print("\n" + "=" * 70)
-    print(f"[DEBUG] Query: {query}")
-    print(f"[DEBUG] Context length: {len(context_text)} characters")
-    print(f"[DEBUG] Number of chunks: {len(retrieved_chunks)}")
-    print(f"[DEBUG] Using Gemini API with model: {model}")
-    print(f"[DEBUG] Context preview (first 300 chars):")
-    print(context_text[:300] + "...")
-    print("=" * 70 + "\n")
-    
+        return None, "Error: No valid context retrieved. Please check your retrieval system."
+
+    # What we're sending to the model (LOG_LEVEL=DEBUG LOG_SAMPLE_RATE=1 to see every prompt)
+    log.debug("Query: %s | context %d characters from %d chunks | model %s | preview: %s...",
+              query, len(context_text), len(retrieved_chunks), model or "backend default",
+              context_text[:300], extra=SAMPLED)
+
     # Build prompt(this is the system prompt that guides the model's behavior)
     # (note that gemini is more strict on safety so sometimes technical content gets blocked)
     prompt = f"""You are a technical assistant for Boeing 737 aircraft operations manuals.
@@ -85,108 +74,146 @@ Instructions:
 - Keep your answer concise and technical
 
 Answer:"""
-    
+    return prompt, None
+
+
+def _finish_reason_message(finish_reason):
+    """Return the user-facing message for a blocked finish reason, None otherwise."""
+    if finish_reason == 3:  # SAFETY
+        log.warning("Response blocked by safety filters")
+        return SAFETY_BLOCKED_MESSAGE
+
+    if finish_reason == 4:  # RECITATION
+        log.warning("Response blocked due to recitation")
+        return RECITATION_BLOCKED_MESSAGE
+
+    if finish_reason == 2:  # MAX_TOKENS
+        log.warning("Response truncated due to token limit")
+    return None
+
+
+def _error_message(error_msg, backend_name="LLM"):
+    """Turn an API error into a helpful message for the user."""
+    log.error("%s API error: %s", backend_name, error_msg)
+
+    if "API_KEY" in error_msg.upper():
+        return "Error: Invalid API key configuration."
+    elif "QUOTA" in error_msg.upper() or "RATE_LIMIT" in error_msg.upper() or "429" in error_msg:
+        return "Error: API quota exceeded. Please try again later."
+    elif "INVALID_ARGUMENT" in error_msg:
+        return f"Error: Invalid request - {error_msg}"
+    else:
+        return f"Error generating answer: {error_msg}"
+
+
+def _answer_text(text, finish_reason):
+    """The answer for a backend's (text, finish_reason), or the message explaining why there is none."""
+    log.debug("Finish reason: %s", finish_reason, extra=SAMPLED)
+    blocked = _finish_reason_message(finish_reason)
+    if blocked:
+        return blocked
+    if text:
+        log.info("Response received (%d chars)", len(text), extra=SAMPLED)
+        return text.strip()
+    if finish_reason is None:
+        log.error("No candidates in response")
+        return NO_RESPONSE_MESSAGE
+    log.error("No text in response")
+    return NO_TEXT_MESSAGE
+
+
+def answer_question(query, retrieved_chunks, model=None, backend=None):
+    """
+    Answer question based on retrieved chunks (max chunks would have equivalent
+      context length of 10 sentences), blocking until the LLM has answered.
+
+    Args:
+        query: The user's question
+        retrieved_chunks: List of dicts with 'text', 'page_number', 'score' keys
+        model: Model name, None for the backend's default
+        backend: LLMBackend to use, None for the configured one (LLM_BACKEND)
+    """
+    prompt, message = build_prompt(query, retrieved_chunks, model=model)
+    if prompt is None:
+        return message
+
+    backend = backend or get_backend()
+    try:
+        log.info("Sending request to %s (model: %s)...", backend.name, model or backend.default_model, extra=SAMPLED)
+        with span("llm_total"):
+            text, finish_reason = backend.generate_sync(prompt, model)
+    except Exception as e:
+        return _error_message(str(e) or type(e).__name__, backend.name)
+    return _answer_text(text, finish_reason)
+
+
+async def answer_question_async(query, retrieved_chunks, model=None, backend=None, route_info=None):
+    """
+    Same contract as answer_question, without blocking a thread on the LLM call.
+    Without an explicit backend the call is routed (hedging / fallback); route_info,
+    a dict, receives the route that answered.
+    """
+    prompt, message = build_prompt(query, retrieved_chunks, model=model)
+    if prompt is None:
+        return message
+
     try:
-        print(f"[INFO] Sending request to Gemini API (model: {model})...")
-        
-        # Get Gemini model
-        gemini_model = get_gemini_model(model)
-        
-        # CORRECT safety settings format - using HarmCategory and HarmBlockThreshold
-        # here changing the settings so it is less strict and allows more content through
-        # Alot of times technical content gets blocked by safety filters ,So have to run it with relaxed settings
-        # Also run it multiple times if blocked 
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_NONE"
-            }
-        ]
-        
-        # Generate response with relaxed safety settings
-        response = gemini_model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.1,
-                top_p=0.9,
-                max_output_tokens=2000,
-            ),
-            safety_settings=safety_settings
-        )
-        
-        # Handle different response scenarios
-        if not response.candidates:
-            print("[ERROR] No candidates in response")
-            return "Error: No response generated. The content may have been filtered."
-        
-        candidate = response.candidates[0]
-        
-        # Check finish reason
-        finish_reason = candidate.finish_reason
-        print(f"[DEBUG] Finish reason: {finish_reason}")
-        
-        # Finish reason values:
-        # 1 = STOP (natural completion) 
-        # 2 = MAX_TOKENS (hit token limit)
-        # 3 = SAFETY (blocked by safety)
-        # 4 = RECITATION (blocked by recitation)
-        # 5 = OTHER
-        
-        if finish_reason == 3:  # SAFETY
-            print("[WARNING] Response blocked by safety filters")
-            if hasattr(candidate, 'safety_ratings'):
-                print(f"[DEBUG] Safety ratings: {candidate.safety_ratings}")
-            return "The response was blocked by content safety filters. This appears to be a false positive for technical aviation content. Please try rephrasing your question."
-        
-        if finish_reason == 4:  # RECITATION
-            print("[WARNING] Response blocked due to recitation")
-            return "The response was blocked due to potential copyright concerns."
-        
-        if finish_reason == 2:  # MAX_TOKENS
-            print("[WARNING] Response truncated due to token limit")
-        
-        # Try to get the text
-        if hasattr(response, 'text') and response.text:
-            print(f"[INFO] Response received from Gemini ({len(response.text)} chars)\n")
-            return response.text.strip()
-        elif candidate.content and candidate.content.parts:
-            # Manually extract text from parts
-            text_parts = []
-            for part in candidate.content.parts:
-                if hasattr(part, 'text'):
-                    text_parts.append(part.text)
-            
-            if text_parts:
-                result = ''.join(text_parts).strip()
-                print(f"[INFO] Response extracted from parts ({len(result)} chars)\n")
-                return result
-        
-        print("[ERROR] No text in response")
-        print(f"[DEBUG] Response object: {response}")
-        return "Error: Unable to extract text from response. Please try again."
-        
+        with span("llm_total"):
+            if backend is not None:
+                log.info("Sending async request to %s (model: %s)...", backend.name,
+                         model or backend.default_model, extra=SAMPLED)
+                text, finish_reason = await backend.generate(prompt, model)
+            else:
+                log.info("Sending async request (model: %s)...", model or "default", extra=SAMPLED)
+                text, finish_reason = await get_router().generate(prompt, model, info=route_info)
     except Exception as e:
-        error_msg = str(e)
-        print(f"[ERROR] Gemini API error: {error_msg}")
-        
-        # Provide helpful error messages
-        if "API_KEY" in error_msg.upper():
-            return "Error: Invalid API key configuration."
-        elif "QUOTA" in error_msg.upper() or "RATE_LIMIT" in error_msg.upper():
-            return "Error: API quota exceeded. Please try again later."
-        elif "INVALID_ARGUMENT" in error_msg:
-            return f"Error: Invalid request - {error_msg}"
+        return _error_message(str(e) or type(e).__name__, backend.name if backend is not None else "LLM")
+    return _answer_text(text, finish_reason)
+
+
+async def answer_question_stream(query, retrieved_chunks, model=None, backend=None, route_info=None):
+    """
+    Async generator over the answer text as the LLM produces it.
+    Errors and blocked responses are yielded as text, like answer_question returns them,
+    possibly after part of the answer; route_info["outcome"] tells them apart once the
+    stream ends: "complete", "blocked", "error" or "no_context".
+    """
+    info = route_info if route_info is not None else {}
+    prompt, message = build_prompt(query, retrieved_chunks, model=model)
+    if prompt is None:
+        info["outcome"] = "no_context"
+        yield message
+        return
+
+    started, first_token = timer(), True
+    try:
+        if backend is not None:
+            log.info("Streaming request to %s (model: %s)...", backend.name, model or backend.default_model,
+                     extra=SAMPLED)
+            pieces = backend.stream(prompt, model)
         else:
-            return f"Error generating answer: {error_msg}"
\ No newline at end of file
+            log.info("Streaming request (model: %s)...", model or "default", extra=SAMPLED)
+            pieces = get_router().stream(prompt, model, info=route_info)
+        async for text, finish_reason in pieces:
+            blocked = _finish_reason_message(finish_reason)
+            if blocked:
+                info["outcome"] = "blocked"
+                yield blocked
+                return
+            if text:
+                if first_token:
+                    record("llm_ttft", timer() - started)
+                    first_token = False
+                yield text
+        info["outcome"] = "complete"
+
+    except Exception as e:
+        info["outcome"] = "error"
+        yield _error_message(str(e) or type(e).__name__, backend.name if backend is not None else "LLM")
+    finally:
+        record("llm_total", timer() - started)
+
+
+async def close_http_client():
+    """Close the backends' connection pools (server shutdown)."""
+    await close_backends()
@@ -0,0 +1,99 @@
+import os
+from time import time
+
+from api.embedder import load_embeddings, EMBED_STORE_DIR
+from api.ann_index import load_index
+from api.bm25 import load_bm25
+from api.store import store_exists, read_meta, lineage_id, VECTORS_FILE
+from api.corpus import CorpusLayout, corpus_exists, corpus_build_id, load_corpus, shard_dir, DEFAULT_DOC_ID
+from api.config import SHARD_WORKERS, SHARD_COUNT, SHARD_THREADS
+from api.log import get_logger
+
+# Everything a query needs from the loaded store, kept in one object so a reload
+# can swap it with a single assignment. Request handlers read the state once and
+# use that snapshot, so a query never mixes chunks of one build with vectors of another.
+
+
+class IndexState:
+    def __init__(self, chunks, embeddings_tensor, index, build_id=None, layout=None, bm25=None):
+        self.chunks = chunks
+        self.embeddings_tensor = embeddings_tensor
+        self.index = index
+        self.build_id = build_id
+        # document row ranges / pages / chapters used to resolve /ask filters
+        self.layout = layout
+        # BM25 lexical index (api/bm25.py), None when it hasn't been built
+        self.bm25 = bm25
+        self.loaded_at = time()
+
+    @property
+    def loaded(self):
+        return len(self.chunks) > 0 and self.embeddings_tensor is not None
+
+    def close(self):
+        """Stop what the state runs besides memory (the shard pool's worker processes)."""
+        if hasattr(self.index, "close"):
+            self.index.close()
+
+
+EMPTY_STATE = IndexState([], None, None)
+
+log = get_logger("index_state")
+
+
+def current_build_id(store_dir=EMBED_STORE_DIR):
+    """build_id of the store (or corpus shards) on disk; None for CSV-only setups."""
+    if corpus_exists():
+        return corpus_build_id()
+    if not store_exists(store_dir):
+        return None
+    return read_meta(store_dir).get("build_id")
+
+
+def current_lineage_id(store_dir=EMBED_STORE_DIR):
+    """Lineage of the store (or corpus shards) on disk: unchanged by incremental builds; None for CSV-only setups."""
+    if corpus_exists():
+        return corpus_build_id(lineage=True)
+    if not store_exists(store_dir):
+        return None
+    return lineage_id(read_meta(store_dir))
+
+
+def load_index_state(store_dir=EMBED_STORE_DIR):
+    """Load chunks, embeddings and the nearest-neighbour index into a new IndexState."""
+    build_id = current_build_id(store_dir)
+    lineage = current_lineage_id(store_dir)
+
+    if corpus_exists():
+        chunks, embeddings_tensor, layout, index, bm25 = load_corpus()
+        chunks.lineage_id = lineage
+        index = _sharded(index, [(os.path.join(shard_dir(doc["doc_id"]), VECTORS_FILE), doc["start"],
+                                  doc["stop"] - doc["start"]) for doc in layout.documents.values()])
+        log.info("Loaded %d chunks successfully (%s index)", len(chunks), index.kind)
+        return IndexState(chunks, embeddings_tensor, index, build_id, layout, bm25)
+
+    chunks, embeddings_tensor = load_embeddings()
+    chunks.lineage_id = lineage
+    index = load_index(store_dir, embeddings_tensor)
+    meta = read_meta(store_dir) if store_exists(store_dir) else {}
+    layout = CorpusLayout.single(chunks.page_numbers, doc_id=meta.get("doc_id", DEFAULT_DOC_ID),
+                                 title=meta.get("title"), chapters=meta.get("chapters"),
+                                 boilerplate=meta.get("boilerplate"))
+    bm25 = load_bm25(store_dir, count=len(chunks)) if store_exists(store_dir) else None
+    if store_exists(store_dir):
+        index = _sharded(index, [(os.path.join(store_dir, VECTORS_FILE), 0, len(chunks))])
+    elif SHARD_WORKERS > 0:
+        log.warning("SHARD_WORKERS needs the binary store (run convert_embeddings.py), searching in-process")
+    log.info("Loaded %d chunks successfully (%s index)", len(chunks), index.kind)
+    return IndexState(chunks, embeddings_tensor, index, build_id, layout, bm25)
+
+
+def _sharded(index, sources):
+    """The exact index as a shard pool over `sources` when SHARD_WORKERS > 0 (approximate indexes are kept)."""
+    if SHARD_WORKERS <= 0:
+        return index
+    if index.kind != "flat" and getattr(index, "shard_kinds", None) != ["flat"]:
+        log.warning("SHARD_WORKERS applies to exact search, keeping the %s index", index.kind)
+        return index
+    from api.shard_pool import ShardPool
+    return ShardPool(sources, SHARD_WORKERS, shards=SHARD_COUNT, threads=SHARD_THREADS)
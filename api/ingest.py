@@ -0,0 +1,387 @@
+import os
+import csv
+import shutil
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter as timer
+
+import numpy as np
+
+from api.document_processor import page_count, process_page_range, split_sentences, Chunker
+from api.embedder import get_model, build_store_index, build_bm25_index, EMBED_CSV_PATH, EMBED_STORE_DIR, EMBED_STORE_DTYPE
+from api.boilerplate import BoilerplateDetector
+from api.config import BOILERPLATE_MIN_FRACTION
+from api.store import (StoreWriter, store_exists, load_manifest, load_columns, swap_store_dir, content_hash, lineage_id,
+                       VECTORS_FILE)
+
+# Streaming ingestion pipeline used by build_embeddings.py:
+#   worker processes: PyMuPDF page extraction + spaCy sentencizing (nlp.pipe)
+#   main process:     chunking -> batched encoding -> incremental store/CSV writes
+# Pages flow through in small page ranges and chunks in fixed-size batches, so
+# peak memory depends on the batch sizes, not on the size of the PDF.
+#
+# Both build modes write a complete new store next to the live one and swap it in
+# at the end, so a running API can reload it (POST /admin/reload) without downtime.
+#   full:        every chunk is embedded, ids are assigned from 0
+#   incremental: chunks whose content hash is already in the store keep their id and
+#                vector; only changed / new chunks are embedded; ids of chunks that
+#                disappeared are tombstoned and never reused
+# Lines repeated on many pages (headers, footers, copyright) are recorded in meta.json
+# as 'boilerplate' so the context builder can strip them from excerpts, and the
+# chunker's settings (document_processor.Chunker) as 'chunking'.
+
+
+def _timed_page_range(path, start, stop, nlp_batch_size, skip_hashes):
+    started = timer()
+    pages = process_page_range(path, start, stop, nlp_batch_size, skip_hashes)
+    return pages, timer() - started
+
+
+def iter_pages(path, workers=None, pages_per_task=16, nlp_batch_size=32, stats=None, skip_hashes=None):
+    """
+    Yield sentence-split pages in page order, processed by a pool of worker processes.
+    At most 2 tasks per worker are in flight, so finished pages never pile up in memory.
+    Pages whose hash is in skip_hashes come back unsplit with 'unchanged': True.
+    """
+    workers = workers or os.cpu_count() or 1
+    total = page_count(path)
+    ranges = deque((start, min(start + pages_per_task, total)) for start in range(0, total, pages_per_task))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        while ranges or pending:
+            while ranges and len(pending) < 2 * workers:
+                start, stop = ranges.popleft()
+                pending.append(pool.submit(_timed_page_range, path, start, stop, nlp_batch_size, skip_hashes))
+            pages, seconds = pending.popleft().result()
+            if stats is not None:
+                stats["pages"] += len(pages)
+                stats["extract_seconds"] += seconds
+            yield from pages
+
+
+def iter_chunks(pages, chunker):
+    """Chunk pages as they arrive (a chunk continued across a page break comes with the later page)."""
+    for page in pages:
+        yield from chunker.add_page(page)
+    yield from chunker.flush()
+
+
+def iter_chunk_batches(pages, batch_size=256, chunker=None):
+    """Chunk pages as they arrive and yield chunks (with global chunk ids) in fixed-size batches."""
+    batch = []
+    next_id = 0
+    for chunk in iter_chunks(pages, chunker or Chunker()):
+        chunk["chunk_id"] = next_id
+        next_id += 1
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _CsvSink:
+    """Streams rows to chunks.csv in the original format (a no-op when disabled)."""
+
+    def __init__(self, csv_path, enabled=True):
+        self._file = None
+        if enabled:
+            os.makedirs(os.path.dirname(os.path.abspath(csv_path)), exist_ok=True)
+            self._file = open(csv_path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(["chunk_id", "page_number", "text", "embedding"])
+
+    def write(self, chunk_ids, page_numbers, texts, vectors):
+        if self._file is None:
+            return
+        for chunk_id, page, text, emb in zip(chunk_ids, page_numbers, texts, vectors):
+            self._writer.writerow([chunk_id, page, text, ",".join(map(lambda x: f"{x:.8f}", emb))])
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def _fresh_build_dir(store_dir):
+    """Scratch directory the new store is written to before it is swapped in."""
+    build_dir = store_dir + ".building"
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)  # left over from an interrupted build
+    return build_dir
+
+
+def _encode(model, texts, model_batch_size):
+    return model.encode(texts, batch_size=model_batch_size, convert_to_numpy=True, device="cpu")
+
+
+def _new_stats():
+    return {"pages": 0, "chunks": 0, "extract_seconds": 0.0, "encode_seconds": 0.0, "write_seconds": 0.0,
+            "embedded": 0, "reused": 0, "removed": 0, "pages_unchanged": 0}
+
+
+def _finish_stats(stats, started, workers, chunker):
+    stats["chunking"] = {**chunker.describe(), **chunker.stats}
+    stats["wall_seconds"] = timer() - started
+    stats["workers"] = workers
+    stats["pages_per_second"] = stats["pages"] / stats["wall_seconds"]
+    stats["chunks_per_second"] = stats["chunks"] / stats["wall_seconds"]
+    # per-stage rates: extraction runs in `workers` processes in parallel
+    stats["extract_pages_per_second"] = stats["pages"] * workers / max(stats["extract_seconds"], 1e-9)
+    stats["encode_chunks_per_second"] = stats["embedded"] / max(stats["encode_seconds"], 1e-9)
+    stats["write_chunks_per_second"] = stats["chunks"] / max(stats["write_seconds"], 1e-9)
+    return stats
+
+
+def _with_boilerplate(extra_meta, detector, chunker):
+    patterns = detector.patterns()
+    print(f"[INFO] {len(patterns)} boilerplate line(s) detected across {detector.pages} pages")
+    return {**(extra_meta or {}), "boilerplate": patterns, "chunking": chunker.describe()}
+
+
+def run_ingestion(pdf_path, store_dir=EMBED_STORE_DIR, csv_path=EMBED_CSV_PATH, dtype=EMBED_STORE_DTYPE,
+                  workers=None, pages_per_task=16, nlp_batch_size=32, encode_batch_size=256,
+                  model_batch_size=64, write_csv=True, build_index=True, extra_meta=None, chunker=None):
+    """
+    Build the embedding store (and optionally the CSV) from a PDF in one streaming pass.
+    extra_meta is written to the store's meta.json (document id, title, chapters).
+    chunker defaults to a Chunker with the CHUNK_* settings.
+
+    Returns:
+        Dict of per-stage counts, timings and throughput
+    """
+    stats = _new_stats()
+    boilerplate = BoilerplateDetector(min_fraction=BOILERPLATE_MIN_FRACTION)
+    model = get_model()
+    # chunk lengths in the model's own tokens, so no chunk is truncated when embedded
+    chunker = (chunker or Chunker()).use_tokenizer(model)
+    workers = workers or os.cpu_count() or 1
+    build_dir = _fresh_build_dir(store_dir)
+    writer = None
+    sink = _CsvSink(csv_path, enabled=write_csv)
+    page_hashes = {}
+    started = timer()
+
+    def track_pages(pages):
+        for page in pages:
+            page_hashes[page["page_number"]] = page["page_hash"]
+            boilerplate.add(page["lines"])
+            yield page
+
+    try:
+        pages = iter_pages(pdf_path, workers=workers, pages_per_task=pages_per_task,
+                           nlp_batch_size=nlp_batch_size, stats=stats)
+        for batch in iter_chunk_batches(track_pages(pages), batch_size=encode_batch_size, chunker=chunker):
+            texts = [c["text"] for c in batch]
+            chunk_ids = [c["chunk_id"] for c in batch]
+            page_numbers = [c["page_number"] for c in batch]
+
+            t0 = timer()
+            vectors = _encode(model, texts, model_batch_size)
+            t1 = timer()
+
+            if writer is None:
+                writer = StoreWriter(build_dir, dim=vectors.shape[1], dtype=dtype)
+            writer.append(vectors, chunk_ids=chunk_ids, page_numbers=page_numbers, texts=texts)
+            sink.write(chunk_ids, page_numbers, texts, vectors)
+            t2 = timer()
+
+            stats["chunks"] += len(batch)
+            stats["embedded"] += len(batch)
+            stats["encode_seconds"] += t1 - t0
+            stats["write_seconds"] += t2 - t1
+            print(f"[INFO] {stats['pages']} pages, {stats['chunks']} chunks embedded")
+    finally:
+        sink.close()
+
+    if writer is None:
+        raise ValueError(f"No text chunks extracted from {pdf_path}")
+    t0 = timer()
+    writer.close(page_hashes=page_hashes, tombstones=set(),
+                 extra_meta=_with_boilerplate(extra_meta, boilerplate, chunker))
+    stats["write_seconds"] += timer() - t0
+
+    if build_index:
+        build_store_index(build_dir)
+        build_bm25_index(build_dir)
+    swap_store_dir(build_dir, store_dir)
+    return _finish_stats(stats, started, workers, chunker)
+
+
+def run_incremental_ingestion(pdf_path, store_dir=EMBED_STORE_DIR, csv_path=EMBED_CSV_PATH, dtype=None,
+                              workers=None, pages_per_task=16, nlp_batch_size=32, encode_batch_size=256,
+                              model_batch_size=64, write_csv=True, build_index=True, extra_meta=None,
+                              chunker=None):
+    """
+    Re-index a revised PDF against an existing store, embedding only changed or new chunks.
+    Falls back to a full build when there is no store yet. When the chunker continues
+    chunks across pages, every page is re-chunked (a page's chunks depend on its
+    neighbours), but unchanged chunks still keep their ids and vectors.
+
+    Returns:
+        Same stats as run_ingestion, with 'embedded', 'reused', 'removed' and
+        'pages_unchanged' showing how much work was skipped
+    """
+    if not store_exists(store_dir):
+        print(f"[INFO] No store at {store_dir}, running a full build")
+        return run_ingestion(pdf_path, store_dir, csv_path, dtype or EMBED_STORE_DTYPE, workers,
+                             pages_per_task, nlp_batch_size, encode_batch_size, model_batch_size,
+                             write_csv, build_index, extra_meta, chunker)
+
+    stats = _new_stats()
+    # the model's tokenizer measures the chunks, so the model is loaded even when nothing changed
+    model = get_model()
+    chunker = (chunker or Chunker()).use_tokenizer(model)
+    workers = workers or os.cpu_count() or 1
+    started = timer()
+
+    manifest = load_manifest(store_dir)
+    meta = manifest["meta"]
+    old_vectors = np.load(os.path.join(store_dir, VECTORS_FILE), mmap_mode="r")
+    old_ids, old_pages = manifest["chunk_ids"], manifest["page_numbers"]
+    _, _, old_offsets, old_blob = load_columns(store_dir)
+
+    def old_text(row):
+        return old_blob[old_offsets[row]:old_offsets[row + 1]].decode("utf-8")
+
+    # old rows by chunk content hash, and old page numbers by page content hash
+    rows_by_hash = defaultdict(deque)
+    for row, h in enumerate(manifest["chunk_hashes"]):
+        rows_by_hash[h].append(row)
+    rows_by_page = defaultdict(list)
+    for row, page in enumerate(old_pages.tolist()):
+        rows_by_page[page].append(row)
+    pages_by_hash = defaultdict(deque)
+    # reusing a page's chunks wholesale needs the same chunker, and chunks that stay within their page
+    if not chunker.cross_page and manifest["meta"].get("chunking") == chunker.describe():
+        for page, h in sorted(manifest["page_hashes"].items()):
+            pages_by_hash[h].append(page)
+
+    claimed = np.zeros(len(old_ids), dtype=bool)
+    next_id = manifest["next_chunk_id"]
+    page_hashes = {}
+    boilerplate = BoilerplateDetector(min_fraction=BOILERPLATE_MIN_FRACTION)
+
+    build_dir = _fresh_build_dir(store_dir)
+    writer = StoreWriter(build_dir, dim=meta["dim"], dtype=dtype or meta["dtype"])
+    sink = _CsvSink(csv_path, enabled=write_csv)
+    pending = []  # (chunk_id, page_number, text, old_row or None)
+
+    def claim_chunk(text):
+        queue = rows_by_hash.get(content_hash(text))
+        while queue:
+            row = queue.popleft()
+            if not claimed[row]:
+                claimed[row] = True
+                return row
+        return None
+
+    def claim_page(h):
+        """Old rows of an identical, not yet reused page, or None."""
+        queue = pages_by_hash.get(h)
+        while queue:
+            rows = rows_by_page.get(queue.popleft(), [])
+            if not claimed[rows].any():
+                claimed[rows] = True
+                return rows
+        return None
+
+    def add_chunk(chunk):
+        nonlocal next_id
+        row = claim_chunk(chunk["text"])
+        if row is not None:
+            chunk_id = int(old_ids[row])
+        else:
+            chunk_id = next_id
+            next_id += 1
+        pending.append((chunk_id, chunk["page_number"], chunk["text"], row))
+        if len(pending) >= encode_batch_size:
+            flush()
+
+    def flush():
+        if not pending:
+            return
+        new_rows = [i for i, item in enumerate(pending) if item[3] is None]
+        vectors = np.empty((len(pending), meta["dim"]), dtype=np.float32)
+
+        t0 = timer()
+        if new_rows:
+            vectors[new_rows] = _encode(model, [pending[i][2] for i in new_rows], model_batch_size)
+        reused = [i for i, item in enumerate(pending) if item[3] is not None]
+        if reused:
+            vectors[reused] = old_vectors[[pending[i][3] for i in reused]]
+        t1 = timer()
+
+        chunk_ids, page_numbers, texts, _ = zip(*pending)
+        writer.append(vectors, chunk_ids=chunk_ids, page_numbers=page_numbers, texts=texts)
+        sink.write(chunk_ids, page_numbers, texts, vectors)
+        t2 = timer()
+
+        stats["chunks"] += len(pending)
+        stats["embedded"] += len(new_rows)
+        stats["reused"] += len(reused)
+        stats["encode_seconds"] += t1 - t0
+        stats["write_seconds"] += t2 - t1
+        pending.clear()
+
+    try:
+        pages = iter_pages(pdf_path, workers=workers, pages_per_task=pages_per_task,
+                           nlp_batch_size=nlp_batch_size, stats=stats, skip_hashes=set(pages_by_hash))
+        for page in pages:
+            page_hashes[page["page_number"]] = page["page_hash"]
+            boilerplate.add(page["lines"])
+
+            if page.get("unchanged"):
+                rows = claim_page(page["page_hash"])
+                if rows is not None:
+                    # identical page: keep its chunks (ids, vectors), only the page number may move
+                    stats["pages_unchanged"] += 1
+                    for row in rows:
+                        pending.append((int(old_ids[row]), page["page_number"], old_text(row), row))
+                    if len(pending) >= encode_batch_size:
+                        flush()
+                    continue
+                # the identical old page was already reused (duplicate pages); split this one here
+                page = split_sentences([page])[0]
+
+            for chunk in chunker.add_page(page):
+                add_chunk(chunk)
+        for chunk in chunker.flush():
+            add_chunk(chunk)
+        flush()
+    finally:
+        sink.close()
+
+    removed = {int(i) for i in old_ids[~claimed]}
+    stats["removed"] = len(removed)
+
+    t0 = timer()
+    # unchanged chunks kept their ids, so the new store continues the old one's lineage
+    writer.close(page_hashes=page_hashes, tombstones=manifest["tombstones"] | removed, next_chunk_id=next_id,
+                 extra_meta=_with_boilerplate({**(extra_meta or {}), "lineage_id": lineage_id(meta)},
+                                              boilerplate, chunker))
+    stats["write_seconds"] += timer() - t0
+
+    if build_index:
+        build_store_index(build_dir)
+        build_bm25_index(build_dir)
+    swap_store_dir(build_dir, store_dir)
+    return _finish_stats(stats, started, workers, chunker)
+
+
+def print_ingestion_report(stats):
+    print("\n[REPORT] Ingestion throughput")
+    print(f"  extract + sentencize : {stats['pages']} pages, {stats['extract_pages_per_second']:.1f} pages/s "
+          f"({stats['workers']} workers)")
+    print(f"  encode               : {stats['embedded']} chunks, {stats['encode_chunks_per_second']:.1f} chunks/s")
+    print(f"  write                : {stats['chunks']} chunks, {stats['write_chunks_per_second']:.1f} chunks/s")
+    if stats["reused"] or stats["removed"] or stats["pages_unchanged"]:
+        print(f"  incremental          : {stats['pages_unchanged']} pages unchanged, {stats['reused']} chunks reused, "
+              f"{stats['embedded']} embedded, {stats['removed']} removed")
+    chunking = stats["chunking"]
+    print(f"  chunking             : {chunking['strategy']}, {chunking['toc_pages']} contents pages "
+          f"({chunking['toc_mode']}), {chunking['leaders_removed']} dot leaders removed, "
+          f"{chunking['cross_page_chunks']} chunks across pages")
+    print(f"  end to end           : {stats['wall_seconds']:.1f}s, {stats['pages_per_second']:.1f} pages/s, "
+          f"{stats['chunks_per_second']:.1f} chunks/s")
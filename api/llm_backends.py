@@ -0,0 +1,428 @@
+import json
+import random
+import asyncio
+import threading
+import time
+
+import httpx
+
+from api.config import (GEMINI_API_KEY, GEMINI_API_ENDPOINT, DEFAULT_GEMINI_API_ENDPOINT, GEMINI_MODEL,
+                        OPENAI_BASE_URL, OPENAI_API_KEY, OPENAI_MODEL, LLM_BACKEND, LLM_TIMEOUT_SECONDS,
+                        LLM_MAX_CONNECTIONS, LLM_MAX_CONCURRENCY, LLM_MAX_RETRIES, LLM_RETRY_BASE_SECONDS,
+                        LLM_RETRY_MAX_SECONDS)
+from api.log import get_logger, SAMPLED
+
+# LLM backends behind generator.py.
+#   gemini - Gemini REST API over a pooled async client (async path) or the
+#            google-generativeai SDK (blocking path, ASYNC_LLM=0)
+#   openai - any OpenAI-compatible /chat/completions server: Ollama (OLLAMA_URL/v1),
+#            vLLM, llama.cpp, OpenAI itself, or benchmarks/fake_llm_server.py
+# Every backend owns one keep-alive connection pool and caps its in-flight calls at
+# LLM_MAX_CONCURRENCY (callers queue instead of piling onto a rate-limited API).
+# Quota / rate-limit / overload errors (429, 5xx, connection failures) are retried up
+# to LLM_MAX_RETRIES times with full-jitter exponential backoff, honouring Retry-After.
+# A streamed answer is only retried until its first token has been sent.
+#
+# Backends return (text, finish_reason) with the finish reason codes below; errors
+# are raised as LLMError and turned into user-facing messages by generator.py.
+
+log = get_logger("llm_backends")
+
+# Finish reason values:
+# 1 = STOP (natural completion)
+# 2 = MAX_TOKENS (hit token limit)
+# 3 = SAFETY (blocked by safety)
+# 4 = RECITATION (blocked by recitation)
+# 5 = OTHER
+# The Gemini REST API reports the same values by name
+FINISH_REASON_CODES = {
+    "STOP": 1,
+    "MAX_TOKENS": 2,
+    "SAFETY": 3,
+    "RECITATION": 4,
+    "OTHER": 5,
+}
+# OpenAI-compatible finish reasons mapped onto the same codes
+OPENAI_FINISH_REASONS = {"stop": 1, "length": 2, "content_filter": 3}
+
+# here changing the settings so it is less strict and allows more content through
+# Alot of times technical content gets blocked by safety filters ,So have to run it with relaxed settings
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_NONE"
+    }
+]
+
+GENERATION_CONFIG = {
+    "temperature": 0.1,
+    "top_p": 0.9,
+    "max_output_tokens": 2000,
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# SDK errors only carry a message; these markers identify the retryable ones
+RETRY_MARKERS = ("429", "QUOTA", "RATE_LIMIT", "RATE LIMIT", "RESOURCE_EXHAUSTED", "503", "UNAVAILABLE", "OVERLOADED")
+
+
+class LLMError(Exception):
+    """A failed LLM call; status is the HTTP status when there was a response."""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _is_retryable(error):
+    if isinstance(error, LLMError) and error.status is not None:
+        return error.status in RETRY_STATUSES
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)):
+        return True
+    message = str(error).upper()
+    return any(marker in message for marker in RETRY_MARKERS)
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _http_error(response, body):
+    return LLMError(f"{response.status_code} {body}", status=response.status_code, retry_after=_retry_after(response))
+
+
+class LLMBackend:
+    """Concurrency limit, timeouts and retries shared by all backends; subclasses do one call."""
+
+    name = None
+
+    def __init__(self, default_model, max_concurrency=LLM_MAX_CONCURRENCY, timeout=LLM_TIMEOUT_SECONDS,
+                 max_retries=LLM_MAX_RETRIES, retry_base=LLM_RETRY_BASE_SECONDS, retry_max=LLM_RETRY_MAX_SECONDS,
+                 max_connections=LLM_MAX_CONNECTIONS):
+        self.default_model = default_model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.max_connections = max_connections
+        self._async_client = None
+        self._sync_client = None
+        self._semaphore = None
+        self._sync_semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._in_flight = 0
+        self._counters = {"calls": 0, "retries": 0, "errors": 0, "timeouts": 0}
+
+    # connection pools -----------------------------------------------------
+
+    def _client_options(self):
+        return dict(
+            timeout=httpx.Timeout(self.timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+        )
+
+    def http_client(self):
+        """Shared keep-alive async HTTP client (created lazily on the running loop)."""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(**self._client_options())
+        return self._async_client
+
+    def sync_http_client(self):
+        if self._sync_client is None:
+            self._sync_client = httpx.Client(**self._client_options())
+        return self._sync_client
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
+        self._semaphore = None
+
+    def _limit(self):
+        # created on first use, so it belongs to the serving loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _backoff(self, attempt, error):
+        """Full jitter: uniform(0, base * 2^attempt), at least Retry-After, capped at retry_max."""
+        delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+        if getattr(error, "retry_after", None):
+            delay = max(delay, error.retry_after)
+        return min(delay, self.retry_max)
+
+    def _should_retry(self, attempt, error):
+        if attempt >= self.max_retries or not _is_retryable(error):
+            self._counters["errors"] += 1
+            return False
+        self._counters["retries"] += 1
+        log.warning("%s call failed (%s), retry %d/%d", self.name, str(error)[:120] or type(error).__name__,
+                    attempt + 1, self.max_retries)
+        return True
+
+    # public calls ---------------------------------------------------------
+
+    async def generate(self, prompt, model=None):
+        """(text, finish_reason) of one answer, retried on retryable errors."""
+        model = model or self.default_model
+        async with self._limit():
+            self._in_flight += 1
+            try:
+                for attempt in range(self.max_retries + 1):
+                    self._counters["calls"] += 1
+                    try:
+                        # httpx timeouts are per read; this bounds the whole call
+                        return await asyncio.wait_for(self._generate(prompt, model), self.timeout)
+                    except asyncio.TimeoutError:
+                        self._counters["timeouts"] += 1
+                        self._counters["errors"] += 1
+                        raise LLMError(f"{self.name} call timed out after {self.timeout:g}s")
+                    except Exception as e:
+                        if not self._should_retry(attempt, e):
+                            raise
+                        await asyncio.sleep(self._backoff(attempt, e))
+            finally:
+                self._in_flight -= 1
+
+    async def stream(self, prompt, model=None):
+        """Async generator of (text, finish_reason) pieces; retried only before the first piece."""
+        model = model or self.default_model
+        async with self._limit():
+            self._in_flight += 1
+            try:
+                for attempt in range(self.max_retries + 1):
+                    self._counters["calls"] += 1
+                    started = False
+                    try:
+                        async for piece in self._stream(prompt, model):
+                            started = True
+                            yield piece
+                        return
+                    except Exception as e:
+                        if started or not self._should_retry(attempt, e):
+                            raise
+                        await asyncio.sleep(self._backoff(attempt, e))
+            finally:
+                self._in_flight -= 1
+
+    def generate_sync(self, prompt, model=None):
+        """Blocking generate, for the threadpool path (ASYNC_LLM=0)."""
+        model = model or self.default_model
+        with self._sync_semaphore:
+            for attempt in range(self.max_retries + 1):
+                self._counters["calls"] += 1
+                try:
+                    return self._generate_sync(prompt, model)
+                except Exception as e:
+                    if not self._should_retry(attempt, e):
+                        raise
+                    time.sleep(self._backoff(attempt, e))
+
+    def stats(self):
+        return {"backend": self.name, "default_model": self.default_model, "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency, **self._counters}
+
+    # one call, implemented by the backends --------------------------------
+
+    async def _generate(self, prompt, model):
+        raise NotImplementedError
+
+    def _stream(self, prompt, model):
+        raise NotImplementedError
+
+    def _generate_sync(self, prompt, model):
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key=GEMINI_API_KEY, endpoint=GEMINI_API_ENDPOINT, default_model=GEMINI_MODEL, **kwargs):
+        super().__init__(default_model, **kwargs)
+        self.api_key = api_key
+        self.endpoint = endpoint.rstrip("/")
+        self._genai = None
+        self._generation_config = None
+        self._models = {}
+        # built once instead of on every call
+        self._request_template = {
+            "generationConfig": {
+                "temperature": GENERATION_CONFIG["temperature"],
+                "topP": GENERATION_CONFIG["top_p"],
+                "maxOutputTokens": GENERATION_CONFIG["max_output_tokens"],
+            },
+            "safetySettings": SAFETY_SETTINGS,
+        }
+
+    def _url(self, model, action):
+        return f"{self.endpoint}/v1beta/models/{model}:{action}"
+
+    def _body(self, prompt):
+        return {"contents": [{"role": "user", "parts": [{"text": prompt}]}], **self._request_template}
+
+    @staticmethod
+    def _candidate(payload):
+        """Return (text, finish_reason code) of the first candidate of a REST response."""
+        candidates = payload.get("candidates") or []
+        if not candidates:
+            return "", None
+        candidate = candidates[0]
+        parts = (candidate.get("content") or {}).get("parts") or []
+        text = "".join(part.get("text", "") for part in parts)
+        return text, FINISH_REASON_CODES.get(candidate.get("finishReason"))
+
+    async def _generate(self, prompt, model):
+        response = await self.http_client().post(self._url(model, "generateContent"),
+                                                 params={"key": self.api_key}, json=self._body(prompt))
+        if response.status_code != 200:
+            raise _http_error(response, response.text)
+        return self._candidate(response.json())
+
+    async def _stream(self, prompt, model):
+        async with self.http_client().stream("POST", self._url(model, "streamGenerateContent"),
+                                             params={"key": self.api_key, "alt": "sse"},
+                                             json=self._body(prompt)) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", "replace")
+                raise _http_error(response, body)
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    yield self._candidate(json.loads(line[len("data:"):]))
+
+    def _sdk(self):
+        if self._genai is None:
+            import google.generativeai as genai
+            if self.endpoint != DEFAULT_GEMINI_API_ENDPOINT:
+                # the SDK only supports custom endpoints over its REST transport
+                genai.configure(api_key=self.api_key, transport="rest",
+                                client_options={"api_endpoint": self.endpoint})
+            else:
+                genai.configure(api_key=self.api_key)
+            self._generation_config = genai.types.GenerationConfig(**GENERATION_CONFIG)
+            self._genai = genai
+        return self._genai
+
+    def _sdk_model(self, model):
+        if model not in self._models:
+            log.info("Loading Gemini model: %s", model)
+            self._models[model] = self._sdk().GenerativeModel(model)
+        return self._models[model]
+
+    def _generate_sync(self, prompt, model):
+        response = self._sdk_model(model).generate_content(
+            prompt, generation_config=self._generation_config, safety_settings=SAFETY_SETTINGS)
+        if not response.candidates:
+            return "", None
+        candidate = response.candidates[0]
+        finish_reason = int(candidate.finish_reason)
+        if finish_reason == 3 and hasattr(candidate, "safety_ratings"):
+            log.debug("Safety ratings: %s", candidate.safety_ratings, extra=SAMPLED)
+        parts = candidate.content.parts if candidate.content else []
+        return "".join(part.text for part in parts if hasattr(part, "text")), finish_reason
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    name = "openai"
+
+    def __init__(self, base_url=OPENAI_BASE_URL, api_key=OPENAI_API_KEY, default_model=OPENAI_MODEL, **kwargs):
+        super().__init__(default_model, **kwargs)
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    def _body(self, prompt, model, stream=False):
+        return {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": GENERATION_CONFIG["temperature"],
+            "top_p": GENERATION_CONFIG["top_p"],
+            "max_tokens": GENERATION_CONFIG["max_output_tokens"],
+            "stream": stream,
+        }
+
+    @staticmethod
+    def _choice(payload, key):
+        choices = payload.get("choices") or []
+        if not choices:
+            return "", None
+        choice = choices[0]
+        text = (choice.get(key) or {}).get("content") or ""
+        return text, OPENAI_FINISH_REASONS.get(choice.get("finish_reason"), 5 if choice.get("finish_reason") else None)
+
+    async def _generate(self, prompt, model):
+        response = await self.http_client().post(f"{self.base_url}/chat/completions", headers=self.headers,
+                                                 json=self._body(prompt, model))
+        if response.status_code != 200:
+            raise _http_error(response, response.text)
+        return self._choice(response.json(), "message")
+
+    async def _stream(self, prompt, model):
+        async with self.http_client().stream("POST", f"{self.base_url}/chat/completions", headers=self.headers,
+                                             json=self._body(prompt, model, stream=True)) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", "replace")
+                raise _http_error(response, body)
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    return
+                yield self._choice(json.loads(data), "delta")
+
+    def _generate_sync(self, prompt, model):
+        response = self.sync_http_client().post(f"{self.base_url}/chat/completions", headers=self.headers,
+                                                json=self._body(prompt, model))
+        if response.status_code != 200:
+            raise _http_error(response, response.text)
+        return self._choice(response.json(), "message")
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "openai": OpenAICompatibleBackend,
+    "ollama": OpenAICompatibleBackend,  # Ollama serves the OpenAI API under /v1
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name=None):
+    """The shared backend instance for a name (default LLM_BACKEND)."""
+    name = (name or LLM_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend {name!r}, expected one of {sorted(BACKENDS)}")
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = BACKENDS[name]()
+            log.info("LLM backend: %s (model %s, max %d concurrent calls)", name,
+                     _backends[name].default_model, _backends[name].max_concurrency)
+        return _backends[name]
+
+
+def backend_stats():
+    return [backend.stats() for backend in _backends.values()]
+
+
+async def close_backends():
+    for backend in list(_backends.values()):
+        await backend.aclose()
@@ -0,0 +1,273 @@
+import asyncio
+import threading
+from time import perf_counter as timer
+
+import numpy as np
+
+from api.llm_backends import get_backend, BACKENDS
+from api.log import get_logger
+from api.config import (LLM_BACKEND, LLM_FALLBACK_ROUTES, LLM_HEDGE, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES,
+                        LLM_HEDGE_DEFAULT_SECONDS, LLM_HEDGE_MIN_SECONDS)
+
+# Hedging and fallback across LLM routes (a route = backend + model).
+# A request goes to its primary route first. The secondary route is
+#   hedged:       started as well when the primary has produced no token by the
+#                 primary's LLM_HEDGE_PERCENTILE time-to-first-token (from its own
+#                 latency histogram); whichever produces the first usable token
+#                 wins and the other call is cancelled
+#   a fallback:   started when the primary is blocked (finish reason SAFETY /
+#                 RECITATION) or fails after its backend's retries (quota, 5xx, ...)
+# Further routes in LLM_FALLBACK_ROUTES are tried in order the same way.
+# Latency histograms are kept per route for time-to-first-token and total time;
+# counts decay so the deadlines follow the current behaviour of each model.
+
+BLOCKED_FINISH_REASONS = (3, 4)  # SAFETY, RECITATION
+log = get_logger("llm_router")
+_END = object()
+
+
+class LatencyHistogram:
+    """Log-spaced latency buckets (5 ms .. ~80 s) with exponential decay of old observations."""
+
+    BOUNDS = np.geomspace(0.005, 80.0, 57)
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.counts = np.zeros(len(self.BOUNDS) + 1)
+        self.observed = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[np.searchsorted(self.BOUNDS, seconds)] += 1
+            self.observed += 1
+            if self.counts.sum() > self.window:
+                self.counts *= 0.5
+
+    def count(self):
+        return float(self.counts.sum())
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile, None without observations."""
+        with self._lock:
+            total = self.counts.sum()
+            if not total:
+                return None
+            bucket = int(np.searchsorted(np.cumsum(self.counts), total * q / 100.0))
+        return float(self.BOUNDS[min(bucket, len(self.BOUNDS) - 1)])
+
+
+class Route:
+    def __init__(self, backend_name, model):
+        self.backend = get_backend(backend_name)
+        self.model = model or self.backend.default_model
+        self.key = f"{self.backend.name}:{self.model}"
+        self.ttft = LatencyHistogram()
+        self.total = LatencyHistogram()
+        self.counters = {"attempts": 0, "wins": 0, "hedges": 0, "hedge_wins": 0, "blocked": 0, "errors": 0}
+
+    def hedge_deadline(self):
+        """Seconds to wait for the first token before hedging, None to not hedge yet."""
+        p = self.ttft.percentile(LLM_HEDGE_PERCENTILE) if self.ttft.count() >= LLM_HEDGE_MIN_SAMPLES else None
+        if p is None:
+            p = LLM_HEDGE_DEFAULT_SECONDS or None
+        return max(p, LLM_HEDGE_MIN_SECONDS) if p is not None else None
+
+    def stats(self):
+        return {"route": self.key, **self.counters,
+                "ttft_p50": self.ttft.percentile(50), "ttft_p95": self.ttft.percentile(95),
+                "total_p50": self.total.percentile(50), "total_p95": self.total.percentile(95)}
+
+
+def parse_routes(spec):
+    """'gemini:gemini-2.0-flash,openai:llama3.1' -> [(backend, model), ...] (model may be empty)."""
+    routes = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        backend, _, model = item.partition(":")
+        routes.append((backend.strip(), model.strip() or None))
+    return routes
+
+
+class _Attempt:
+    """One route's streamed call running as a task; pieces are handed over through a queue."""
+
+    def __init__(self, route, prompt, hedge=False):
+        self.route = route
+        self.hedge = hedge
+        self.status = None  # "ok" | "blocked" | "error" once the first piece (or failure) is in
+        self.error = None
+        self.blocked_piece = None
+        self.first = asyncio.Event()
+        self.queue = asyncio.Queue()
+        self.started = timer()
+        route.counters["attempts"] += 1
+        if hedge:
+            route.counters["hedges"] += 1
+        self.task = asyncio.get_running_loop().create_task(self._run(prompt))
+        self.waiter = asyncio.get_running_loop().create_task(self.first.wait())
+
+    async def _run(self, prompt):
+        started = self.started
+        try:
+            async for text, finish_reason in self.route.backend.stream(prompt, self.route.model):
+                if self.status is None:
+                    if finish_reason in BLOCKED_FINISH_REASONS:
+                        self.status, self.blocked_piece = "blocked", (text, finish_reason)
+                        self.route.counters["blocked"] += 1
+                        return
+                    if not text and finish_reason is None:
+                        continue
+                    self.status = "ok"
+                    self.route.ttft.observe(timer() - started)
+                    self.first.set()
+                await self.queue.put((text, finish_reason))
+            if self.status is None:
+                self.status = "ok"  # empty answer; generator reports it
+            self.route.total.observe(timer() - started)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.error = e
+            if self.status is None:
+                self.status = "error"
+                self.route.counters["errors"] += 1
+        finally:
+            self.first.set()
+            self.queue.put_nowait(_END)
+
+    def cancel(self):
+        self.task.cancel()
+        self.waiter.cancel()
+
+
+class LLMRouter:
+    def __init__(self, primary_backend=LLM_BACKEND, fallback_spec=LLM_FALLBACK_ROUTES, hedge=LLM_HEDGE):
+        self.primary_backend = primary_backend
+        self.fallbacks = parse_routes(fallback_spec)
+        for backend_name, _ in self.fallbacks:
+            if backend_name.lower() not in BACKENDS:
+                raise ValueError(f"Unknown LLM backend {backend_name!r} in LLM_FALLBACK_ROUTES")
+        self.hedge = hedge
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def _route(self, backend_name, model):
+        backend = get_backend(backend_name)
+        key = f"{backend.name}:{model or backend.default_model}"
+        with self._lock:
+            if key not in self._routes:
+                self._routes[key] = Route(backend_name, model)
+            return self._routes[key]
+
+    def routes_for(self, model=None):
+        """Primary route for the requested model, then the configured fallbacks (deduplicated)."""
+        routes = [self._route(self.primary_backend, model)]
+        for backend_name, fallback_model in self.fallbacks:
+            route = self._route(backend_name, fallback_model)
+            if route not in routes:
+                routes.append(route)
+        return routes
+
+    async def stream(self, prompt, model=None, info=None):
+        """
+        Async generator of (text, finish_reason) pieces from the winning route.
+        info (a dict) is filled with the route that answered and whether it was a hedge / fallback.
+        """
+        pending = self.routes_for(model)
+        info = info if info is not None else {}
+        info.update(route=None, hedged=False, fallbacks=0)
+        active, failure = [], None
+
+        def launch(hedge=False):
+            active.append(_Attempt(pending.pop(0), prompt, hedge=hedge))
+
+        launch()
+        winner = None
+        try:
+            while winner is None:
+                if not active:
+                    if not pending:
+                        break
+                    info["fallbacks"] += 1
+                    launch()
+                timeout = None
+                if self.hedge and pending and len(active) == 1 and not info["hedged"]:
+                    deadline = active[0].route.hedge_deadline()
+                    if deadline is not None:
+                        timeout = max(0.0, active[0].started + deadline - timer())
+                done, _ = await asyncio.wait([a.waiter for a in active], timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # the running route is slow to start: race the next route against it
+                    info["hedged"] = True
+                    launch(hedge=True)
+                    continue
+                for attempt in [a for a in active if a.waiter in done]:
+                    active.remove(attempt)
+                    if attempt.status == "ok":
+                        winner = attempt
+                        break
+                    failure = attempt
+                    log.warning("LLM route %s %s, trying the next one", attempt.route.key,
+                                "blocked" if attempt.status == "blocked" else "failed")
+
+            for attempt in active:
+                attempt.cancel()
+            active.clear()
+
+            if winner is None:
+                # every route failed: surface the last outcome like a single backend would
+                info["route"] = failure.route.key if failure else None
+                if failure is not None and failure.status == "blocked":
+                    yield failure.blocked_piece
+                    return
+                raise failure.error if failure is not None and failure.error else RuntimeError("No LLM route answered")
+
+            winner.route.counters["wins"] += 1
+            if winner.hedge:
+                winner.route.counters["hedge_wins"] += 1
+            info["route"] = winner.route.key
+            while True:
+                piece = await winner.queue.get()
+                if piece is _END:
+                    break
+                yield piece
+            if winner.error is not None:
+                raise winner.error
+        finally:
+            for attempt in active + ([winner] if winner is not None else []):
+                attempt.cancel()
+
+    async def generate(self, prompt, model=None, info=None):
+        """(text, finish_reason) of the winning route."""
+        if len(self.routes_for(model)) == 1:
+            # nothing to hedge or fall back to: plain call
+            route = self.routes_for(model)[0]
+            started = timer()
+            text, finish_reason = await route.backend.generate(prompt, route.model)
+            route.total.observe(timer() - started)
+            if info is not None:
+                info.update(route=route.key, hedged=False, fallbacks=0)
+            return text, finish_reason
+        parts, finish_reason = [], None
+        async for text, reason in self.stream(prompt, model, info):
+            parts.append(text)
+            finish_reason = reason or finish_reason
+        return "".join(parts), finish_reason
+
+    def stats(self):
+        return [route.stats() for route in self._routes.values()]
+
+
+_router = None
+
+
+def get_router():
+    global _router
+    if _router is None:
+        _router = LLMRouter()
+        if _router.fallbacks:
+            routes = ", ".join(f"{backend}:{model or 'default'}" for backend, model in _router.fallbacks)
+            log.info("LLM routing: %s -> %s (hedging %s)", _router.primary_backend, routes,
+                     "on" if _router.hedge else "off")
+    return _router
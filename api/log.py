@@ -0,0 +1,38 @@
+import sys
+import random
+import logging
+
+from api.config import LOG_LEVEL, LOG_SAMPLE_RATE
+
+# Leveled logging for the serving path, in the same "[INFO] message" format the
+# print statements used. Per-request messages (scores, timings, prompt previews) are
+# logged with extra=SAMPLED and only LOG_SAMPLE_RATE of them are written, so logging
+# no longer costs every request a few stdout writes under load. Warnings and errors
+# are never sampled. Messages use %-style arguments, so a disabled level costs only
+# the call.
+#
+#   LOG_LEVEL=DEBUG LOG_SAMPLE_RATE=1   # everything, e.g. while debugging prompts
+
+SAMPLED = {"sampled": True}
+
+
+class _SamplingFilter(logging.Filter):
+    def filter(self, record):
+        if getattr(record, "sampled", False) and record.levelno < logging.WARNING:
+            return LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE
+        return True
+
+
+_root = logging.getLogger("rag")
+if not _root.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+    _handler.addFilter(_SamplingFilter())
+    _root.addHandler(_handler)
+    _root.setLevel(getattr(logging, LOG_LEVEL.upper(), logging.INFO))
+    _root.propagate = False
+
+
+def get_logger(name):
+    """Logger for one module, e.g. get_logger("retriever")."""
+    return _root.getChild(name)
@@ -1,13 +1,50 @@
-from fastapi import FastAPI, HTTPException
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
 # CRITICAL: Load .env BEFORE any other imports(This makes sure the gemini api key and paths are set and configured properly)
 load_dotenv()
 
-from api.retriever import search, pages_from_results
-from api.generator import answer_question
-from api.embedder import load_embeddings_csv
+from api.retriever import search_batch, search_lexical, fuse_results, pages_from_results
+from api.batcher import QueryBatcher
+from api.answer_cache import AnswerCache
+from api.generator import answer_question, answer_question_async, answer_question_stream, close_http_client
+from api.llm_backends import get_backend, backend_stats
+from api.llm_router import get_router
+from api.index_state import load_index_state, current_build_id, EMPTY_STATE
+from api.corpus import SearchFilter
+from api.context_builder import build_context
+from api.reranker import Reranker
+from api.batch_qa import parse_items, run_batch
+from api.admission import AdmissionStage, Overloaded
+from api.query_log import QueryLog, read_log, top_queries
+from api.model_registry import warm_up, freeze_for_fork, model_stats, get_cross_encoder
+from api.config import PRELOAD_MODEL, BACKGROUND_LOAD, check_setup
+from api.config import QUERY_BATCHING, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, ENCODE_THREADS, ASYNC_LLM
+from api.config import (ANSWER_CACHE, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SECONDS, SEMANTIC_CACHE_THRESHOLD,
+                        SEMANTIC_CACHE_MIN_OVERLAP, ANSWER_CACHE_PATH)
+from api.config import ADMIN_TOKEN, INDEX_RELOAD_POLL_SECONDS
+from api.config import RETRIEVAL_MODE, HYBRID_FUSION, HYBRID_ALPHA, HYBRID_CANDIDATES
+from api.config import CONTEXT_TOKEN_BUDGET
+from api.config import RERANK, RERANK_CANDIDATES, RERANK_BUDGET_MS
+from api.config import BATCH_QA_CONCURRENCY, BATCH_QA_MAX_ITEMS
+from api.config import (RETRIEVAL_CONCURRENCY, RETRIEVAL_QUEUE, RETRIEVAL_QUEUE_TIMEOUT_MS, RETRIEVAL_MAX_WAIT_MS,
+                        GENERATION_CONCURRENCY, GENERATION_QUEUE, GENERATION_QUEUE_TIMEOUT_MS,
+                        GENERATION_MAX_WAIT_MS, ADMISSION_DEGRADE)
+from api.config import (QUERY_LOG_PATH, QUERY_LOG_FLUSH_SECONDS, QUERY_LOG_MAX_PENDING, QUERY_LOG_MAX_MB,
+                        QUERY_LOG_PREWARM, QUERY_LOG_PREWARM_HOURS, QUERY_LOG_PREWARM_ANSWERS)
+from api.metrics import (MetricsMiddleware, Gauge, span, current_timings, timings_ms, render_metrics,
+                         PROMETHEUS_CONTENT_TYPE)
+from api.log import get_logger, SAMPLED
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter as timer
+from time import time
+import asyncio
+import contextvars
+import json
 import os
 import sys
 
@@ -15,28 +52,295 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 app = FastAPI(title="Boeing 737 Manual RAG API")
+# request latency / status metrics and the per-request stage timings (api/metrics.py)
+app.add_middleware(MetricsMiddleware)
 
+log = get_logger("main")
 
-# Load embedding vectors at the beginning
-try:
-    chunks, embeddings_tensor = load_embeddings_csv()
-    print(f"[INFO] Loaded {len(chunks)} chunks successfully")
-except Exception as e:
-    print(f"[ERROR] Failed to load embeddings: {e}")
-    chunks = []
-    embeddings_tensor = None
+
+# chunks + embeddings + index live in one IndexState that /admin/reload swaps. It is
+# loaded once, by _load_serving_state: in the background after startup (BACKGROUND_LOAD=1),
+# before the server accepts requests (BACKGROUND_LOAD=0), or here at import (PRELOAD_MODEL=1).
+# Importing this module doesn't import torch / sentence_transformers; they come with the load.
+state = EMPTY_STATE
+
+# progress of that load, for /health/ready
+_boot = {
+    "phase": "pending",  # -> loading_index -> loading_model -> done
+    "started_at": None,
+    "index_seconds": None,
+    "model_seconds": None,
+    "ready_seconds": None,
+    "model_loaded": False,
+    "errors": [],
+}
+_started_at = time()
+# seconds a client is told to wait (Retry-After) while the index is still loading
+_BOOT_RETRY_AFTER = "5"
+
+# serializes /admin/reload, the poller and the startup load (created in startup_event, on the serving loop)
+_reload_lock = None
+_boot_task = None
+
+
+def _search_batch(queries, top_ks, nprobes, filters=None, current=None):
+    """
+    Returns one (results, query_vector) pair per query. current is the IndexState to search
+    (default: the served one), for callers that resolved their filters against a snapshot.
+    """
+    # one read of the global: a reload in the middle of a batch can't mix two builds
+    current = state if current is None else current
+    results, query_vectors = search_batch(queries, current.chunks, current.embeddings_tensor, top_k=top_ks,
+                                          index=current.index, nprobe=nprobes, return_query_vectors=True,
+                                          filters=filters, layout=current.layout)
+    if query_vectors is None:
+        return [(r, None) for r in results]
+    return list(zip(results, query_vectors))
+
+
+# Coalesces concurrent /ask queries into batched encodes (started in startup_event)
+query_batcher = QueryBatcher(_search_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS) \
+    if QUERY_BATCHING else None
+
+# Exact + semantic answer cache in front of the LLM
+answer_cache = AnswerCache(
+    max_size=ANSWER_CACHE_SIZE,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    semantic_threshold=SEMANTIC_CACHE_THRESHOLD,
+    min_chunk_overlap=SEMANTIC_CACHE_MIN_OVERLAP,
+    path=ANSWER_CACHE_PATH or None,
+) if ANSWER_CACHE else None
+
+# One JSON line per /ask request (api/query_log.py), written off the request path by a
+# background thread (started in startup_event); read back by the startup pre-warm below
+query_log = QueryLog(
+    QUERY_LOG_PATH,
+    flush_seconds=QUERY_LOG_FLUSH_SECONDS,
+    max_pending=QUERY_LOG_MAX_PENDING,
+    max_bytes=int(QUERY_LOG_MAX_MB * 1024 * 1024),
+) if QUERY_LOG_PATH else None
+# what the startup pre-warm from the query log did, for /health
+_prewarm = {"status": "off" if not (QUERY_LOG_PATH and QUERY_LOG_PREWARM > 0) else "pending"}
+
+# Dedicated threads for CPU-bound query encoding when batching is off,
+# so it never competes with the default threadpool or blocks the event loop
+encode_executor = ThreadPoolExecutor(max_workers=ENCODE_THREADS, thread_name_prefix="encode")
+# BM25 lookups run here, concurrently with the dense search of the same request
+lexical_executor = ThreadPoolExecutor(max_workers=ENCODE_THREADS, thread_name_prefix="lexical")
+# Cross-encoder re-ranking of the retrieved candidates (RERANK=1 or rerank=true per request);
+# the model is loaded on first use
+reranker = Reranker()
+rerank_executor = ThreadPoolExecutor(max_workers=ENCODE_THREADS, thread_name_prefix="rerank")
+
+# Admission control (api/admission.py): bounded concurrency and queues for the retrieval
+# and LLM stages of /ask and /ask/stream, so overload is shed early instead of queued
+retrieval_stage = AdmissionStage("retrieval", RETRIEVAL_CONCURRENCY, RETRIEVAL_QUEUE,
+                                 RETRIEVAL_QUEUE_TIMEOUT_MS, RETRIEVAL_MAX_WAIT_MS)
+generation_stage = AdmissionStage("generation", GENERATION_CONCURRENCY, GENERATION_QUEUE,
+                                  GENERATION_QUEUE_TIMEOUT_MS, GENERATION_MAX_WAIT_MS)
+
+
+def _load_serving_state():
+    """
+    The one load of the index and the models (embedding model warmed up, the query
+    engine and, with RERANK=1, the cross-encoder). Failures are logged and reported
+    on /health/ready; the server stays up so /admin/reload can recover.
+    """
+    global state
+    check_setup()
+    _boot["started_at"] = time()
+    start = timer()
+
+    _boot["phase"] = "loading_index"
+    try:
+        log.info("Loading embeddings...")
+        state = load_index_state()
+        log.info("Successfully loaded %d chunks", len(state.chunks))
+    except Exception as e:
+        log.error("Failed to load embeddings: %s", e)
+        _boot["errors"].append(f"index: {e}")
+    _boot["index_seconds"] = round(timer() - start, 3)
+
+    # Load the embedding model now instead of on the first /ask request
+    _boot["phase"] = "loading_model"
+    model_start = timer()
+    try:
+        warm_up()
+        _boot["model_loaded"] = True
+    except Exception as e:
+        log.error("Failed to warm up embedding model: %s", e)
+        _boot["errors"].append(f"model: {e}")
+    if RERANK:
+        try:
+            get_cross_encoder()
+        except Exception as e:
+            log.error("Failed to load the re-ranking model: %s", e)
+            _boot["errors"].append(f"rerank model: {e}")
+    _boot["model_seconds"] = round(timer() - model_start, 3)
+
+    _boot["ready_seconds"] = round(time() - _started_at, 3)
+    _boot["phase"] = "done"
+    log.info("Loaded in %.2fs (index %.2fs, models %.2fs), %.2fs after import",
+             timer() - start, _boot["index_seconds"], _boot["model_seconds"], _boot["ready_seconds"])
+
+
+async def _load_in_background():
+    # under the reload lock: a reload or index poll waits for this load instead of repeating it
+    async with _reload_lock:
+        await run_in_threadpool(_load_serving_state)
+
+
+def _booting():
+    return _boot["phase"] != "done"
+
+
+def _ready():
+    return not _booting() and state.loaded and _boot["model_loaded"]
+
+
+# With PRELOAD_MODEL=1 under a preloading parent (see gunicorn.conf.py) the index and
+# model are loaded once here, before workers fork, and shared copy-on-write
+if PRELOAD_MODEL:
+    _load_serving_state()
+    freeze_for_fork()
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Load embeddings on startup"""
-    global chunks, embeddings_tensor
+    """Load embeddings on startup (in the background with BACKGROUND_LOAD=1)"""
+    global _reload_lock, _boot_task
+    _reload_lock = asyncio.Lock()
+    if _boot["phase"] == "pending":
+        if BACKGROUND_LOAD:
+            _boot_task = asyncio.get_running_loop().create_task(_load_in_background())
+        else:
+            await _load_in_background()
+
+    if query_batcher is not None:
+        query_batcher.start()
+
+    if answer_cache is not None:
+        try:
+            answer_cache.load()
+        except Exception as e:
+            log.error("Failed to load answer cache: %s", e)
+
+    if query_log is not None:
+        query_log.start()
+        if QUERY_LOG_PREWARM > 0:
+            asyncio.get_running_loop().create_task(_prewarm_from_log())
+
+    if INDEX_RELOAD_POLL_SECONDS > 0:
+        asyncio.get_running_loop().create_task(_poll_for_new_index())
+
+
+async def reload_index():
+    """
+    Load the store from disk in a worker thread and swap it in. Requests already
+    running finish on the old state. The answer and re-ranking caches are kept: their
+    keys include the build lineage, so entries stay valid across incremental builds
+    (unchanged chunks keep their ids) and stop matching after a full rebuild.
+    """
+    global state
+    async with _reload_lock:
+        new_state = await run_in_threadpool(load_index_state)
+        old_state, state = state, new_state
+    log.info("Index reloaded: %d -> %d chunks (build %s)", len(old_state.chunks), len(new_state.chunks),
+             new_state.build_id)
+    asyncio.get_running_loop().create_task(_close_later(old_state))
+    return new_state
+
+
+async def _close_later(old_state, grace_seconds=30):
+    """Stop the replaced state's shard workers once the requests still using it are done."""
+    await asyncio.sleep(grace_seconds)
+    await run_in_threadpool(old_state.close)
+
+
+async def _poll_for_new_index():
+    """Reload automatically when a build swaps a new store in (INDEX_RELOAD_POLL_SECONDS > 0)."""
+    while True:
+        await asyncio.sleep(INDEX_RELOAD_POLL_SECONDS)
+        if _booting():
+            continue
+        try:
+            build_id = current_build_id()
+            if build_id is not None and build_id != state.build_id:
+                await reload_index()
+        except Exception as e:
+            log.error("Index reload failed, still serving the previous index: %s", e)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if _boot_task is not None:
+        _boot_task.cancel()
+    if query_batcher is not None:
+        await query_batcher.stop()
+    await close_http_client()
+    encode_executor.shutdown(wait=False)
+    lexical_executor.shutdown(wait=False)
+    state.close()
+    rerank_executor.shutdown(wait=False)
+    if answer_cache is not None:
+        answer_cache.save()
+    if query_log is not None:
+        query_log.stop()
+
+
+async def _prewarm_from_log():
+    """
+    Run the most frequent recent queries of the query log through retrieval once the index
+    is loaded, so their first real requests find the tokenizer cache, the index pages and
+    the query path warm. With QUERY_LOG_PREWARM_ANSWERS=1 the ones the answer cache doesn't
+    hold are also answered, one at a time, through the generation stage.
+    """
+    if _boot_task is not None:
+        await asyncio.shield(_boot_task)
+    if not _ready():
+        _prewarm["status"] = "skipped"
+        return
+    _prewarm["status"] = "running"
+    start = timer()
+    since = time() - QUERY_LOG_PREWARM_HOURS * 3600 if QUERY_LOG_PREWARM_HOURS > 0 else None
+    records, retrieved, answered = [], 0, 0
     try:
-        print("[INFO] Loading embeddings...")
-        chunks, embeddings_tensor = load_embeddings_csv()
-        print(f"[INFO] Successfully loaded {len(chunks)} chunks")
+        records = await run_in_threadpool(lambda: top_queries(read_log(QUERY_LOG_PATH, since), QUERY_LOG_PREWARM))
+        for i in range(0, len(records), BATCH_MAX_SIZE):
+            block = records[i:i + BATCH_MAX_SIZE]
+            filters = [SearchFilter.from_params(r.get("doc"), r.get("chapter"), r.get("page_start"),
+                                                r.get("page_end")) for r in block]
+            try:
+                results = await _in_executor(encode_executor, _search_batch, [r["query"] for r in block],
+                                             [r.get("top_k", 5) for r in block], [r.get("nprobe") for r in block],
+                                             filters)
+            except ValueError as e:
+                # a filter naming a document that is no longer served
+                log.warning("Query log pre-warm skipped %d queries: %s", len(block), e)
+                continue
+            retrieved += len(block)
+            if not (QUERY_LOG_PREWARM_ANSWERS and answer_cache is not None):
+                continue
+            for record, (top_chunks, query_vector) in zip(block, results):
+                model = record.get("model") or get_backend().default_model
+                if record.get("retrieval_only") or not top_chunks or \
+                        _cached_answer(record["query"], query_vector, top_chunks, model)[0] is not None:
+                    continue
+                passages, _ = _build_context(top_chunks, record.get("max_context_tokens"))
+                answer = await _generate(record["query"], passages, model)
+                _cache_answer(record["query"], query_vector, top_chunks, model, answer)
+                answered += 1
+    except Overloaded as e:
+        log.warning("Query log pre-warm stopped, the LLM stage is busy: %s", e)
+        _prewarm["status"] = "stopped"
     except Exception as e:
-        print(f"[ERROR] Failed to load embeddings: {e}")
+        log.error("Query log pre-warm failed: %s", e)
+        _prewarm["status"] = "failed"
+    else:
+        _prewarm["status"] = "done"
+    _prewarm.update(queries=len(records), retrieved=retrieved, answered=answered, seconds=round(timer() - start, 3))
+    log.info("Query log pre-warm %s: %d queries retrieved, %d answered in %.2fs", _prewarm["status"],
+             retrieved, answered, _prewarm["seconds"])
 
 
 # this is just to check if the api is online
@@ -48,12 +352,18 @@ def root():
         "name": "Boeing 737 Manual RAG API",
         "version": "1.0.0",
         "status": "online",
-        "llm": "Google Gemini 1.5 Flash",
-        "embeddings_loaded": len(chunks) > 0,
-        "total_chunks": len(chunks),
+        "llm": f"{get_backend().name} ({get_backend().default_model})",
+        "embeddings_loaded": len(state.chunks) > 0,
+        "total_chunks": len(state.chunks),
         "endpoints": {
             "ask": "/ask?query=YOUR_QUESTION",
+            "ask_stream": "/ask/stream?query=YOUR_QUESTION",
+            "ask_batch": "POST /ask/batch (JSONL body)",
+            "documents": "/documents",
             "health": "/health",
+            "health_live": "/health/live",
+            "health_ready": "/health/ready",
+            "metrics": "/metrics",
             "docs": "/docs"
         },
         "example": "/ask?query=What is the hydraulic system?",
@@ -64,37 +374,384 @@ def root():
 def health():
     """Health check endpoint"""
     gemini_configured = os.getenv("GEMINI_API_KEY") is not None
+    backend = get_backend()
+    llm_configured = gemini_configured or backend.name != "gemini"
+    current = state
     
     return {
-        "status": "healthy" if (len(chunks) > 0 and gemini_configured) else "degraded",
-        "embeddings_loaded": len(chunks) > 0,
-        "total_chunks": len(chunks),
+        "status": "healthy" if (len(current.chunks) > 0 and llm_configured) else "degraded",
+        "embeddings_loaded": len(current.chunks) > 0,
+        "total_chunks": len(current.chunks),
+        "index": current.index.kind if current.index is not None else None,
+        "shard_pool": current.index.stats() if hasattr(current.index, "stats") else None,
+        "lexical_index": current.bm25.kind if current.bm25 is not None else None,
+        "retrieval_mode": RETRIEVAL_MODE,
+        "documents": current.layout.doc_ids if current.layout is not None else [],
+        "build_id": current.build_id,
         "gemini_configured": gemini_configured,
-        "llm": "Gemini 1.5 Flash"
+        "llm": f"{backend.name} ({backend.default_model})",
+        "llm_backends": backend_stats(),
+        "llm_routes": get_router().stats(),
+        "embedding_model": model_stats(),
+        "query_batcher": query_batcher.metrics() if query_batcher is not None else None,
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "reranker": reranker.stats(),
+        "admission": {stage.name: stage.stats() for stage in (retrieval_stage, generation_stage)},
+        "query_log": {**query_log.stats(), "prewarm": dict(_prewarm)} if query_log is not None else None,
+        "startup": _startup_info()
     }
 
-# here is where the main logic happens and where we pose the user query
-@app.get("/ask")
-def ask(query: str, top_k: int = 5, model: str = "gemini-2.5-flash"):
+
+def _startup_info():
+    info = {k: v for k, v in _boot.items() if k != "errors"}
+    info["errors"] = list(_boot["errors"])
+    info["uptime_seconds"] = round(time() - _started_at, 3)
+    return info
+
+
+# liveness probe: the process is up and its event loop answers (no index or model needed),
+# so an orchestrator doesn't restart a pod that is still loading
+@app.get("/health/live")
+def health_live():
+    return {"status": "alive", "uptime_seconds": round(time() - _started_at, 3)}
+
+
+# readiness probe: 200 once the index and the embedding model are loaded, 503 (with
+# Retry-After while the startup load is still running) until then
+@app.get("/health/ready")
+def health_ready():
+    info = _startup_info()
+    info["total_chunks"] = len(state.chunks)
+    if _ready():
+        return {"status": "ready", **info}
+    headers = {"Retry-After": _BOOT_RETRY_AFTER} if _booting() else None
+    return JSONResponse({"status": "loading" if _booting() else "not_ready", **info},
+                        status_code=503, headers=headers)
+
+# Prometheus scrape target: stage / request latency histograms plus the gauges below
+Gauge("rag_index_chunks", "Chunks in the served index", callback=lambda: [({}, len(state.chunks))])
+Gauge("rag_ready", "1 once the index and the embedding model are loaded", callback=lambda: [({}, int(_ready()))])
+Gauge("rag_llm_in_flight", "LLM calls in flight per backend", ("backend",),
+      callback=lambda: [({"backend": s["backend"]}, s["in_flight"]) for s in backend_stats()])
+Gauge("rag_batcher_queue_depth", "Queries waiting for the next encode batch",
+      callback=lambda: [({}, query_batcher.metrics()["queue_depth"])] if query_batcher is not None else [])
+Gauge("rag_admission_queue_depth", "Requests waiting for a slot per stage", ("stage",),
+      callback=lambda: [({"stage": s.name}, s.queued) for s in (retrieval_stage, generation_stage)])
+Gauge("rag_admission_in_flight", "Requests holding a slot per stage", ("stage",),
+      callback=lambda: [({"stage": s.name}, s.in_flight) for s in (retrieval_stage, generation_stage)])
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.get("/documents")
+def documents():
+    """Documents served by this instance and their chapters (values for the /ask filters)"""
+    current = state
+    return {"documents": current.layout.describe() if current.layout is not None else []}
+
+
+def _parse_filter(doc, chapter, page_start, page_end):
+    """
+    Build the SearchFilter for a request and resolve it once here, so unknown
+    documents are a 400 instead of an error inside the search batch.
+    """
+    search_filter = SearchFilter.from_params(doc, chapter, page_start, page_end)
+    if search_filter is not None and state.layout is not None:
+        try:
+            state.layout.resolve(search_filter)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return search_filter
+
+
+def _check_ready(query, needs_llm=True):
     if not query.strip():
         raise HTTPException(status_code=400, detail="Query cannot be empty")
-    
-    if not chunks or embeddings_tensor is None:
+    _check_service(needs_llm)
+
+
+def _check_service(needs_llm=True):
+    """503 while the index isn't loaded, or when an answer needs Gemini and no key is set."""
+    if not state.loaded and _booting():
+        raise HTTPException(
+            status_code=503,
+            detail="Service starting: the index is still loading, retry shortly.",
+            headers={"Retry-After": _BOOT_RETRY_AFTER}
+        )
+    if not state.loaded:
         raise HTTPException(
             status_code=503, 
             detail="Embeddings not loaded. Please generate embeddings first."
         )
     
-    # Check Gemini API key
-    if not os.getenv("GEMINI_API_KEY"):
+    # Check Gemini API key (only the Gemini backend needs one; retrieval_only requests need no LLM)
+    if needs_llm and get_backend().name == "gemini" and not os.getenv("GEMINI_API_KEY"):
         raise HTTPException(
             status_code=503,
             detail="Service unavailable: Gemini API key not configured."
         )
+
+
+def _retrieval_options(mode, fusion, alpha):
+    """Per-request retrieval settings, defaulting to RETRIEVAL_MODE / HYBRID_FUSION / HYBRID_ALPHA."""
+    mode = mode or RETRIEVAL_MODE
+    fusion = fusion or HYBRID_FUSION
+    alpha = HYBRID_ALPHA if alpha is None else alpha
+    if mode not in ("dense", "lexical", "hybrid"):
+        raise HTTPException(status_code=400, detail="mode must be one of: dense, lexical, hybrid")
+    if fusion not in ("rrf", "weighted"):
+        raise HTTPException(status_code=400, detail="fusion must be one of: rrf, weighted")
+    if not 0.0 <= alpha <= 1.0:
+        raise HTTPException(status_code=400, detail="alpha must be between 0 and 1")
+    if mode != "dense" and state.bm25 is None:
+        log.warning("No BM25 index loaded, serving %s request with dense retrieval "
+                    "(run build_index.py --bm25-only)", mode)
+        mode = "dense"
+    return mode, fusion, alpha
+
+
+def _in_executor(executor, fn, *args):
+    """run_in_executor that carries the request's context along, so the worker's stage timings count."""
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(executor, context.run, fn, *args)
+
+
+def _search_lexical(query, top_k, search_filter):
+    current = state
+    ranges = current.layout.resolve(search_filter) if search_filter is not None else None
+    return search_lexical(query, current.chunks, current.bm25, top_k=top_k, ranges=ranges)
+
+
+async def _retrieve(query, top_k, nprobe, search_filter=None, mode="dense", fusion="rrf", alpha=0.5):
+    """
+    Search for relevant chunks without blocking the event loop.
+    Returns (top_chunks, query_vector); the vector feeds the semantic answer cache
+    (None for lexical-only retrieval).
+    """
+    with span("retrieve"):
+        if mode == "dense":
+            return await _search_dense(query, top_k, nprobe, search_filter)
+
+        candidates = top_k if mode == "lexical" else max(top_k, HYBRID_CANDIDATES)
+        lexical = _in_executor(lexical_executor, _search_lexical, query, candidates, search_filter)
+        if mode == "lexical":
+            return await lexical, None
+
+        # dense (batcher / encode pool) and BM25 (lexical pool) run at the same time
+        (dense_results, query_vector), lexical_results = await asyncio.gather(
+            _search_dense(query, candidates, nprobe, search_filter), lexical
+        )
+        with span("fuse"):
+            fused = fuse_results(dense_results, lexical_results, top_k, method=fusion, alpha=alpha)
+        return fused, query_vector
+
+
+async def _search_dense(query, top_k, nprobe, search_filter=None):
+    # nprobe trades recall for latency when an IVF index is loaded (ignored by the flat index)
+    if query_batcher is not None:
+        return await query_batcher.search(query, top_k=top_k, nprobe=nprobe, search_filter=search_filter)
+    results = await _in_executor(encode_executor, _search_batch, [query], [top_k], [nprobe], [search_filter])
+    return results[0]
+
+
+def _rerank_options(rerank, rerank_budget_ms, top_k):
+    """(enabled, budget ms, candidates to retrieve) for a request, defaulting to RERANK / RERANK_BUDGET_MS."""
+    enabled = RERANK if rerank is None else rerank
+    budget_ms = RERANK_BUDGET_MS if rerank_budget_ms is None else rerank_budget_ms
+    if budget_ms < 0:
+        raise HTTPException(status_code=400, detail="rerank_budget_ms must not be negative")
+    return enabled, budget_ms, max(top_k, RERANK_CANDIDATES) if enabled else top_k
+
+
+async def _rerank(query, candidates, top_k, enabled, budget_ms):
+    """
+    Re-rank the retrieved candidates with the cross-encoder and keep top_k. The budget
+    starts now, so time spent waiting for a rerank thread counts against it. When the
+    model can't be used the retrieval order is served.
+    """
+    if not enabled or not candidates:
+        return candidates[:top_k], None
+    deadline = timer() + budget_ms / 1000
+    try:
+        with span("rerank"):
+            return await _in_executor(rerank_executor, reranker.rerank, query, candidates, top_k, deadline)
+    except Exception as e:
+        log.error("Re-ranking failed, using the retrieval order: %s", e)
+        return candidates[:top_k], {"error": str(e)}
+
+
+def _overloaded(e):
+    return HTTPException(status_code=e.status, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+async def _generate(query, passages, model, route_info=None):
+    """The LLM answer, once the generation stage admits the request (raises Overloaded)."""
+    async with generation_stage.admit():
+        if ASYNC_LLM:
+            return await answer_question_async(query, passages, model=model, route_info=route_info)
+        return await run_in_threadpool(answer_question, query, passages, model=model)
+
+
+def _degraded_info(overloaded=None):
+    """Why a response carries excerpts instead of an answer (retrieval_only=true, or the LLM stage shed it)."""
+    if overloaded is None:
+        return {"reason": "retrieval_only"}
+    return {"reason": overloaded.reason, "stage": overloaded.stage, "retry_after_seconds": overloaded.retry_after}
+
+
+def _excerpts(passages):
+    """Retrieval-only answer: the excerpts the prompt would have held, best first."""
+    return [{**{k: p[k] for k in ("doc_id", "page_number", "page_end") if k in p},
+             "score": f"{p['score']:.4f}", "text": p["text"]} for p in passages]
+
+
+def _chunk_keys(top_chunks):
+    """Keys of the retrieved chunks (chunk ids are only unique within a document)."""
+    return [f"{c['doc_id']}:{c['chunk_id']}" if "doc_id" in c else c["chunk_id"] for c in top_chunks]
+
+
+def _cache_keys(top_chunks):
+    """
+    Answer cache keys of the retrieved chunks: their keys within the build lineage of the
+    store they came from, so a full rebuild (which reuses chunk ids for other text) never
+    hits answers cached, or saved to disk, before it.
+    """
+    lineage = getattr(top_chunks[0], "lineage_id", None) if top_chunks else None
+    keys = _chunk_keys(top_chunks)
+    return [f"{lineage[:12]}/{key}" for key in keys] if lineage else keys
+
+
+def _retrieval_info(mode, fusion):
+    return {"mode": mode, "fusion": fusion} if mode == "hybrid" else {"mode": mode}
+
+
+def _documents_used(top_chunks):
+    return sorted({c["doc_id"] for c in top_chunks if "doc_id" in c})
+
+
+def _build_context(top_chunks, max_context_tokens):
+    """Excerpts for the prompt: boilerplate stripped, duplicates dropped, packed into the token budget."""
+    current = state
+    with span("context_build"):
+        passages, stats = build_context(top_chunks, token_budget=max_context_tokens or CONTEXT_TOKEN_BUDGET,
+                                        layout=current.layout, embeddings_tensor=current.embeddings_tensor)
+    log.info("Context: %d/%d excerpts, ~%d tokens (%d saved)", stats["passages"], len(top_chunks),
+             stats["tokens_after"], stats["tokens_saved"], extra=SAMPLED)
+    return passages, stats
+
+
+def _check_context_budget(max_context_tokens):
+    if max_context_tokens is not None and max_context_tokens <= 0:
+        raise HTTPException(status_code=400, detail="max_context_tokens must be positive")
+
+
+def _check_search_params(top_k, nprobe):
+    # before the query is enqueued: a bad item would fail every query batched with it
+    if top_k <= 0:
+        raise HTTPException(status_code=400, detail="top_k must be positive")
+    if nprobe is not None and nprobe <= 0:
+        raise HTTPException(status_code=400, detail="nprobe must be positive")
+
+
+def _timings(enabled):
+    """Stage timings of this request so far (ms), for timings=true; None otherwise."""
+    timings = current_timings() if enabled else None
+    return timings_ms(timings) if timings is not None else None
+
+
+def _cached_answer(query, query_vector, top_chunks, model):
+    if answer_cache is None:
+        return None, None
+    return answer_cache.get(query, query_vector, _cache_keys(top_chunks), model)
+
+
+def _cache_answer(query, query_vector, top_chunks, model, answer):
+    if answer_cache is not None:
+        answer_cache.put(query, query_vector, _cache_keys(top_chunks), model, answer)
+
+
+def _query_record(query, top_k, **params):
+    """Query log record of a request: when it came, and the parameters it set."""
+    return {"ts": round(time(), 3), "query": query, "top_k": top_k,
+            **{name: value for name, value in params.items() if value is not None}}
+
+
+def _log_query(record, model, started, status=200):
+    """Complete the record with the outcome and stage timings and hand it to the query log writer."""
+    if query_log is None:
+        return
+    record["model_used"] = model
+    record["status"] = status
+    record["latency_ms"] = round((timer() - started) * 1000, 2)
+    timings = current_timings()
+    if timings:
+        record["timings_ms"] = {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()}
+    query_log.append(record)
+
+
+# swap in a store written by build_embeddings.py without restarting the server
+@app.post("/admin/reload")
+async def admin_reload(x_admin_token: Optional[str] = Header(None)):
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    previous = state.build_id
+    try:
+        current = await reload_index()
+    except Exception as e:
+        # the previous state stays in place, so the server keeps answering
+        raise HTTPException(status_code=500, detail=f"Reload failed: {str(e)}")
+    return {
+        "status": "reloaded",
+        "previous_build_id": previous,
+        "build_id": current.build_id,
+        "total_chunks": len(current.chunks),
+        "index": current.index.kind if current.index is not None else None
+    }
+
+
+# here is where the main logic happens and where we pose the user query
+# doc (comma separated ids), chapter (title match) and page_start/page_end restrict the search;
+# they are resolved to row ranges up front so only the matching rows are scored.
+# mode=dense|lexical|hybrid picks the retriever (hybrid fuses both with fusion=rrf|weighted, alpha=dense weight)
+# max_context_tokens overrides CONTEXT_TOKEN_BUDGET; "context" in the response reports the tokens saved
+# timings=true adds "timings_ms": the time this request spent in each stage (encode, score, llm_total, ...)
+# rerank=true retrieves RERANK_CANDIDATES chunks and keeps the cross-encoder's top_k, spending at
+# most rerank_budget_ms on it; "rerank" in the response says how many candidates were re-scored
+# retrieval_only=true skips the LLM: "answer" is null (unless cached) and "excerpts" holds the
+# retrieved passages. The same response is served, with "degraded" saying why and a Retry-After
+# header, when the LLM stage is overloaded (ADMISSION_DEGRADE=1); otherwise overload is a 429 / 503.
+@app.get("/ask")
+async def ask(response: Response, query: str, top_k: int = 5, model: Optional[str] = None,
+              nprobe: Optional[int] = None, doc: Optional[str] = None, chapter: Optional[str] = None,
+              page_start: Optional[int] = None, page_end: Optional[int] = None,
+              mode: Optional[str] = None, fusion: Optional[str] = None, alpha: Optional[float] = None,
+              max_context_tokens: Optional[int] = None, timings: bool = False,
+              rerank: Optional[bool] = None, rerank_budget_ms: Optional[float] = None,
+              retrieval_only: bool = False):
+    started = timer()
+    _check_ready(query, needs_llm=not retrieval_only)
+    _check_context_budget(max_context_tokens)
+    _check_search_params(top_k, nprobe)
+    # the query log keeps the parameters as sent, so a replay gets the server's defaults
+    logged = _query_record(query, top_k, model=model, nprobe=nprobe, doc=doc, chapter=chapter,
+                           page_start=page_start, page_end=page_end, mode=mode, fusion=fusion, alpha=alpha,
+                           max_context_tokens=max_context_tokens, rerank=rerank,
+                           rerank_budget_ms=rerank_budget_ms, retrieval_only=retrieval_only or None)
+    model = model or get_backend().default_model
+    search_filter = _parse_filter(doc, chapter, page_start, page_end)
+    mode, fusion, alpha = _retrieval_options(mode, fusion, alpha)
+    rerank, rerank_budget_ms, candidates = _rerank_options(rerank, rerank_budget_ms, top_k)
     
+    status = 200
     try:
         # Search for relevant chunks
-        top_chunks = search(query, chunks, embeddings_tensor, top_k=top_k)
+        async with retrieval_stage.admit():
+            top_chunks, query_vector = await _retrieve(query, candidates, nprobe, search_filter, mode, fusion, alpha)
+            top_chunks, rerank_stats = await _rerank(query, top_chunks, top_k, rerank, rerank_budget_ms)
+        logged["chunks"] = _chunk_keys(top_chunks)
         pages = pages_from_results(top_chunks)
 
         if not top_chunks:
@@ -104,26 +761,208 @@ def ask(query: str, top_k: int = 5, model: str = "gemini-2.5-flash"):
                 "pages": [],
                 "num_chunks_used": 0,
                 "top_scores": [],
-                "model_used": model
+                "model_used": model,
+                "filter": search_filter.to_dict() if search_filter else None,
+                "retrieval": _retrieval_info(mode, fusion),
+                "timings_ms": _timings(timings)
             }
         
-        print(f"[INFO] Top chunk scores: {[chunk['score'] for chunk in top_chunks]}") 
+        log.info("Top chunk scores: %s", [chunk['score'] for chunk in top_chunks], extra=SAMPLED)
 
         
+        # Paraphrases of recent questions over the same chunks are answered from the cache
+        answer, cached = _cached_answer(query, query_vector, top_chunks, model)
+        passages, context_stats = _build_context(top_chunks, max_context_tokens)
+
         # Generate answer - NOTE THE CORRECT ORDER: query first, then chunks
-        answer = answer_question(query, top_chunks, model=model)
+        route_info = {}
+        degraded = None
+        if answer is None and retrieval_only:
+            degraded = _degraded_info()
+        elif answer is None:
+            try:
+                answer = await _generate(query, passages, model, route_info)
+            except Overloaded as e:
+                if not ADMISSION_DEGRADE:
+                    raise
+                degraded = _degraded_info(e)
+                response.headers["Retry-After"] = str(e.retry_after)
+            else:
+                _cache_answer(query, query_vector, top_chunks, model, answer)
+        if cached:
+            logged["cached"] = cached
+        if degraded:
+            logged["degraded"] = degraded["reason"]
 
         return {
             "query": query,
             "answer": answer,
             "pages": pages,
+            "documents": _documents_used(top_chunks),
             "num_chunks_used": len(top_chunks),
             "top_scores": [f"{chunk['score']:.4f}" for chunk in top_chunks],#it is based on this the answer is given 
-            "model_used": model
+            "model_used": model,
+            "cached": cached,
+            "filter": search_filter.to_dict() if search_filter else None,
+            "retrieval": _retrieval_info(mode, fusion),
+            "context": context_stats,
+            "rerank": rerank_stats,
+            "llm_route": route_info or None,
+            "degraded": degraded,
+            "excerpts": _excerpts(passages) if degraded else None,
+            "timings_ms": _timings(timings)
         }
-    
+
+    except Overloaded as e:
+        status = e.status
+        raise _overloaded(e)
     except Exception as e:
+        status = 500
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+    finally:
+        _log_query(logged, model, started, status)
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# same as /ask but the answer is sent as server-sent events while the LLM generates it:
+#   event: meta   -> pages / scores (sent as soon as retrieval is done)
+#   event: token  -> {"text": "..."} pieces of the answer
+#   event: route  -> LLM route that answered, whether it was hedged / a fallback, and the
+#                    outcome: complete | blocked | error (the token events then end in the message)
+#   event: degraded -> {"reason": ..., "excerpts": [...]} instead of tokens, for retrieval_only=true
+#                   or when the LLM stage is overloaded (ADMISSION_DEGRADE=1)
+#   event: error  -> {"status": 429 | 503, "retry_after_seconds": ...} when it is overloaded otherwise
+#   event: done   -> end of the answer ({"timings_ms": {...}} with timings=true)
+@app.get("/ask/stream")
+async def ask_stream(query: str, top_k: int = 5, model: Optional[str] = None, nprobe: Optional[int] = None,
+                     doc: Optional[str] = None, chapter: Optional[str] = None,
+                     page_start: Optional[int] = None, page_end: Optional[int] = None,
+                     mode: Optional[str] = None, fusion: Optional[str] = None, alpha: Optional[float] = None,
+                     max_context_tokens: Optional[int] = None, timings: bool = False,
+                     rerank: Optional[bool] = None, rerank_budget_ms: Optional[float] = None,
+                     retrieval_only: bool = False):
+    _check_ready(query, needs_llm=not retrieval_only)
+    _check_context_budget(max_context_tokens)
+    _check_search_params(top_k, nprobe)
+    model = model or get_backend().default_model
+    search_filter = _parse_filter(doc, chapter, page_start, page_end)
+    mode, fusion, alpha = _retrieval_options(mode, fusion, alpha)
+    rerank, rerank_budget_ms, candidates = _rerank_options(rerank, rerank_budget_ms, top_k)
+
+    try:
+        async with retrieval_stage.admit():
+            top_chunks, query_vector = await _retrieve(query, candidates, nprobe, search_filter, mode, fusion, alpha)
+            top_chunks, rerank_stats = await _rerank(query, top_chunks, top_k, rerank, rerank_budget_ms)
+    except Overloaded as e:
+        raise _overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+
+    answer, cached = _cached_answer(query, query_vector, top_chunks, model)
+    passages, context_stats = _build_context(top_chunks, max_context_tokens)
+
+    async def events():
+        yield _sse("meta", {
+            "query": query,
+            "pages": pages_from_results(top_chunks),
+            "documents": _documents_used(top_chunks),
+            "num_chunks_used": len(top_chunks),
+            "top_scores": [f"{chunk['score']:.4f}" for chunk in top_chunks],
+            "model_used": model,
+            "cached": cached,
+            "filter": search_filter.to_dict() if search_filter else None,
+            "retrieval": _retrieval_info(mode, fusion),
+            "context": context_stats,
+            "rerank": rerank_stats
+        })
+        if answer is not None:
+            yield _sse("token", {"text": answer})
+        elif retrieval_only:
+            yield _sse("degraded", {**_degraded_info(), "excerpts": _excerpts(passages)})
+        else:
+            # the slot is taken inside the stream, so it is always given back when the stream ends
+            try:
+                admitted = await generation_stage.acquire()
+            except Overloaded as e:
+                if ADMISSION_DEGRADE:
+                    yield _sse("degraded", {**_degraded_info(e), "excerpts": _excerpts(passages)})
+                else:
+                    yield _sse("error", {"status": e.status, "detail": str(e), "retry_after_seconds": e.retry_after})
+            else:
+                try:
+                    parts = []
+                    route_info = {}
+                    async for text in answer_question_stream(query, passages, model=model, route_info=route_info):
+                        parts.append(text)
+                        yield _sse("token", {"text": text})
+                    yield _sse("route", route_info)
+                    # an error or block can arrive after part of the answer: only a finished stream is cached
+                    if route_info.get("outcome") == "complete":
+                        _cache_answer(query, query_vector, top_chunks, model, "".join(parts).strip())
+                finally:
+                    generation_stage.release(admitted)
+        yield _sse("done", {"timings_ms": _timings(timings)} if timings else {})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def _answer_batch_item(query, passages, model):
+    # admitted like /ask: a shed call raises Overloaded and comes back as that item's error
+    return await _generate(query, passages, model)
+
+
+# many questions in one request: the body is JSONL, one {"id": ..., "query": ..., "top_k": ...,
+# "model": ..., "doc": ..., "chapter": ..., "page_start": ..., "page_end": ...} per line (or a
+# JSON string); query parameters set the defaults. Answers stream back as JSONL in completion
+# order, each with the item's "id" and "index", per-item "timings_ms" and an "error" (null when
+# answered), so a client can write them out as they arrive and resubmit only the failures.
+# Retrieval is batched (one encode + one matrix product per block of questions), identical
+# contexts are built once and identical questions over the same context share one LLM call.
+# Blocks and LLM calls go through the same admission stages as /ask, and `concurrency` is
+# capped at GENERATION_CONCURRENCY; an item the stages shed comes back with an "error".
+@app.post("/ask/batch")
+async def ask_batch(request: Request, top_k: int = 5, model: Optional[str] = None,
+                    concurrency: Optional[int] = None, max_context_tokens: Optional[int] = None):
+    _check_service()
+    _check_context_budget(max_context_tokens)
+    concurrency = BATCH_QA_CONCURRENCY if concurrency is None else concurrency
+    if concurrency <= 0 or top_k <= 0:
+        raise HTTPException(status_code=400, detail="concurrency and top_k must be positive")
+    if GENERATION_CONCURRENCY > 0:
+        concurrency = min(concurrency, GENERATION_CONCURRENCY)
+
+    body = (await request.body()).decode("utf-8", errors="replace")
+    items = parse_items(body.splitlines(), default_top_k=top_k, default_model=model or get_backend().default_model)
+    if not items:
+        raise HTTPException(status_code=400, detail="Request body must contain at least one JSONL question")
+    if len(items) > BATCH_QA_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_QA_MAX_ITEMS} questions per batch")
+
+    current = state
+
+    async def retrieve(queries, top_ks, filters):
+        async with retrieval_stage.admit():
+            # the snapshot the filters were resolved against, even if /admin/reload swaps state meanwhile
+            return await _in_executor(encode_executor, _search_batch, queries, top_ks, [None] * len(queries),
+                                      filters, current)
+
+    async def lines():
+        async for result in run_batch(
+            items, retrieve, lambda chunks: _build_context(chunks, max_context_tokens), _answer_batch_item,
+            concurrency=concurrency, cached_answer=_cached_answer, cache_answer=_cache_answer,
+            resolve_filter=current.layout.resolve if current.layout is not None else None,
+        ):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,240 @@
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter as timer
+
+# Latency instrumentation and Prometheus-format metrics (GET /metrics).
+# Stages of a request are timed with span("encode") / record("encode", seconds); each
+# observation goes to the rag_stage_seconds histogram and, when the code runs inside a
+# request (see request_timings), into that request's timings dict, which /ask returns
+# with timings=true. Work that runs on executor threads either copies the request's
+# context (contextvars.copy_context().run) or collects its own timings (collect_timings)
+# that are merged into every request it served (the query batcher).
+# No client library needed: the exposition format is written here.
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds; fine at the low end where encode / score / top-k live
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+_timings = ContextVar("request_timings", default=None)
+# stage seconds of an open stage_group, recorded when the group ends
+_grouped = ContextVar("grouped_stages", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value):
+    return "+Inf" if value == float("inf") else repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines += self._samples()
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_label_text(self.label_names, key)} {_number(value)}"
+                for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """Current value, either set explicitly or read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, label_names=(), callback=None):
+        super().__init__(name, help_text, label_names)
+        self._values = {}
+        self._callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        values = self._values
+        if self._callback is not None:
+            values = {self._key(labels): value for labels, value in self._callback()}
+        return [f"{self.name}{_label_text(self.label_names, key)} {_number(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def _samples(self):
+        lines = []
+        names = self.label_names + ("le",)
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_text(names, key + (_number(bound),))} {cumulative}")
+            labels = _label_text(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]!r}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render_metrics():
+    """All registered metrics in the Prometheus text exposition format (0.0.4)."""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent per request stage", ("stage",))
+REQUEST_SECONDS = Histogram("rag_request_seconds", "End-to-end HTTP request latency", ("endpoint",))
+REQUESTS = Counter("rag_requests_total", "HTTP requests by endpoint and status code", ("endpoint", "status"))
+
+
+# per-request timings -------------------------------------------------------
+
+@contextmanager
+def request_timings():
+    """Collect the stage timings of everything run in this context; yields the dict."""
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def current_timings():
+    return _timings.get()
+
+
+def record(stage, seconds):
+    """Observe one stage duration (added up when a stage runs several times in a request)."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage):
+    started = timer()
+    try:
+        yield
+    finally:
+        grouped = _grouped.get()
+        if grouped is None:
+            record(stage, timer() - started)
+        else:
+            grouped[stage] = grouped.get(stage, 0.0) + timer() - started
+
+
+@contextmanager
+def stage_group():
+    """
+    Add up the spans run inside (an index timing each shard or query row) and record
+    each stage once when the group ends, so the histogram sees one observation per call.
+    """
+    if _grouped.get() is not None:
+        # nested: the outer group records
+        yield
+        return
+    grouped = {}
+    token = _grouped.set(grouped)
+    try:
+        yield
+    finally:
+        _grouped.reset(token)
+        for stage, seconds in grouped.items():
+            record(stage, seconds)
+
+
+def collect_timings(fn, *args):
+    """Run fn(*args) with its own timings dict (for shared work on a worker thread); returns (result, timings)."""
+    with request_timings() as timings:
+        return fn(*args), timings
+
+
+def timings_ms(timings):
+    return {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: per-request timings context, request latency and status counts.
+    Requests are labelled with their route's path template ("/ask"), never the raw
+    URL, so unknown paths don't create a series each.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = timer()
+        try:
+            with request_timings():
+                await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "other"
+            REQUEST_SECONDS.observe(timer() - started, endpoint=endpoint)
+            REQUESTS.inc(endpoint=endpoint, status=status[0])
@@ -0,0 +1,209 @@
+import gc
+import os
+import resource
+import threading
+from time import perf_counter as timer
+
+from api.config import EMBED_MODEL_NAME, EMBED_MODEL_DTYPE, EMBED_NUM_THREADS, RERANK_MODEL_NAME
+from api.config import QUERY_ENCODER_ENGINE, QUERY_ENCODER_INT8, QUERY_ENCODER_MIN_COSINE
+from api.log import get_logger
+
+log = get_logger("model_registry")
+
+# One process-wide registry of embedding models, shared by the build path
+# (embedder.py) and the serving path (retriever.py) so a model is loaded once.
+# The re-ranking cross-encoder (reranker.py) and the exported query encoders
+# (query_encoder.py) are kept here too.
+# torch / sentence_transformers are imported by the functions that load a model:
+# importing them takes seconds, and the API imports this module before it can
+# answer its liveness probe.
+
+_DTYPES = ("float32", "float16", "bfloat16")
+
+_models = {}
+_stats = {}
+_query_encoders = {}
+_lock = threading.Lock()
+
+
+def process_memory_mb():
+    """Current resident set size of this process in MB (peak RSS if /proc is unavailable)."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+
+
+def _load(name, dtype):
+    if dtype not in _DTYPES:
+        raise ValueError(f"Unsupported EMBED_MODEL_DTYPE {dtype!r}, expected one of {list(_DTYPES)}")
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if EMBED_NUM_THREADS > 0:
+        torch.set_num_threads(EMBED_NUM_THREADS)
+
+    log.info("Loading model: %s (%s)", name, dtype)
+    rss_before = process_memory_mb()
+    start = timer()
+
+    # Force model to CPU
+    model = SentenceTransformer(name, device="cpu")
+    if dtype != "float32":
+        model = model.to(getattr(torch, dtype))
+    model.eval()
+
+    _stats[name] = {
+        "model": name,
+        "dtype": dtype,
+        "threads": torch.get_num_threads(),
+        "load_seconds": round(timer() - start, 4),
+        "rss_delta_mb": round(process_memory_mb() - rss_before, 1),
+        "warmed_up": False,
+    }
+    log.info("Model %s loaded in %.2fs", name, _stats[name]["load_seconds"])
+    return model
+
+
+def get_embedding_model(name=None, dtype=None):
+    """Return the shared embedding model, loading it on first use."""
+    name = name or EMBED_MODEL_NAME
+    dtype = dtype or EMBED_MODEL_DTYPE
+    model = _models.get(name)
+    if model is None:
+        with _lock:
+            model = _models.get(name)
+            if model is None:
+                model = _load(name, dtype)
+                _models[name] = model
+    return model
+
+
+def get_cross_encoder(name=None):
+    """Return the shared cross-encoder used for re-ranking, loading it on first use."""
+    name = name or RERANK_MODEL_NAME
+    model = _models.get(name)
+    if model is None:
+        with _lock:
+            model = _models.get(name)
+            if model is None:
+                import torch
+                from sentence_transformers import CrossEncoder
+
+                log.info("Loading cross-encoder: %s", name)
+                rss_before = process_memory_mb()
+                start = timer()
+                model = CrossEncoder(name, device="cpu")
+                _stats[name] = {
+                    "model": name,
+                    "dtype": "float32",
+                    "threads": torch.get_num_threads(),
+                    "load_seconds": round(timer() - start, 4),
+                    "rss_delta_mb": round(process_memory_mb() - rss_before, 1),
+                    "warmed_up": True,
+                }
+                _models[name] = model
+    return model
+
+
+def _load_query_encoder(model, name, engine, int8):
+    import torch
+    from api.query_encoder import CompiledEncoder, verify
+
+    label = f"{name} [{engine}{', int8' if int8 else ''}]"
+    log.info("Loading query encoder: %s", label)
+    rss_before = process_memory_mb()
+    start = timer()
+    try:
+        encoder = CompiledEncoder.load(model, name, engine, int8=int8)
+        encoder.verification = verify(model, encoder, QUERY_ENCODER_MIN_COSINE)
+    except Exception as e:
+        log.error("Query encoder %s unavailable, encoding queries with PyTorch: %s", label, e)
+        return model
+    if not encoder.verification["passed"]:
+        log.error("Query encoder %s is off by cosine %s (< %s), encoding queries with PyTorch",
+                  label, encoder.verification["min_cosine"], QUERY_ENCODER_MIN_COSINE)
+        return model
+    _stats[label] = {
+        "model": label,
+        "dtype": "int8" if int8 else "float32",
+        "threads": torch.get_num_threads(),
+        "load_seconds": round(timer() - start, 4),
+        "rss_delta_mb": round(process_memory_mb() - rss_before, 1),
+        "warmed_up": True,
+        "verification": encoder.verification,
+    }
+    log.info("Query encoder %s verified (min cosine %s)", label, encoder.verification["min_cosine"])
+    return encoder
+
+
+def get_query_encoder(name=None, engine=None, int8=None):
+    """
+    The model that encodes queries: the shared embedding model with QUERY_ENCODER_ENGINE=torch,
+    otherwise its exported engine, checked against the embedding model on first use.
+    Falls back to the embedding model when the engine can't be built or isn't close enough.
+    """
+    name = name or EMBED_MODEL_NAME
+    engine = engine or QUERY_ENCODER_ENGINE
+    int8 = QUERY_ENCODER_INT8 if int8 is None else int8
+    model = get_embedding_model(name)
+    if engine == "torch":
+        return model
+    key = (name, engine, int8)
+    encoder = _query_encoders.get(key)
+    if encoder is None:
+        with _lock:
+            encoder = _query_encoders.get(key)
+            if encoder is None:
+                encoder = _load_query_encoder(model, name, engine, int8)
+                _query_encoders[key] = encoder
+    return encoder
+
+
+def warm_up(name=None):
+    """
+    Load the model and run one dummy encode so the first real query
+    doesn't pay for lazy initialisation inside torch / the tokenizer.
+    """
+    name = name or EMBED_MODEL_NAME
+    model = get_embedding_model(name)
+    if not _stats[name]["warmed_up"]:
+        import torch
+
+        start = timer()
+        with torch.inference_mode():
+            model.encode("warm up", convert_to_tensor=True, device="cpu")
+        _stats[name]["warm_up_seconds"] = round(timer() - start, 4)
+        _stats[name]["warmed_up"] = True
+    # exports / verifies the query engine now rather than on the first query
+    get_query_encoder(name)
+    return model
+
+
+def freeze_for_fork():
+    """
+    Call in a preloading parent after warm_up() and before workers are forked.
+    gc.freeze() moves every existing object into a permanent generation so the
+    children's garbage collector never writes to (and un-shares) the model's pages.
+    """
+    gc.collect()
+    gc.freeze()
+
+
+def model_stats():
+    """Load time / memory information for /health."""
+    # compiled encoders carry describe(); a torch fallback is the SentenceTransformer itself
+    return {
+        "loaded_models": [dict(s) for s in _stats.values()],
+        "query_encoder": [e.describe() if hasattr(e, "engine") else {"engine": "torch"}
+                          for e in _query_encoders.values()] or [{"engine": "torch"}],
+        "process_rss_mb": round(process_memory_mb(), 1),
+        "pid": os.getpid(),
+    }
@@ -0,0 +1,326 @@
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
+from time import perf_counter as timer
+
+import numpy as np
+import torch
+
+from api.config import QUERY_ENCODER_EXPORT_DIR, QUERY_TOKEN_CACHE_SIZE, EMBED_NUM_THREADS
+from api.log import get_logger
+
+log = get_logger("query_encoder")
+
+# Optimized CPU engines for query encoding (QUERY_ENCODER_ENGINE, see model_registry.get_query_encoder).
+# The SentenceTransformer's transformer is exported once to QUERY_ENCODER_EXPORT_DIR and
+# later loads reuse the file:
+#   torchscript  traced + frozen TorchScript module (no extra dependency)
+#   onnx         ONNX graph run by onnxruntime with all graph optimizations (pip install onnx onnxruntime)
+# Either can be exported with dynamic int8 quantization of the Linear layers (QUERY_ENCODER_INT8).
+# Pooling and normalization are replayed from the SentenceTransformer's own modules and
+# tokenized queries are kept in an LRU, so a repeated query skips the tokenizer too.
+# An engine is only used after verify() found its embeddings within QUERY_ENCODER_MIN_COSINE
+# of the PyTorch model's on PROBE_SENTENCES.
+
+ENGINES = ("torch", "torchscript", "onnx")
+
+PROBE_SENTENCES = [
+    "What is the hydraulic system?",
+    "How do I start the APU on the ground?",
+    "Engine fire checklist",
+    "Which switches are on the overhead panel for the fuel pumps and crossfeed valve?",
+    "Explain the bleed air system, including the isolation valve, pack operation and what happens "
+    "when a bleed trip off light illuminates during climb.",
+    "flaps 15",
+    "autopilot disengage warning",
+    "What are the landing gear limits?",
+]
+
+
+class TokenCache:
+    """LRU of text -> token id arrays (unpadded), shared by all threads encoding queries."""
+
+    def __init__(self, tokenizer, max_length, max_size=QUERY_TOKEN_CACHE_SIZE):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _tokenize(self, texts):
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length)
+        types = encoded.get("token_type_ids")
+        return [(np.asarray(ids, dtype=np.int64), np.asarray(types[i], dtype=np.int64) if types else None)
+                for i, ids in enumerate(encoded["input_ids"])]
+
+    def batch(self, texts):
+        """
+        Padded model inputs for texts.
+
+        Returns:
+            Dict of int64 arrays 'input_ids', 'attention_mask' and, when the tokenizer
+            produces them, 'token_type_ids', each (len(texts), longest)
+        """
+        rows = [None] * len(texts)
+        with self._lock:
+            for i, text in enumerate(texts):
+                entry = self._entries.get(text)
+                if entry is not None:
+                    self._entries.move_to_end(text)
+                    rows[i] = entry
+        missing = [i for i, row in enumerate(rows) if row is None]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            for i, entry in zip(missing, self._tokenize([texts[i] for i in missing])):
+                rows[i] = entry
+            if self.max_size:
+                with self._lock:
+                    for i in missing:
+                        self._entries[texts[i]] = rows[i]
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+
+        longest = max(len(ids) for ids, _ in rows)
+        pad = self.tokenizer.pad_token_id or 0
+        inputs = {"input_ids": np.full((len(rows), longest), pad, dtype=np.int64),
+                  "attention_mask": np.zeros((len(rows), longest), dtype=np.int64)}
+        if rows[0][1] is not None:
+            inputs["token_type_ids"] = np.zeros((len(rows), longest), dtype=np.int64)
+        for i, (ids, types) in enumerate(rows):
+            inputs["input_ids"][i, :len(ids)] = ids
+            inputs["attention_mask"][i, :len(ids)] = 1
+            if types is not None:
+                inputs["token_type_ids"][i, :len(ids)] = types
+        return inputs
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class _TokenEmbeddings(torch.nn.Module):
+    """The transformer alone, with positional inputs so it can be traced / exported."""
+
+    def __init__(self, auto_model, input_names):
+        super().__init__()
+        self.model = auto_model
+        self.input_names = input_names
+
+    def forward(self, input_ids, attention_mask, token_type_ids=None):
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if token_type_ids is not None:
+            inputs["token_type_ids"] = token_type_ids
+        return self.model(**inputs, return_dict=False)[0]
+
+
+def _pipeline(model):
+    """(transformer module, pooling mode, normalize) of a SentenceTransformer, or ValueError."""
+    modules = list(model)
+    if not modules or not hasattr(modules[0], "auto_model") or not hasattr(modules[0], "tokenizer"):
+        raise ValueError("expected a SentenceTransformer starting with a Transformer module")
+    pooling, normalize = None, False
+    for module in modules[1:]:
+        name = type(module).__name__
+        if name == "Pooling":
+            config = module.get_config_dict()
+            # sentence-transformers >= 5 has one 'pooling_mode', older versions one flag per mode
+            mode = config.get("pooling_mode")
+            if mode == "mean" or config.get("pooling_mode_mean_tokens"):
+                pooling = "mean"
+            elif mode == "cls" or config.get("pooling_mode_cls_token"):
+                pooling = "cls"
+            else:
+                raise ValueError(f"unsupported pooling {config}")
+        elif name == "Normalize":
+            normalize = True
+        else:
+            raise ValueError(f"unsupported module {name}")
+    if pooling is None:
+        raise ValueError("no Pooling module")
+    return modules[0], pooling, normalize
+
+
+def export_path(model_name, engine, int8, export_dir=QUERY_ENCODER_EXPORT_DIR):
+    safe = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name.strip("/"))
+    suffix = "pt" if engine == "torchscript" else "onnx"
+    return os.path.join(export_dir, f"{safe}-{engine}{'-int8' if int8 else ''}.{suffix}")
+
+
+class CompiledEncoder:
+    """
+    Drop-in for SentenceTransformer.encode on the query path, running an exported engine.
+    Build with CompiledEncoder.load(model, model_name, engine, int8).
+    """
+
+    def __init__(self, engine, run, tokens, pooling, normalize, path, int8):
+        self.engine = engine
+        self.int8 = int8
+        self.path = path
+        self._run = run
+        self.tokens = tokens
+        self.pooling = pooling
+        self.normalize = normalize
+        self.max_seq_length = tokens.max_length
+        self.verification = None
+
+    @classmethod
+    def load(cls, model, model_name, engine, int8=False, export_dir=QUERY_ENCODER_EXPORT_DIR):
+        """Load the exported engine for model, exporting it first when there is no file yet."""
+        if engine not in ENGINES[1:]:
+            raise ValueError(f"Unknown query encoder engine {engine!r}, expected one of {list(ENGINES[1:])}")
+        transformer, pooling, normalize = _pipeline(model)
+        tokens = TokenCache(transformer.tokenizer, transformer.max_seq_length)
+        example = tokens.batch(PROBE_SENTENCES[:2])
+        input_names = list(example)
+
+        path = export_path(model_name, engine, int8, export_dir)
+        stamp_path = path + ".json"
+        stamp = {"model": model_name, "engine": engine, "int8": int8, "inputs": input_names,
+                 "torch": torch.__version__}
+        current = None
+        if os.path.exists(path) and os.path.exists(stamp_path):
+            with open(stamp_path, "r", encoding="utf-8") as f:
+                current = json.load(f)
+        if current != stamp:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            start = timer()
+            module = _TokenEmbeddings(transformer.auto_model, input_names).eval()
+            # workers starting together may all export: each writes its own temporary files and
+            # renames them into place (the file first, then its stamp), so no worker ever loads
+            # a half-written file or trusts a stamp whose file isn't there yet
+            tmp = f"{path}.{os.getpid()}.tmp"
+            try:
+                (_export_torchscript if engine == "torchscript" else _export_onnx)(module, example, tmp, int8)
+                os.replace(tmp, path)
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(stamp, f)
+                os.replace(tmp, stamp_path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            log.info("Exported %s query encoder%s to %s in %.2fs", engine, " (int8)" if int8 else "", path,
+                     timer() - start)
+
+        run = _load_torchscript(path) if engine == "torchscript" else _load_onnx(path)
+        return cls(engine, run, tokens, pooling, normalize, path, int8)
+
+    def _pool(self, token_embeddings, attention_mask):
+        if self.pooling == "cls":
+            pooled = token_embeddings[:, 0]
+        else:
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    def encode(self, sentences, batch_size=32, convert_to_tensor=False, **kwargs):
+        """Same call shape as SentenceTransformer.encode (device and other options are ignored, CPU only)."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        parts = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokens.batch(texts[start:start + batch_size])
+            parts.append(self._pool(self._run(inputs), inputs["attention_mask"]))
+        vectors = np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+        if single:
+            vectors = vectors[0]
+        return torch.from_numpy(vectors) if convert_to_tensor else vectors
+
+    def describe(self):
+        return {"engine": self.engine, "int8": self.int8, "export": self.path, "pooling": self.pooling,
+                "token_cache": self.tokens.stats(), "verification": self.verification}
+
+
+def _export_torchscript(module, example, path, int8):
+    if int8:
+        module = torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+    inputs = tuple(torch.from_numpy(example[name]) for name in module.input_names)
+    with torch.inference_mode():
+        traced = torch.jit.trace(module, inputs, strict=False, check_trace=False)
+    torch.jit.save(traced, path)
+
+
+def _load_torchscript(path):
+    module = torch.jit.load(path, map_location="cpu").eval()
+    try:
+        module = torch.jit.optimize_for_inference(torch.jit.freeze(module))
+    except Exception as e:  # quantized graphs can't always be frozen; the traced module still runs
+        log.warning("TorchScript freeze skipped for %s: %s", path, e)
+
+    def run(inputs):
+        with torch.inference_mode():
+            return module(*(torch.from_numpy(v) for v in inputs.values())).float().numpy()
+    return run
+
+
+def _onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError("QUERY_ENCODER_ENGINE=onnx needs onnxruntime: pip install onnxruntime")
+    return onnxruntime
+
+
+def _export_onnx(module, example, path, int8):
+    _onnxruntime()  # fail before the export, not after it
+    try:
+        import onnx  # noqa: F401 (the exporter needs it)
+    except ImportError:
+        raise ImportError("Exporting the query encoder to ONNX needs onnx: pip install onnx")
+    names = module.input_names
+    fp32_path = path if not int8 else path + ".fp32"
+    with torch.inference_mode():
+        torch.onnx.export(module, tuple(torch.from_numpy(example[n]) for n in names), fp32_path,
+                          input_names=names, output_names=["token_embeddings"],
+                          dynamic_axes={**{n: {0: "batch", 1: "sequence"} for n in names},
+                                        "token_embeddings": {0: "batch", 1: "sequence"}},
+                          opset_version=17, dynamo=False)
+    if int8:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+
+
+def _load_onnx(path):
+    ort = _onnxruntime()
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if EMBED_NUM_THREADS > 0:
+        options.intra_op_num_threads = EMBED_NUM_THREADS
+    session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+    expected = {i.name for i in session.get_inputs()}
+
+    def run(inputs):
+        return session.run(None, {k: v for k, v in inputs.items() if k in expected})[0]
+    return run
+
+
+def verify(reference, encoder, min_cosine, sentences=PROBE_SENTENCES):
+    """
+    Compare encoder's embeddings with the reference (PyTorch) model's, one by one and batched.
+
+    Returns:
+        Dict with 'min_cosine', 'mean_cosine', 'max_abs_diff' and 'passed'
+    """
+    with torch.inference_mode():
+        expected = reference.encode(sentences, convert_to_tensor=True, device="cpu").float().numpy()
+    batched = encoder.encode(sentences)
+    single = np.stack([encoder.encode(s) for s in sentences])
+    cosines = []
+    for got in (batched, single):
+        norms = np.linalg.norm(expected, axis=1) * np.linalg.norm(got, axis=1)
+        cosines.append((expected * got).sum(axis=1) / np.clip(norms, 1e-12, None))
+    cosines = np.concatenate(cosines)
+    result = {
+        "min_cosine": round(float(cosines.min()), 6),
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "max_abs_diff": round(float(max(np.abs(expected - batched).max(), np.abs(expected - single).max())), 6),
+        "threshold": min_cosine,
+    }
+    result["passed"] = result["min_cosine"] >= min_cosine
+    return result
@@ -0,0 +1,177 @@
+import os
+import json
+import threading
+from collections import Counter as Tally
+
+from api.answer_cache import normalize_query
+from api.metrics import Counter
+from api.log import get_logger
+
+log = get_logger("query_log")
+
+# Capture of the /ask traffic: one compact JSON line per request with its time, the query
+# parameters as sent, the model used, the retrieved chunk ids, the stage timings and the
+# outcome. A request only appends a dict to an in-memory buffer; a background thread
+# serializes the buffer and appends it to the file every flush interval, so the request
+# path never waits for the disk. When the buffer is full (the disk can't keep up) new
+# records are dropped and counted rather than waited for.
+# The log is read back by replay_queries.py (most frequent queries, pre-warming a running
+# instance, replay at N x speed) and by the startup pre-warm (QUERY_LOG_PREWARM).
+
+RECORDS = Counter("rag_query_log_records_total", "Query log records written or dropped", ("outcome",))
+
+# /ask parameters a record keeps (when the request set them); replay sends them again
+REQUEST_FIELDS = ("query", "top_k", "model", "nprobe", "doc", "chapter", "page_start", "page_end", "mode",
+                  "fusion", "alpha", "max_context_tokens", "rerank", "rerank_budget_ms", "retrieval_only")
+
+
+class QueryLog:
+    def __init__(self, path, flush_seconds=1.0, max_pending=10000, max_bytes=0):
+        """
+        Args:
+            path: JSONL file records are appended to
+            flush_seconds: How often the writer thread appends the buffered records
+            max_pending: Records buffered before new ones are dropped
+            max_bytes: Rotate the file to <path>.1 when it would grow past this (0 = never)
+        """
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+        self.written = 0
+        self.dropped = 0
+        self.write_errors = 0
+
+    def start(self):
+        """Start the writer thread (in the serving process, not a preloading parent)."""
+        if self._thread is not None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="query-log", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write what is buffered and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(timeout=10)
+        self._thread = None
+
+    def append(self, record):
+        """Queue one record; returns False when it was dropped because the buffer is full."""
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                RECORDS.inc(outcome="dropped")
+                return False
+            self._pending.append(record)
+            # half full: write now instead of at the next interval
+            if len(self._pending) == self.max_pending // 2:
+                self._wake.set()
+        return True
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """Append the buffered records to the file (called by the writer thread); returns how many."""
+        with self._lock:
+            records, self._pending = self._pending, []
+        if not records:
+            return 0
+        data = "".join(json.dumps(r, separators=(",", ":"), ensure_ascii=False) + "\n"
+                       for r in records).encode("utf-8")
+        try:
+            self._rotate(len(data))
+            # one appending write per flush, so workers sharing the file keep whole lines
+            with open(self.path, "ab") as f:
+                f.write(data)
+        except OSError as e:
+            self.write_errors += 1
+            self.dropped += len(records)
+            RECORDS.inc(len(records), outcome="dropped")
+            log.error("Query log write to %s failed, %d records lost: %s", self.path, len(records), e)
+            return 0
+        self.written += len(records)
+        RECORDS.inc(len(records), outcome="written")
+        return len(records)
+
+    def _rotate(self, incoming):
+        if self.max_bytes <= 0:
+            return
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size and size + incoming > self.max_bytes:
+            os.replace(self.path, self.path + ".1")
+            log.info("Query log rotated to %s.1 (%.1f MB)", self.path, size / 1e6)
+
+    def stats(self):
+        """Path, written / dropped counts and buffer depth for /health."""
+        return {
+            "path": self.path,
+            "written": self.written,
+            "dropped": self.dropped,
+            "pending": len(self._pending),
+            "write_errors": self.write_errors,
+            "flush_seconds": self.flush_seconds,
+        }
+
+
+def read_log(path, since=None):
+    """
+    Records of a query log, oldest first (the rotated <path>.1, then path). Lines that
+    don't parse, such as one cut off by a crash, are skipped.
+
+    Args:
+        path: Query log file
+        since: Only records with "ts" >= since (unix time)
+    """
+    for file_path in (path + ".1", path):
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict) or not record.get("query"):
+                    continue
+                if since is not None and record.get("ts", 0) < since:
+                    continue
+                yield record
+
+
+def top_queries(records, n):
+    """
+    The n most frequent queries (compared normalized, as the answer cache does), most
+    frequent first. Each is the latest record of that query with its "count" added.
+    """
+    counts = Tally()
+    latest = {}
+    for record in records:
+        key = normalize_query(record["query"])
+        counts[key] += 1
+        latest[key] = record
+    return [dict(latest[key], count=count) for key, count in counts.most_common(n)]
+
+
+def request_params(record):
+    """The /ask query parameters of a record, to send the same request again."""
+    return {field: record[field] for field in REQUEST_FIELDS if record.get(field) is not None}
@@ -0,0 +1,125 @@
+import threading
+from collections import OrderedDict
+from time import perf_counter as timer
+
+from api.answer_cache import normalize_query
+from api.model_registry import get_cross_encoder
+from api.config import RERANK_BATCH_SIZE, RERANK_CACHE_SIZE
+
+# Cross-encoder re-ranking of retrieved candidates.
+# The bi-encoder search retrieves a wide candidate set cheaply; the cross-encoder reads
+# query and chunk together and scores each pair far more precisely, so only the best
+# few chunks go into the prompt. Candidates are scored in batches in retrieval order
+# (best first) until the request's deadline: a batch that would not finish in time is
+# not started, and unscored candidates follow the scored ones in retrieval order.
+# Pair scores are cached per (normalized query, chunk), so a repeated question over the
+# same chunks skips the model. Chunks are identified within their store's build lineage
+# (api/store.py), since a full rebuild gives the same ids to other texts.
+
+
+def _chunk_key(chunk):
+    return getattr(chunk, "lineage_id", None), chunk.get("doc_id"), chunk["chunk_id"]
+
+
+class Reranker:
+    def __init__(self, model_loader=get_cross_encoder, batch_size=RERANK_BATCH_SIZE, cache_size=RERANK_CACHE_SIZE):
+        """
+        Args:
+            model_loader: Callable returning an object with predict(pairs, batch_size=...) -> scores
+            batch_size: Pairs per forward pass; also the granularity of the deadline check
+            cache_size: Cached (query, chunk) scores, 0 disables the cache
+        """
+        self.model_loader = model_loader
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # running estimate of the seconds one pair takes, to decide whether a batch still fits
+        self._pair_seconds = None
+
+        self.requests = 0
+        self.truncated = 0
+        self.pairs_scored = 0
+        self.cache_hits = 0
+
+    def _cached(self, key):
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _store(self, keys, scores):
+        if not self.cache_size:
+            return
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._cache[key] = score
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _predict(self, query, chunks):
+        started = timer()
+        scores = self.model_loader().predict([(query, c["text"]) for c in chunks], batch_size=len(chunks))
+        per_pair = (timer() - started) / len(chunks)
+        self._pair_seconds = per_pair if self._pair_seconds is None else 0.8 * self._pair_seconds + 0.2 * per_pair
+        return [float(s) for s in scores]
+
+    def rerank(self, query, candidates, top_k, deadline=None):
+        """
+        Re-order candidates (chunk dicts from the retriever, best first) by cross-encoder score.
+
+        Args:
+            deadline: perf_counter() time by which scoring must stop (None = no limit)
+        Returns:
+            (top_k chunks, stats); re-scored chunks carry 'rerank_score', the others None
+        """
+        started = timer()
+        normalized = normalize_query(query)
+        scores = [self._cached((normalized, _chunk_key(c))) for c in candidates]
+        cache_hits = sum(s is not None for s in scores)
+        pending = [i for i, s in enumerate(scores) if s is None]
+
+        truncated = False
+        for start in range(0, len(pending), self.batch_size):
+            rows = pending[start:start + self.batch_size]
+            # stop when the deadline has passed or this batch is not expected to finish before it
+            if deadline is not None and timer() + (self._pair_seconds or 0.0) * len(rows) > deadline:
+                truncated = True
+                break
+            batch_scores = self._predict(query, [candidates[i] for i in rows])
+            for i, score in zip(rows, batch_scores):
+                scores[i] = score
+            self._store([(normalized, _chunk_key(candidates[i])) for i in rows], batch_scores)
+            self.pairs_scored += len(rows)
+
+        scored = sorted((i for i, s in enumerate(scores) if s is not None), key=lambda i: scores[i], reverse=True)
+        unscored = [i for i, s in enumerate(scores) if s is None]
+        results = []
+        for i in (scored + unscored)[:top_k]:
+            chunk = candidates[i].copy()
+            chunk["rerank_score"] = scores[i]
+            results.append(chunk)
+
+        self.requests += 1
+        self.cache_hits += cache_hits
+        self.truncated += truncated
+        return results, {
+            "candidates": len(candidates),
+            "scored": len(candidates) - len(unscored),
+            "cache_hits": cache_hits,
+            "truncated": truncated,
+            "rerank_ms": round((timer() - started) * 1000, 3),
+        }
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "truncated": self.truncated,
+            "pairs_scored": self.pairs_scored,
+            "cache_hits": self.cache_hits,
+            "cache_entries": len(self._cache),
+            "pair_ms": round(self._pair_seconds * 1000, 3) if self._pair_seconds is not None else None,
+        }
@@ -1,23 +1,22 @@
-import torch
-from sentence_transformers import SentenceTransformer, util
+import numpy as np
 from time import perf_counter as timer
 
-MODEL_NAME = "all-MiniLM-L6-v2"
+from api.model_registry import get_query_encoder
+from api.metrics import span, stage_group
+from api.log import get_logger, SAMPLED
+
+log = get_logger("retriever")
 
-_model = None
 
 def get_model():
-    """Lazy load the embedding model on CPU."""
-    global _model
-    if _model is None:
-        print(f"[INFO] Loading model: {MODEL_NAME}")
-        _model = SentenceTransformer(MODEL_NAME)
-        # Force model to CPU
-        _model = _model.to('cpu')
-    return _model
+    """
+    Return the query encoder: the shared embedding model (same instance the embedder
+    uses), or its exported engine with QUERY_ENCODER_ENGINE=torchscript / onnx.
+    """
+    return get_query_encoder()
 
 
-def search(query, chunks, embeddings_tensor, top_k=5):
+def search(query, chunks, embeddings_tensor, top_k=5, index=None, nprobe=None):
     """
     Perform semantic search using dot product.
     All operations forced to CPU to avoid device mismatch.
@@ -27,10 +26,14 @@ def search(query, chunks, embeddings_tensor, top_k=5):
         chunks: List of chunk dictionaries
         embeddings_tensor: Torch tensor of all embeddings (on CPU)
         top_k: Number of results to return
+        index: Optional nearest-neighbour index (api/ann_index.py); exact scan when None
+        nprobe: IVF clusters to scan for this query (recall/latency knob)
     """
     if not chunks:
         return []
-    
+
+    import torch
+
     model = get_model()
     
     start_time = timer()
@@ -50,26 +53,227 @@ def search(query, chunks, embeddings_tensor, top_k=5):
     if query_embedding.device.type != 'cpu':
         query_embedding = query_embedding.cpu()
 
+    # The binary store may hold float16 vectors; match the query to the matrix dtype
+    if query_embedding.dtype != embeddings_tensor.dtype:
+        query_embedding = query_embedding.to(embeddings_tensor.dtype)
+
+    if index is not None:
+        # Index path: the index does its own scoring + top-k over the query
+        scores, ids = index.search(query_embedding.float().numpy()[None, :], top_k, nprobe=nprobe)
+        end_time = timer()
+        log.debug("Search (%s) took %.5f seconds for %d chunks", index.kind, end_time - start_time, len(chunks),
+                  extra=SAMPLED)
+        return _collect_results(chunks, scores[0].tolist(), ids[0].tolist())
+
     # calcuate similarity scores using dot product and get top k results
     
     # Calculate dot product scores
-    dot_scores = util.dot_score(a=query_embedding, b=embeddings_tensor)[0]
+    dot_scores = query_embedding @ embeddings_tensor.T
     
     end_time = timer()
     
-    print(f"[INFO] Search took {end_time - start_time:.5f} seconds for {len(chunks)} chunks")
+    log.debug("Search took %.5f seconds for %d chunks", end_time - start_time, len(chunks), extra=SAMPLED)
     
     # Get top k results
     top_results = torch.topk(dot_scores, k=min(top_k, len(chunks)))
     
-    # Extract the matching chunks
+    return _collect_results(chunks, top_results.values.tolist(), top_results.indices.tolist())
+
+
+def encode_queries(queries):
+    """Encode a list of queries in a single forward pass, returns a float32 (Q, dim) array."""
+    model = get_model()
+    vectors = model.encode(
+        list(queries),
+        convert_to_tensor=True,
+        device='cpu'
+    )
+    return vectors.cpu().float().numpy()
+
+
+def search_batch(queries, chunks, embeddings_tensor, top_k=5, index=None, nprobe=None,
+                 return_query_vectors=False, filters=None, layout=None):
+    """
+    Search several queries at once: one batched encode and one matrix-matrix
+    product (or one batched index call per distinct nprobe) for the whole batch.
+
+    Args:
+        queries: List of query strings
+        chunks: List of chunk dictionaries
+        embeddings_tensor: Torch tensor of all embeddings (on CPU)
+        top_k: int, or a list with one top_k per query
+        index: Optional nearest-neighbour index; exact scan when None
+        nprobe: None/int, or a list with one nprobe per query
+        return_query_vectors: Also return the (Q, dim) query embeddings
+        filters: None, or a list with one SearchFilter (or None) per query (api/corpus.py)
+        layout: CorpusLayout that resolves the filters to row ranges
+    Returns:
+        One result list per query, same format as search()
+        (and the query embeddings when return_query_vectors is set)
+    """
+    if not chunks or not queries:
+        empty = [[] for _ in queries]
+        return (empty, None) if return_query_vectors else empty
+
+    top_ks = top_k if isinstance(top_k, (list, tuple)) else [top_k] * len(queries)
+    nprobes = nprobe if isinstance(nprobe, (list, tuple)) else [nprobe] * len(queries)
+    filters = filters if filters is not None else [None] * len(queries)
+    k = max(top_ks)
+
+    start_time = timer()
+    with span("encode"):
+        query_vectors = encode_queries(queries)
+
+    if embeddings_tensor.device.type != 'cpu':
+        embeddings_tensor = embeddings_tensor.cpu()
+
+    all_scores = [None] * len(queries)
+    all_ids = [None] * len(queries)
+    unfiltered = [row for row, f in enumerate(filters) if f is None]
+    if unfiltered and index is None:
+        import torch
+
+        q = torch.from_numpy(query_vectors[unfiltered]).to(embeddings_tensor.dtype)
+        with span("score"):
+            scores = q @ embeddings_tensor.T
+        with span("topk"):
+            top_results = torch.topk(scores, k=min(k, len(chunks)), dim=1)
+        for pos, row in enumerate(unfiltered):
+            all_scores[row] = top_results.values[pos].float().tolist()
+            all_ids[row] = top_results.indices[pos].tolist()
+    elif unfiltered:
+        # group rows by nprobe so each group is a single batched index call
+        groups = {}
+        for row in unfiltered:
+            groups.setdefault(nprobes[row], []).append(row)
+        for n, rows in groups.items():
+            with stage_group():  # the index times its own score and topk sections
+                scores, ids = index.search(query_vectors[rows], k, nprobe=n)
+            for pos, row in enumerate(rows):
+                all_scores[row] = scores[pos].tolist()
+                all_ids[row] = ids[pos].tolist()
+
+    # filtered rows: one exact scan per distinct filter, over its row ranges only
+    filter_groups = {}
+    for row, f in enumerate(filters):
+        if f is not None:
+            filter_groups.setdefault(f, []).append(row)
+    for f, rows in filter_groups.items():
+        with stage_group():
+            scores, ids = _search_ranges(query_vectors[rows], embeddings_tensor, layout.resolve(f), k)
+        for pos, row in enumerate(rows):
+            all_scores[row] = scores[pos].tolist()
+            all_ids[row] = ids[pos].tolist()
+
+    log.debug("Batched search of %d queries took %.5f seconds", len(queries), timer() - start_time, extra=SAMPLED)
+
+    results = [
+        _collect_results(chunks, all_scores[row][:top_ks[row]], all_ids[row][:top_ks[row]])
+        for row in range(len(queries))
+    ]
+    if return_query_vectors:
+        return results, query_vectors
+    return results
+
+
+def search_lexical(query, chunks, bm25, top_k=5, ranges=None):
+    """
+    BM25 keyword search (api/bm25.py), same result format as search().
+
+    Args:
+        ranges: Optional row ranges from CorpusLayout.resolve (filtered /ask)
+    """
+    if not chunks or bm25 is None:
+        return []
+    start_time = timer()
+    with span("lexical"):
+        scores, ids = bm25.search(query, top_k, ranges=ranges)
+    log.debug("Lexical search took %.5f seconds for %d chunks", timer() - start_time, len(chunks), extra=SAMPLED)
+    return _collect_results(chunks, scores.tolist(), ids.tolist())
+
+
+def _result_key(chunk):
+    return chunk.get("doc_id"), chunk["chunk_id"]
+
+
+def fuse_results(dense_results, lexical_results, top_k=5, method="rrf", alpha=0.5, rrf_k=60):
+    """
+    Merge dense and lexical result lists into one ranking.
+
+    Args:
+        method: "rrf" (reciprocal rank fusion: sum of 1 / (rrf_k + rank)) or
+            "weighted" (alpha * dense + (1 - alpha) * lexical, each min-max scaled to [0, 1])
+        alpha: Weight of the dense scores for the weighted method
+    Returns:
+        Top-k chunk dicts; 'score' is the fused score, 'dense_score' / 'lexical_score'
+        keep the original ones (None when the chunk came from one retriever only)
+    """
+    if method not in ("rrf", "weighted"):
+        raise ValueError(f"Unknown fusion method {method!r}, expected 'rrf' or 'weighted'")
+
+    def scaled(results):
+        if not results:
+            return {}
+        scores = [r["score"] for r in results]
+        lo, hi = min(scores), max(scores)
+        return {_result_key(r): (r["score"] - lo) / (hi - lo) if hi > lo else 1.0 for r in results}
+
+    fused, merged = {}, {}
+    for name, results in (("dense", dense_results), ("lexical", lexical_results)):
+        weight = alpha if name == "dense" else 1 - alpha
+        norm = scaled(results) if method == "weighted" else None
+        for rank, chunk in enumerate(results):
+            key = _result_key(chunk)
+            if key not in merged:
+                merged[key] = chunk.copy()
+                merged[key].update(dense_score=None, lexical_score=None)
+            merged[key][f"{name}_score"] = chunk["score"]
+            if method == "rrf":
+                fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            else:
+                fused[key] = fused.get(key, 0.0) + weight * norm[key]
+
+    ranked = sorted(fused, key=fused.get, reverse=True)[:top_k]
+    results = []
+    for key in ranked:
+        chunk = merged[key]
+        chunk["score"] = float(fused[key])
+        results.append(chunk)
+    return results
+
+
+def _search_ranges(query_vectors, embeddings_tensor, ranges, k):
+    """
+    Exact top-k restricted to row ranges of the matrix. Only the rows inside the
+    ranges are scored (slices are views, nothing is copied), so a narrow filter
+    costs a fraction of a full scan.
+    """
+    if not ranges:
+        empty = np.empty((len(query_vectors), 0))
+        return empty.astype(np.float32), empty.astype(np.int64)
+    import torch
+
+    q = torch.from_numpy(query_vectors).to(embeddings_tensor.dtype)
+    with span("score"):
+        scores = torch.cat([q @ embeddings_tensor[start:stop].T for start, stop in ranges], dim=1)
+    with span("topk"):
+        row_ids = torch.cat([torch.arange(start, stop) for start, stop in ranges])
+        top_results = torch.topk(scores, k=min(k, scores.shape[1]), dim=1)
+    return top_results.values.float().numpy(), row_ids[top_results.indices].numpy()
+
+
+def _collect_results(chunks, scores, ids):
+    """Extract the matching chunks, skipping padding ids (-1) from partial index results."""
     results = []
-    for score, idx in zip(top_results.values, top_results.indices):
-        chunk = chunks[idx.item()].copy()
-        chunk['score'] = score.item()
+    for score, idx in zip(scores, ids):
+        if idx < 0:
+            continue
+        chunk = chunks[idx].copy()
+        chunk['score'] = float(score)
         results.append(chunk)
     
-    print(f"[INFO] Top score: {results[0]['score']:.4f}")
+    if results:
+        log.debug("Top score: %.4f", results[0]['score'], extra=SAMPLED)
     
     return results
 
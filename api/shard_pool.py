@@ -0,0 +1,156 @@
+import os
+import threading
+import multiprocessing
+
+import numpy as np
+
+from api.ann_index import _topk_rows
+from api.shard_worker import serve, process_memory
+from api.log import get_logger
+from api.metrics import span
+
+# Exact search split over worker processes, for corpora one core can't scan fast enough.
+# The rows of the corpus are cut into `shards` contiguous ranges, dealt round-robin to
+# `workers` processes. Every worker memory-maps the store's vectors files read-only, so
+# the vectors are in memory once (the OS page cache), however many workers there are; a
+# worker's private memory is its interpreter plus one scoring block. A search sends the
+# query vectors to every worker, each returns the top-k over its shards, and the pool
+# merges them into the global top-k. Used as the index of an IndexState (SHARD_WORKERS > 0,
+# see api/index_state.py) in place of the in-process FlatIndex.
+
+log = get_logger("shard_pool")
+
+
+def partition(sources, shards):
+    """
+    Cut the corpus rows into `shards` near-equal contiguous ranges.
+
+    Args:
+        sources: (vectors .npy path, first corpus row, rows) per file, in corpus order
+        shards: Number of ranges
+    Returns:
+        One list per shard of (path, start, stop, offset) pieces: rows [start, stop) of the
+        file, whose row 0 is corpus row `offset` (a range can span files)
+    """
+    total = sum(rows for _, _, rows in sources)
+    shards = max(1, min(shards, total))
+    bounds = np.linspace(0, total, shards + 1).astype(np.int64)
+    pieces = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        shard = []
+        for path, offset, rows in sources:
+            start, stop = max(lo, offset), min(hi, offset + rows)
+            if start < stop:
+                shard.append((path, int(start - offset), int(stop - offset), offset))
+        pieces.append(shard)
+    return pieces
+
+
+class ShardPool:
+    kind = "process"
+
+    def __init__(self, sources, workers, shards=0, threads=1, block_rows=65536):
+        """
+        Args:
+            sources: (vectors .npy path, first corpus row, rows) per file, in corpus order
+            workers: Worker processes
+            shards: Row ranges (0 = one per worker); more shards than workers gives each
+                worker several smaller scans
+            threads: BLAS threads per worker
+            block_rows: Rows scored at a time inside a worker
+        """
+        self.sources = sources
+        self.count = sum(rows for _, _, rows in sources)
+        self.shards = partition(sources, shards or max(1, workers))
+        # a worker without a shard would have nothing to scan
+        self.workers = max(1, min(workers, len(self.shards)))
+        self.threads = threads
+        self.block_rows = block_rows
+        self._assigned = [[piece for shard in self.shards[w::self.workers] for piece in shard]
+                          for w in range(self.workers)]
+        self._lock = threading.Lock()
+        self._procs = []
+        self._pid = None
+        self._searches = 0
+        self.start()
+
+    def __len__(self):
+        return self.count
+
+    def start(self):
+        """Spawn the workers and wait until each has mapped its shards."""
+        # spawn, not fork: the API process has torch's thread pools, which don't survive a fork
+        context = multiprocessing.get_context("spawn")
+        procs = []
+        for w, pieces in enumerate(self._assigned):
+            conn, child_conn = context.Pipe()
+            proc = context.Process(target=serve, args=(child_conn, pieces, self.threads, self.block_rows),
+                                   name=f"shard-worker-{w}", daemon=True)
+            proc.start()
+            child_conn.close()
+            procs.append((proc, conn))
+        self._procs = procs
+        for proc, conn in procs:
+            try:
+                conn.recv()
+            except EOFError:
+                self._stop()
+                raise RuntimeError(f"{proc.name} exited while mapping its shards (exit code {proc.exitcode})")
+        self._pid = os.getpid()
+        log.info("Shard pool: %d rows in %d shards over %d workers", self.count, len(self.shards), self.workers)
+
+    def search(self, query_vectors, k, **params):
+        """Exact top-k over the whole corpus; (scores, ids) arrays of shape (num_queries, k)."""
+        queries = np.ascontiguousarray(np.asarray(query_vectors, dtype=np.float32))
+        with self._lock:
+            # workers started by a preloading parent belong to the parent; start our own
+            if self._pid != os.getpid():
+                self.start()
+            try:
+                # the workers score and select their shards' top-k; only the merge is "topk" here
+                with span("score"):
+                    for _, conn in self._procs:
+                        conn.send(("search", queries, k))
+                    replies = [conn.recv() for _, conn in self._procs]
+            except (EOFError, OSError) as e:
+                # a worker died: start a fresh set for the next query
+                self._stop()
+                self.start()
+                raise RuntimeError(f"Shard worker failed: {e}")
+            self._searches += 1
+        errors = [reply[1] for reply in replies if reply[0] != "ok"]
+        if errors:
+            raise RuntimeError(f"Shard search failed: {errors[0]}")
+        with span("topk"):
+            scores = np.concatenate([reply[1] for reply in replies], axis=1)
+            ids = np.concatenate([reply[2] for reply in replies], axis=1)
+            top_scores, top_pos = _topk_rows(scores, k)
+        return top_scores, np.take_along_axis(ids, top_pos, axis=1)
+
+    def _stop(self):
+        for proc, conn in self._procs:
+            try:
+                conn.send(("stop",))
+            except (OSError, ValueError):
+                pass
+        for proc, conn in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+            conn.close()
+        self._procs = []
+
+    def close(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                self._stop()
+
+    def stats(self):
+        """Shard layout and per-worker memory for /health and the benchmarks."""
+        return {
+            "workers": self.workers,
+            "shards": len(self.shards),
+            "rows": self.count,
+            "searches": self._searches,
+            "worker_memory": [{"pid": proc.pid, **(process_memory(proc.pid) or {})} for proc, _ in self._procs],
+        }
@@ -0,0 +1,83 @@
+import os
+
+# Code that runs inside the worker processes of api/shard_pool.py. Kept apart from the
+# pool so a freshly spawned worker sets its BLAS thread count before numpy is imported
+# (numpy reads it once, at import); nothing here imports numpy at module level.
+
+
+def serve(conn, shards, threads, block_rows):
+    """
+    Worker main loop. Maps its shards' vectors files read-only (the page cache is shared
+    with the other workers and the API process), then answers ("search", queries, k)
+    messages with the top-k over all of its shards until it gets ("stop",).
+    """
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    import numpy as np
+    from api.ann_index import _topk_rows
+
+    vectors = {}
+    for path, _, _, _ in shards:
+        if path not in vectors:
+            vectors[path] = np.load(path, mmap_mode="r")
+    conn.send(("ready", os.getpid()))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message[0] == "stop":
+            return
+        _, queries, k = message
+        try:
+            results = [search_rows(vectors[path], start, stop, offset, queries, k, block_rows)
+                       for path, start, stop, offset in shards]
+            scores = np.concatenate([r[0] for r in results], axis=1)
+            ids = np.concatenate([r[1] for r in results], axis=1)
+            top_scores, top_pos = _topk_rows(scores, k)
+            conn.send(("ok", top_scores, np.take_along_axis(ids, top_pos, axis=1)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def search_rows(vectors, start, stop, offset, queries, k, block_rows):
+    """
+    Exact top-k of queries (float32, num_queries x dim) over rows [start, stop) of a
+    vectors matrix, scanned in blocks so the score matrix stays num_queries x block_rows.
+    Returns (scores, ids) with ids shifted by offset (the matrix's first row in the corpus).
+    """
+    import numpy as np
+    from api.ann_index import _topk_rows
+
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    best_ids = np.empty((len(queries), 0), dtype=np.int64)
+    for block_start in range(start, stop, block_rows):
+        block_stop = min(block_start + block_rows, stop)
+        block = np.asarray(vectors[block_start:block_stop], dtype=np.float32)
+        scores, pos = _topk_rows(queries @ block.T, k)
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+        best_ids = np.concatenate([best_ids, pos + block_start], axis=1)
+        if best_scores.shape[1] > k:
+            best_scores, keep = _topk_rows(best_scores, k)
+            best_ids = np.take_along_axis(best_ids, keep, axis=1)
+    return best_scores, best_ids + offset
+
+
+def process_memory(pid="self"):
+    """
+    Resident, proportional (shared pages split between their users) and anonymous memory in MB.
+    Anonymous memory is what the process owns outright (heap, score blocks); mapped vectors
+    pages are page cache, counted in RSS and PSS only.
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in ("Rss", "Pss", "Anonymous"):
+                    fields[name] = int(rest.split()[0]) / 1024
+    except OSError:
+        return None
+    return {"rss_mb": round(fields.get("Rss", 0), 1), "pss_mb": round(fields.get("Pss", 0), 1),
+            "anon_mb": round(fields.get("Anonymous", 0), 1)}
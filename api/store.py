@@ -0,0 +1,325 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import warnings
+import numpy as np
+
+from api.chunk_table import ChunkTable
+
+# Binary embedding store.
+# Layout of a store directory:
+#   vectors.npy       float32 (or float16) matrix of shape (num_chunks, dim)
+#   chunk_ids.npy     int64 chunk ids
+#   page_numbers.npy  int32 page numbers
+#   text_offsets.npy  int64 byte offsets into texts.bin (num_chunks + 1 entries)
+#   texts.bin         utf-8 chunk texts concatenated back to back
+#   chunk_hashes.npy  content hash of each chunk text (incremental builds)
+#   page_hashes.json  content hash of each page of the source PDF (incremental builds)
+#   tombstones.npy    chunk ids removed by incremental builds, never reused
+#   meta.json         count, dim, dtype, format version, build id and next free chunk id
+#                     (+ doc_id / title / chapters for corpus shards, see api/corpus.py)
+# Everything is plain .npy so it can be memory-mapped read-only and wrapped as
+# a tensor without copying, instead of parsing floats out of a CSV.
+
+STORE_VERSION = 1
+
+VECTORS_FILE = "vectors.npy"
+CHUNK_IDS_FILE = "chunk_ids.npy"
+PAGE_NUMBERS_FILE = "page_numbers.npy"
+TEXT_OFFSETS_FILE = "text_offsets.npy"
+TEXTS_FILE = "texts.bin"
+META_FILE = "meta.json"
+CHUNK_HASHES_FILE = "chunk_hashes.npy"
+PAGE_HASHES_FILE = "page_hashes.json"
+TOMBSTONES_FILE = "tombstones.npy"
+
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+def _atomic_save_npy(path, array):
+    """Write an .npy file next to its final location and rename it into place."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def _atomic_write_bytes(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def content_hash(text):
+    """Short stable hash of a page or chunk text."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _write_meta(store_dir, count, dim, dtype, extra_meta=None):
+    build_id = uuid.uuid4().hex
+    meta = {
+        "version": STORE_VERSION,
+        "count": int(count),
+        "dim": int(dim),
+        "dtype": dtype,
+        # changes on every build, so a running API can tell the store was replaced
+        "build_id": build_id,
+        # kept by incremental builds (extra_meta), new with every full build; see lineage_id
+        "lineage_id": build_id,
+    }
+    meta.update(extra_meta or {})
+    # meta.json goes last so a half-written store is never mistaken for a complete one
+    _atomic_write_bytes(os.path.join(store_dir, META_FILE), json.dumps(meta, indent=2).encode("utf-8"))
+
+
+def encode_texts(texts):
+    """Pack a list of strings into (offsets, utf-8 blob)."""
+    encoded = [t.encode("utf-8") for t in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return offsets, b"".join(encoded)
+
+
+def write_store(store_dir, vectors, chunk_ids, page_numbers, texts, dtype="float32", extra_meta=None):
+    """
+    Write embeddings and chunk columns to a binary store directory.
+
+    Args:
+        store_dir: Directory to write into (created if missing)
+        vectors: Array-like of shape (num_chunks, dim)
+        chunk_ids: Sequence of chunk ids
+        page_numbers: Sequence of page numbers
+        texts: Sequence of chunk texts
+        dtype: "float32" or "float16" for the vector matrix
+        extra_meta: Additional keys for meta.json
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported store dtype {dtype!r}, expected one of {SUPPORTED_DTYPES}")
+
+    vectors = np.ascontiguousarray(np.asarray(vectors, dtype=dtype))
+    if vectors.ndim != 2:
+        raise ValueError(f"Expected a 2D embedding matrix, got shape {vectors.shape}")
+    if not (len(vectors) == len(chunk_ids) == len(page_numbers) == len(texts)):
+        raise ValueError("vectors, chunk_ids, page_numbers and texts must have the same length")
+
+    os.makedirs(store_dir, exist_ok=True)
+
+    offsets, blob = encode_texts(texts)
+
+    _atomic_save_npy(os.path.join(store_dir, VECTORS_FILE), vectors)
+    _atomic_save_npy(os.path.join(store_dir, CHUNK_IDS_FILE), np.asarray(chunk_ids, dtype=np.int64))
+    _atomic_save_npy(os.path.join(store_dir, PAGE_NUMBERS_FILE), np.asarray(page_numbers, dtype=np.int32))
+    _atomic_save_npy(os.path.join(store_dir, TEXT_OFFSETS_FILE), offsets)
+    _atomic_write_bytes(os.path.join(store_dir, TEXTS_FILE), blob)
+    _atomic_save_npy(os.path.join(store_dir, CHUNK_HASHES_FILE),
+                     np.asarray([content_hash(t) for t in texts], dtype="S16"))
+
+    extra_meta = dict(extra_meta or {})
+    extra_meta.setdefault("next_chunk_id", int(max(chunk_ids, default=-1)) + 1)
+    _write_meta(store_dir, vectors.shape[0], vectors.shape[1], dtype, extra_meta)
+
+
+class StoreWriter:
+    """
+    Incremental store writer: vectors, ids, pages and texts are appended batch by
+    batch and streamed to disk, so building a store never holds the whole corpus
+    in memory. Call close() to finalise (files are only renamed into place then).
+    """
+
+    def __init__(self, store_dir, dim, dtype="float32"):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported store dtype {dtype!r}, expected one of {SUPPORTED_DTYPES}")
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+
+        self._vectors_raw = open(os.path.join(store_dir, VECTORS_FILE + ".raw"), "wb")
+        self._texts = open(os.path.join(store_dir, TEXTS_FILE + ".tmp"), "wb")
+        self._chunk_ids = []
+        self._page_numbers = []
+        self._chunk_hashes = []
+        self._offsets = [0]
+
+    def append(self, vectors, chunk_ids, page_numbers, texts):
+        vectors = np.ascontiguousarray(np.asarray(vectors, dtype=self.dtype))
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of shape (n, {self.dim}), got {vectors.shape}")
+        if not (len(vectors) == len(chunk_ids) == len(page_numbers) == len(texts)):
+            raise ValueError("vectors, chunk_ids, page_numbers and texts must have the same length")
+
+        self._vectors_raw.write(vectors.tobytes())
+        for text in texts:
+            encoded = text.encode("utf-8")
+            self._texts.write(encoded)
+            self._offsets.append(self._offsets[-1] + len(encoded))
+        self._chunk_ids.extend(int(c) for c in chunk_ids)
+        self._page_numbers.extend(int(p) for p in page_numbers)
+        self._chunk_hashes.extend(content_hash(t) for t in texts)
+        self.count += len(vectors)
+
+    def close(self, page_hashes=None, tombstones=None, next_chunk_id=None, extra_meta=None):
+        """
+        Args:
+            page_hashes: Optional {page_number: hash} of the source PDF
+            tombstones: Optional chunk ids removed since the previous build
+            next_chunk_id: First id a later incremental build may assign
+            extra_meta: Additional keys for meta.json (document id, chapters, ...)
+        """
+        self._vectors_raw.close()
+        self._texts.close()
+
+        # prepend an .npy header to the raw vector file without loading it
+        raw_path = os.path.join(self.store_dir, VECTORS_FILE + ".raw")
+        tmp_path = os.path.join(self.store_dir, VECTORS_FILE + ".tmp")
+        header = {"descr": np.lib.format.dtype_to_descr(self.dtype), "fortran_order": False,
+                  "shape": (self.count, self.dim)}
+        with open(tmp_path, "wb") as out, open(raw_path, "rb") as raw:
+            np.lib.format.write_array_header_1_0(out, header)
+            shutil.copyfileobj(raw, out, 16 * 1024 * 1024)
+        os.remove(raw_path)
+        os.replace(tmp_path, os.path.join(self.store_dir, VECTORS_FILE))
+
+        os.replace(os.path.join(self.store_dir, TEXTS_FILE + ".tmp"), os.path.join(self.store_dir, TEXTS_FILE))
+        _atomic_save_npy(os.path.join(self.store_dir, CHUNK_IDS_FILE), np.asarray(self._chunk_ids, dtype=np.int64))
+        _atomic_save_npy(os.path.join(self.store_dir, PAGE_NUMBERS_FILE), np.asarray(self._page_numbers, dtype=np.int32))
+        _atomic_save_npy(os.path.join(self.store_dir, TEXT_OFFSETS_FILE), np.asarray(self._offsets, dtype=np.int64))
+        _atomic_save_npy(os.path.join(self.store_dir, CHUNK_HASHES_FILE), np.asarray(self._chunk_hashes, dtype="S16"))
+        if page_hashes is not None:
+            _atomic_write_bytes(os.path.join(self.store_dir, PAGE_HASHES_FILE),
+                                json.dumps({str(k): v for k, v in page_hashes.items()}).encode("utf-8"))
+        if tombstones is not None:
+            _atomic_save_npy(os.path.join(self.store_dir, TOMBSTONES_FILE), np.asarray(sorted(tombstones), dtype=np.int64))
+
+        if next_chunk_id is None:
+            next_chunk_id = max(self._chunk_ids, default=-1) + 1
+        extra_meta = dict(extra_meta or {})
+        extra_meta.update({
+            "next_chunk_id": int(next_chunk_id),
+            "tombstones": len(tombstones or ()),
+        })
+        _write_meta(self.store_dir, self.count, self.dim, self.dtype.name, extra_meta)
+
+
+def store_exists(store_dir):
+    return os.path.exists(os.path.join(store_dir, META_FILE))
+
+
+def read_meta(store_dir):
+    with open(os.path.join(store_dir, META_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def lineage_id(meta):
+    """
+    Id shared by a full build and the incremental builds made on top of it. Within one
+    lineage a chunk id always names the same chunk text; a full build restarts ids at 0,
+    so caches keyed on chunk ids must not outlive their lineage.
+    """
+    return meta.get("lineage_id") or meta.get("build_id")
+
+
+def open_vectors(store_dir):
+    """Memory-map the vector matrix read-only and wrap it as a CPU tensor (no copy)."""
+    import torch
+
+    array = np.load(os.path.join(store_dir, VECTORS_FILE), mmap_mode="r")
+    # torch warns about non-writable arrays; the store is never written through the tensor
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        tensor = torch.from_numpy(array)
+    return tensor
+
+
+def load_columns(store_dir):
+    """Load the chunk_id / page_number / text columns of a store."""
+    chunk_ids = np.load(os.path.join(store_dir, CHUNK_IDS_FILE), mmap_mode="r")
+    page_numbers = np.load(os.path.join(store_dir, PAGE_NUMBERS_FILE), mmap_mode="r")
+    offsets = np.load(os.path.join(store_dir, TEXT_OFFSETS_FILE), mmap_mode="r")
+    with open(os.path.join(store_dir, TEXTS_FILE), "rb") as f:
+        blob = f.read()
+    return chunk_ids, page_numbers, offsets, blob
+
+
+def load_store(store_dir):
+    """
+    Load a binary store.
+
+    Returns:
+        chunks: ChunkTable (api/chunk_table.py); chunks[i] gives 'chunk_id', 'page_number', 'text'
+        embeddings_tensor: Read-only memory-mapped tensor on CPU
+    """
+    if not store_exists(store_dir):
+        raise FileNotFoundError(
+            f"Embedding store not found at {store_dir}. "
+            "Please run the embedding generation script or convert_embeddings.py first."
+        )
+
+    meta = read_meta(store_dir)
+    if meta.get("version") != STORE_VERSION:
+        raise ValueError(f"Unsupported store version {meta.get('version')} in {store_dir}")
+
+    embeddings_tensor = open_vectors(store_dir)
+    chunk_ids, page_numbers, offsets, blob = load_columns(store_dir)
+
+    # columns stay as arrays (no per-chunk dicts); texts are decoded when a result needs them
+    chunks = ChunkTable(chunk_ids, page_numbers, offsets, blob)
+    if len(chunks) != meta["count"]:
+        raise ValueError(f"Store {store_dir} has {len(chunks)} chunk rows, meta.json says {meta['count']}")
+
+    return chunks, embeddings_tensor
+
+
+def load_manifest(store_dir):
+    """
+    Content hashes and id bookkeeping of a store, for incremental builds.
+    Stores written before hashes existed get their chunk hashes computed from the texts.
+    """
+    meta = read_meta(store_dir)
+    chunk_ids, page_numbers, offsets, blob = load_columns(store_dir)
+
+    hashes_path = os.path.join(store_dir, CHUNK_HASHES_FILE)
+    if os.path.exists(hashes_path):
+        chunk_hashes = [h.decode("ascii") for h in np.load(hashes_path)]
+    else:
+        chunk_hashes = [content_hash(blob[offsets[i]:offsets[i + 1]].decode("utf-8")) for i in range(meta["count"])]
+
+    page_hashes = {}
+    page_hashes_path = os.path.join(store_dir, PAGE_HASHES_FILE)
+    if os.path.exists(page_hashes_path):
+        with open(page_hashes_path, "r", encoding="utf-8") as f:
+            page_hashes = {int(k): v for k, v in json.load(f).items()}
+
+    tombstones_path = os.path.join(store_dir, TOMBSTONES_FILE)
+    tombstones = set(np.load(tombstones_path).tolist()) if os.path.exists(tombstones_path) else set()
+
+    next_chunk_id = meta.get("next_chunk_id", int(chunk_ids.max()) + 1 if len(chunk_ids) else 0)
+    return {
+        "meta": meta,
+        "chunk_ids": np.asarray(chunk_ids),
+        "page_numbers": np.asarray(page_numbers),
+        "chunk_hashes": chunk_hashes,
+        "page_hashes": page_hashes,
+        "tombstones": tombstones,
+        "next_chunk_id": int(next_chunk_id),
+    }
+
+
+def swap_store_dir(new_dir, store_dir):
+    """
+    Replace store_dir with a fully written new_dir. A running API keeps serving from
+    its memory-mapped old files (unlinked, not overwritten) until it reloads.
+    """
+    old_dir = store_dir + ".old"
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    if os.path.exists(store_dir):
+        os.rename(store_dir, old_dir)
+    os.rename(new_dir, store_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
@@ -0,0 +1,180 @@
+# batch_ask.py
+# Answer a JSONL file of questions in one batch job (see api/batch_qa.py for the format).
+# Answers are appended to --out as JSONL as they complete, one line per question with its
+# "id", "answer", "pages", per-item "timings_ms" and "error" (null when answered). The job
+# is resumable: run it again with the same --out and only the questions without a
+# successful answer are asked again (failed lines and a line cut off by the interruption
+# are dropped first).
+#
+#   python batch_ask.py questions.jsonl --out answers.jsonl
+#   python batch_ask.py questions.jsonl --out answers.jsonl --concurrency 16 --top-k 8
+#   python batch_ask.py questions.jsonl --out answers.jsonl --url http://localhost:8000
+
+import argparse
+import asyncio
+import json
+import os
+from time import perf_counter as timer
+
+from api.batch_qa import parse_items, run_batch
+from api.config import BATCH_QA_CONCURRENCY, BATCH_QA_BLOCK_SIZE, CONTEXT_TOKEN_BUDGET
+
+
+def _id_key(item_id):
+    return json.dumps(item_id)
+
+
+def load_finished(out_path):
+    """
+    Ids already answered in out_path. Lines with an error, and a last line left
+    incomplete by an interruption, are removed so the file only holds finished answers.
+    """
+    if not os.path.exists(out_path):
+        return set()
+    finished, kept = set(), []
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if result.get("error") is None:
+                finished.add(_id_key(result.get("id")))
+                kept.append(line)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(kept)
+    os.replace(tmp_path, out_path)
+    return finished
+
+
+def run_local(items, args):
+    """Answer in this process, against the local embedding store."""
+    from api.index_state import load_index_state
+    from api.retriever import search_batch
+    from api.context_builder import build_context
+    from api.generator import answer_question_async, close_http_client
+    from api.llm_backends import get_backend
+
+    state = load_index_state()
+    if not state.loaded:
+        raise SystemExit("[ERROR] Embeddings not loaded. Please generate embeddings first.")
+    for item in items:
+        item["model"] = item.get("model") or get_backend().default_model
+
+    async def retrieve(queries, top_ks, filters):
+        def search():
+            results, query_vectors = search_batch(queries, state.chunks, state.embeddings_tensor, top_k=top_ks,
+                                                  index=state.index, return_query_vectors=True,
+                                                  filters=filters, layout=state.layout)
+            return list(zip(results, query_vectors if query_vectors is not None else [None] * len(results)))
+        return await asyncio.get_running_loop().run_in_executor(None, search)
+
+    def context(chunks):
+        return build_context(chunks, token_budget=args.max_context_tokens or CONTEXT_TOKEN_BUDGET,
+                             layout=state.layout, embeddings_tensor=state.embeddings_tensor)
+
+    async def answer(query, passages, model):
+        return await answer_question_async(query, passages, model=model)
+
+    async def results():
+        try:
+            async for result in run_batch(items, retrieve, context, answer, concurrency=args.concurrency,
+                                          block_size=args.block_size,
+                                          resolve_filter=state.layout.resolve if state.layout is not None else None):
+                yield result
+        finally:
+            await close_http_client()
+
+    return results()
+
+
+def run_remote(items, args):
+    """Send the questions to a running API's POST /ask/batch and read the answers as they stream back."""
+    import httpx
+
+    async def results():
+        lines = []
+        for item in items:
+            if "error" in item:
+                # invalid lines are reported locally, the server would only echo the error
+                yield {"index": item["index"], "id": item["id"], "query": item.get("query"),
+                       "answer": None, "error": item["error"]}
+                continue
+            question = {"id": item["id"], "query": item["query"], "top_k": item["top_k"], "model": item["model"]}
+            question.update(item["source"])
+            lines.append(json.dumps(question))
+        if not lines:
+            return
+        params = {"concurrency": args.concurrency}
+        if args.max_context_tokens:
+            params["max_context_tokens"] = args.max_context_tokens
+        async with httpx.AsyncClient(timeout=httpx.Timeout(60.0, read=None)) as client:
+            async with client.stream("POST", args.url.rstrip("/") + "/ask/batch", params=params,
+                                     content="\n".join(lines).encode("utf-8")) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise SystemExit(f"[ERROR] {response.status_code}: {response.text}")
+                async for line in response.aiter_lines():
+                    if line.strip():
+                        yield json.loads(line)
+
+    return results()
+
+
+async def main_async(args):
+    with open(args.input, "r", encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+    items = parse_items(lines, default_top_k=args.top_k, default_model=args.model)
+    # filter fields as given, so a remote run sends the same question
+    for item, line in zip(items, lines):
+        try:
+            source = json.loads(line)
+        except ValueError:
+            source = None
+        item["source"] = {k: source[k] for k in ("doc", "chapter", "page_start", "page_end")
+                          if k in source} if isinstance(source, dict) else {}
+
+    finished = load_finished(args.out)
+    pending = [item for item in items if _id_key(item["id"]) not in finished]
+    print(f"[INFO] {len(items)} questions, {len(items) - len(pending)} already answered, {len(pending)} to go")
+    if not pending:
+        return
+
+    results = run_remote(pending, args) if args.url else run_local(pending, args)
+    start = timer()
+    answered = failed = 0
+    with open(args.out, "a", encoding="utf-8") as out:
+        async for result in results:
+            # one complete line per answer, flushed, so an interruption loses at most the one in flight
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            if result.get("error") is None:
+                answered += 1
+            else:
+                failed += 1
+            if (answered + failed) % args.progress_every == 0:
+                print(f"[INFO] {answered + failed}/{len(pending)} done ({failed} failed)")
+
+    elapsed = timer() - start
+    print(f"[INFO] Answered {answered}, failed {failed} in {elapsed:.1f}s "
+          f"({(answered + failed) / elapsed if elapsed else 0:.1f} questions/s)")
+    if failed:
+        print(f"[INFO] Run the same command again to retry the {failed} failed question(s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions; resumable")
+    parser.add_argument("input", help="JSONL questions: {\"id\": ..., \"query\": ...} per line")
+    parser.add_argument("--out", required=True, help="JSONL answers (appended to; existing answers are kept)")
+    parser.add_argument("--url", help="Send the questions to this API instead of answering in-process")
+    parser.add_argument("--concurrency", type=int, default=BATCH_QA_CONCURRENCY, help="LLM calls in flight")
+    parser.add_argument("--block-size", type=int, default=BATCH_QA_BLOCK_SIZE,
+                        help="Questions encoded and scored together (in-process only)")
+    parser.add_argument("--top-k", type=int, default=5, help="Chunks per question unless the line sets top_k")
+    parser.add_argument("--model", help="LLM model unless the line sets model")
+    parser.add_argument("--max-context-tokens", type=int, help=f"Prompt excerpt budget (default {CONTEXT_TOKEN_BUDGET})")
+    parser.add_argument("--progress-every", type=int, default=100)
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,89 @@
+# benchmarks/bench_ann.py
+# Recall@k vs latency of the IVF index against exact (flat) search.
+#
+#   python -m benchmarks.bench_ann --n 200000 --nlist 1024 --nprobe 1 4 8 16 32
+#   python -m benchmarks.bench_ann --store embeddings/store    # real vectors
+#
+# Synthetic vectors are drawn around random cluster centres and L2-normalised,
+# which is roughly how sentence embeddings of a technical manual are distributed.
+
+import argparse
+from time import perf_counter as timer
+
+import numpy as np
+
+from api.ann_index import FlatIndex, IVFIndex
+
+
+def synthetic_vectors(n, dim, clusters=256, noise=0.35, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    data = centres[rng.integers(0, clusters, n)] + noise * rng.standard_normal((n, dim)).astype(np.float32)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def make_queries(vectors, num_queries, seed=1):
+    """Queries are perturbed copies of stored vectors (like paraphrased questions)."""
+    rng = np.random.default_rng(seed)
+    base = np.asarray(vectors[rng.choice(len(vectors), num_queries, replace=False)], dtype=np.float32)
+    q = base + 0.5 * rng.standard_normal(base.shape).astype(np.float32) / np.sqrt(base.shape[1])
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def time_queries(index, queries, k, **params):
+    """Per-query latency (single-query calls, as the API issues them) and results."""
+    latencies, ids = [], []
+    for q in queries:
+        start = timer()
+        _, found = index.search(q[None, :], k, **params)
+        latencies.append(timer() - start)
+        ids.append(found[0])
+    return np.array(latencies), ids
+
+
+def recall_at_k(truth, found):
+    hits = [len(set(t.tolist()) & set(f.tolist())) / len(t) for t, f in zip(truth, found)]
+    return float(np.mean(hits))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF recall@k vs latency benchmark")
+    parser.add_argument("--store", help="Use the vectors of an existing embedding store")
+    parser.add_argument("--n", type=int, default=200_000, help="Synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=0, help="0 = ~4*sqrt(N)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    if args.store:
+        from api.store import open_vectors
+        vectors = open_vectors(args.store).float().numpy()
+    else:
+        vectors = synthetic_vectors(args.n, args.dim)
+    queries = make_queries(vectors, min(args.queries, len(vectors)))
+
+    print(f"[INFO] {len(vectors)} vectors, {len(queries)} queries, k={args.k}")
+
+    start = timer()
+    ivf = IVFIndex.build(vectors, nlist=args.nlist or None)
+    print(f"[INFO] IVF build: nlist={ivf.nlist} in {timer() - start:.2f}s")
+
+    flat = FlatIndex(vectors)
+    flat_lat, truth = time_queries(flat, queries, args.k)
+
+    print(f"{'index':<16}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}{'speedup':>10}")
+    flat_p50 = np.percentile(flat_lat, 50)
+    print(f"{'flat':<16}{1.0:>10.3f}{flat_p50 * 1e3:>10.3f}{np.percentile(flat_lat, 95) * 1e3:>10.3f}{1.0:>10.1f}")
+    for nprobe in args.nprobe:
+        if nprobe > ivf.nlist:
+            continue
+        lat, found = time_queries(ivf, queries, args.k, nprobe=nprobe)
+        p50 = np.percentile(lat, 50)
+        print(f"{'ivf nprobe=' + str(nprobe):<16}{recall_at_k(truth, found):>10.3f}"
+              f"{p50 * 1e3:>10.3f}{np.percentile(lat, 95) * 1e3:>10.3f}{flat_p50 / p50:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
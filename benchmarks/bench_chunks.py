@@ -0,0 +1,97 @@
+# benchmarks/bench_chunks.py
+# Heap usage, GC cost and result materialisation of the columnar ChunkTable vs the
+# old list-of-dicts chunk layout.
+#
+#   python -m benchmarks.bench_chunks --n 300000
+#   python -m benchmarks.bench_chunks --n 300000 --with-embedding   # dicts also hold a float64 vector,
+#                                                                   # as the CSV loader used to
+#
+# Each layout generates its own synthetic chunk texts (~80 words, like a 10-sentence
+# chunk of the manual) so only what the layout retains is measured.
+
+import gc
+import argparse
+import tracemalloc
+from time import perf_counter as timer
+
+import numpy as np
+
+from api.chunk_table import ChunkTable
+
+WORDS = ("hydraulic pump pressure system engine bleed valve switch panel light caution warning "
+         "procedure checklist flap gear brake fuel apu generator bus electrical").split()
+
+
+def synthetic_texts(n, words_per_chunk=80, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(n):
+        yield " ".join(WORDS[i] for i in rng.integers(0, len(WORDS), words_per_chunk))
+
+
+def build_dicts(n, dim=0):
+    chunks = []
+    for i, text in enumerate(synthetic_texts(n)):
+        chunk = {"chunk_id": i, "page_number": 1 + i // 3, "text": text}
+        if dim:
+            chunk["embedding"] = np.zeros(dim)
+        chunks.append(chunk)
+    return chunks
+
+
+def build_table(n, dim=0):
+    # texts go straight into the blob; the Python strings are released as we go
+    encoded = [t.encode("utf-8") for t in synthetic_texts(n)]
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    blob = b"".join(encoded)
+    del encoded
+    return ChunkTable(np.arange(n, dtype=np.int64), (1 + np.arange(n) // 3).astype(np.int32), offsets, blob)
+
+
+def measure(name, build, n, dim, results_per_query, queries):
+    gc.collect()
+    tracemalloc.start()
+    chunks = build(n, dim)
+    retained, peak = tracemalloc.get_traced_memory()
+    # live heap blocks ~ Python objects the layout keeps (dicts of plain values aren't
+    # GC-tracked, so gc.get_objects() would undercount them)
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+
+    start = timer()
+    gc.collect()
+    gc_ms = (timer() - start) * 1000
+
+    # what retriever._collect_results + the prompt builder do per query
+    rng = np.random.default_rng(1)
+    start = timer()
+    for _ in range(queries):
+        for idx in rng.integers(0, n, results_per_query).tolist():
+            chunk = chunks[idx].copy()
+            chunk["score"] = 0.5
+            chunk["text"], chunk["page_number"]
+    per_query_us = (timer() - start) / queries * 1e6
+
+    print(f"{name:<14}{retained / 1e6:>12.1f}{peak / 1e6:>10.1f}{blocks:>14,}{gc_ms:>15.1f}{per_query_us:>15.1f}")
+    del chunks
+    gc.collect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChunkTable vs list-of-dicts memory benchmark")
+    parser.add_argument("--n", type=int, default=300_000, help="Number of chunks")
+    parser.add_argument("--with-embedding", action="store_true",
+                        help="Dicts also carry a 384-dim float64 vector (the old CSV loader)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+    dim = 384 if args.with_embedding else 0
+
+    print(f"[INFO] {args.n} chunks{', dicts with float64 embeddings' if dim else ''}")
+    print(f"\n{'layout':<14}{'retained MB':>12}{'peak MB':>10}{'heap blocks':>14}{'gc.collect ms':>15}{'top-k copy us':>15}")
+    measure("list of dicts", build_dicts, args.n, dim, args.top_k, args.queries)
+    measure("ChunkTable", build_table, args.n, 0, args.top_k, args.queries)
+
+
+if __name__ == "__main__":
+    main()
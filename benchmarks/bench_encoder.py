@@ -0,0 +1,108 @@
+# benchmarks/bench_encoder.py
+# Query encoding latency of the PyTorch SentenceTransformer against the exported engines
+# of api/query_encoder.py (TorchScript / ONNX Runtime, fp32 and dynamic int8), and how
+# far each engine's embeddings are from PyTorch's (cosine similarity on the probe set).
+#
+#   python -m benchmarks.bench_encoder
+#   python -m benchmarks.bench_encoder --engines torch torchscript torchscript-int8 --threads 1
+#   python -m benchmarks.bench_encoder --batch-size 64 --repeat 200 --out encoder.json
+#
+# Per engine:
+#   single cold   one query per call, every query new (tokenizer runs)
+#   single warm   one query per call, repeated (token cache hit for the exported engines)
+#   batch         --batch-size distinct queries per call
+# Engines that can't be built here (e.g. onnx without onnxruntime) are skipped.
+# Exports go to QUERY_ENCODER_EXPORT_DIR and are reused by the API.
+
+import argparse
+import json
+
+import numpy as np
+import torch
+
+from api.config import EMBED_MODEL_NAME, QUERY_ENCODER_MIN_COSINE
+from api.model_registry import get_embedding_model
+from api.query_encoder import CompiledEncoder, verify
+from benchmarks.load_test import QUESTIONS
+from benchmarks.suite import measure
+
+
+def distinct_queries(n, offset=0):
+    return [f"{QUESTIONS[i % len(QUESTIONS)]} ({offset + i})" for i in range(n)]
+
+
+def bench(name, encoder, args):
+    counter = iter(range(10 ** 9))
+    # cold: a new query every call, so the token cache never helps
+    cold = measure(lambda: encoder.encode(distinct_queries(1, next(counter))[0]), args.repeat)
+    warm = measure(lambda: encoder.encode(QUESTIONS[0]), args.repeat)
+    batches = iter(range(0, 10 ** 9, args.batch_size))
+    batch = measure(lambda: encoder.encode(distinct_queries(args.batch_size, 10 ** 6 + next(batches)),
+                                           batch_size=args.batch_size), max(args.repeat // 5, 5))
+    return {
+        "engine": name,
+        "single_cold": cold,
+        "single_warm": warm,
+        f"batch_{args.batch_size}": batch,
+        "batch_per_query_ms": batch["p50_ms"] / args.batch_size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query encoder latency: PyTorch vs TorchScript / ONNX Runtime")
+    parser.add_argument("--model", default=EMBED_MODEL_NAME)
+    parser.add_argument("--engines", nargs="+",
+                        default=["torch", "torchscript", "torchscript-int8", "onnx", "onnx-int8"])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=100, help="Timed calls per single-query measurement")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads (0 = torch default)")
+    parser.add_argument("--min-cosine", type=float, default=QUERY_ENCODER_MIN_COSINE)
+    parser.add_argument("--out", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = get_embedding_model(args.model)
+
+    class Torch:
+        """The PyTorch path as retriever.encode_queries runs it."""
+        def encode(self, sentences, batch_size=32):
+            with torch.inference_mode():
+                return model.encode(sentences, batch_size=batch_size, convert_to_tensor=True, device="cpu")
+
+    results = []
+    for name in args.engines:
+        engine, _, int8 = name.partition("-")
+        if engine == "torch":
+            results.append(bench(name, Torch(), args))
+            continue
+        try:
+            encoder = CompiledEncoder.load(model, args.model, engine, int8=int8 == "int8")
+        except Exception as e:
+            print(f"[WARNING] Skipping {name}: {e}")
+            continue
+        verification = verify(model, encoder, args.min_cosine)
+        result = bench(name, encoder, args)
+        result["verification"] = verification
+        results.append(result)
+
+    base = results[0] if results and results[0]["engine"] == "torch" else None
+    print(f"\n{'engine':<20}{'cold p50':>10}{'cold p95':>10}{'warm p50':>10}"
+          f"{'batch p50':>11}{'ms/query':>10}{'speedup':>9}{'min cos':>10}")
+    for r in results:
+        speedup = base["single_cold"]["p50_ms"] / r["single_cold"]["p50_ms"] if base else float("nan")
+        cosine = r["verification"]["min_cosine"] if "verification" in r else 1.0
+        flag = "" if "verification" not in r or r["verification"]["passed"] else "  BELOW TOLERANCE"
+        print(f"{r['engine']:<20}{r['single_cold']['p50_ms']:>10.2f}{r['single_cold']['p95_ms']:>10.2f}"
+              f"{r['single_warm']['p50_ms']:>10.2f}{r[f'batch_{args.batch_size}']['p50_ms']:>11.2f}"
+              f"{r['batch_per_query_ms']:>10.3f}{speedup:>8.2f}x{cosine:>10.5f}{flag}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"model": args.model, "threads": torch.get_num_threads(), "batch_size": args.batch_size,
+                       "results": results}, f, indent=2)
+        print(f"[INFO] Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# benchmarks/bench_load.py
+# Compare embedding load time and peak RSS of the CSV path against the binary store.
+# Each loader runs in a fresh subprocess so import cost and RSS don't leak between runs.
+#
+#   python -m benchmarks.bench_load [--repeat 5]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_LOADER = r"""
+import json, resource, sys
+from time import perf_counter as timer
+import torch  # imported up front so only the load itself is timed
+from api import embedder
+
+kind, store_dir = sys.argv[1], sys.argv[2]
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = timer()
+if kind == "csv":
+    chunks, emb = embedder.load_embeddings_csv()
+else:
+    chunks, emb = embedder.load_embeddings_store(store_dir)
+    # touch every page so the mmap is actually read, like the first queries would
+    float(emb.float().sum())
+elapsed = timer() - start
+rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"seconds": elapsed, "rss_delta_kb": rss_after - rss_before, "chunks": len(chunks)}))
+"""
+
+
+def run_once(kind, store_dir):
+    out = subprocess.run(
+        [sys.executable, "-c", _LOADER, kind, store_dir],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+    )
+    # the loaders print [INFO] lines; the result is the last line
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-time benchmark: CSV vs binary store")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    sys.path.insert(0, PROJECT_ROOT)
+    from api.embedder import convert_csv_to_store
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = {}
+        for dtype in ("float32", "float16"):
+            stores[dtype] = os.path.join(tmp, dtype)
+            convert_csv_to_store(store_dir=stores[dtype], dtype=dtype)
+
+        cases = [("csv", "csv", "")] + [(f"store-{d}", "store", p) for d, p in stores.items()]
+        print(f"{'loader':<16}{'best s':>10}{'median s':>10}{'rss MB':>10}")
+        for name, kind, store_dir in cases:
+            runs = [run_once(kind, store_dir) for _ in range(args.repeat)]
+            times = sorted(r["seconds"] for r in runs)
+            rss = max(r["rss_delta_kb"] for r in runs) / 1024
+            print(f"{name:<16}{times[0]:>10.4f}{times[len(times) // 2]:>10.4f}{rss:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# benchmarks/bench_quant.py
+# Memory and recall@k of the int8 (sq8) and 1-bit (binary) quantized indexes
+# against exact float search, for several rescoring shortlist sizes.
+#
+#   python -m benchmarks.bench_quant --n 200000 --rescore 1 2 4 8 16
+#   python -m benchmarks.bench_quant --store embeddings/store    # real vectors
+#
+# "resident MB" is what each index keeps in RAM for the first pass. The float matrix
+# the shortlist is rescored against stays memory-mapped; only the shortlisted rows
+# of it are read per query.
+
+import argparse
+from time import perf_counter as timer
+
+import numpy as np
+
+from api.ann_index import FlatIndex, SQ8Index, BinaryIndex
+from benchmarks.bench_ann import synthetic_vectors, make_queries, time_queries, recall_at_k
+
+
+def megabytes(*arrays):
+    return sum(np.asarray(a).nbytes for a in arrays) / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantized index memory / recall@k benchmark")
+    parser.add_argument("--store", help="Use the vectors of an existing embedding store")
+    parser.add_argument("--n", type=int, default=200_000, help="Synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rescore", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                        help="Shortlist sizes as multiples of k")
+    args = parser.parse_args()
+
+    if args.store:
+        from api.store import open_vectors
+        vectors = open_vectors(args.store).float().numpy()
+    else:
+        vectors = synthetic_vectors(args.n, args.dim)
+    queries = make_queries(vectors, min(args.queries, len(vectors)))
+    print(f"[INFO] {len(vectors)} vectors of dim {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    flat = FlatIndex(vectors)
+    flat_lat, truth = time_queries(flat, queries, args.k)
+
+    indexes = []
+    for cls in (SQ8Index, BinaryIndex):
+        start = timer()
+        index = cls.build(vectors)
+        print(f"[INFO] {cls.kind} build: {timer() - start:.2f}s")
+        indexes.append(index)
+
+    print(f"\n{'index':<20}{'resident MB':>12}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    print(f"{'flat float32':<20}{megabytes(vectors):>12.1f}{1.0:>10.3f}"
+          f"{np.percentile(flat_lat, 50) * 1e3:>10.3f}{np.percentile(flat_lat, 95) * 1e3:>10.3f}")
+    for index in indexes:
+        resident = megabytes(index.codes, *([index.minimum, index.step] if index.kind == "sq8" else []))
+        for rescore in args.rescore:
+            lat, found = time_queries(index, queries, args.k, rescore=rescore)
+            print(f"{index.kind + ' rescore=' + str(rescore):<20}{resident:>12.1f}{recall_at_k(truth, found):>10.3f}"
+                  f"{np.percentile(lat, 50) * 1e3:>10.3f}{np.percentile(lat, 95) * 1e3:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
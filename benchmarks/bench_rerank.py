@@ -0,0 +1,110 @@
+# benchmarks/bench_rerank.py
+# Prompt tokens saved by cross-encoder re-ranking against the CPU time it adds.
+# Compares, per query,
+#   over-fetch  - dense top --wide-k chunks straight into the prompt (what we do without
+#                 re-ranking, to make up for the bi-encoder's precision)
+#   rerank      - dense top --candidates, re-scored by the cross-encoder, best --k kept
+#   rerank@B    - the same with a --budget-ms latency budget (may re-score fewer)
+# and reports recall@k (hit rate on relevant pages), prompt tokens of the excerpts and
+# the re-ranking time. The score cache is off, so every query pays the full cost.
+#
+#   python -m benchmarks.bench_rerank --qrels benchmarks/qrels.jsonl --k 3 --wide-k 10
+#   python -m benchmarks.bench_rerank --synthetic 200 --candidates 20 --budget-ms 100
+
+import argparse
+import json
+from time import perf_counter as timer
+
+import numpy as np
+
+from api.index_state import load_index_state
+from api.retriever import search_batch
+from api.reranker import Reranker
+from api.context_builder import context_tokens
+from api.config import RERANK_CANDIDATES, RERANK_BATCH_SIZE, RERANK_MODEL_NAME
+from benchmarks.eval_retrieval import load_qrels, synthetic_qrels, is_relevant
+
+
+def run(name, qrels, select):
+    """select(query, candidates) -> (chunks for the prompt, seconds spent choosing them)."""
+    hits, tokens, seconds = [], [], []
+    for qrel in qrels:
+        chunks, spent = select(qrel["query"], qrel["candidates"])
+        hits.append(any(is_relevant(c, qrel) for c in chunks))
+        tokens.append(context_tokens(chunks))
+        seconds.append(spent)
+    ms = np.array(seconds) * 1000
+    return {
+        "method": name,
+        "recall": round(float(np.mean(hits)), 4),
+        "mean_tokens": round(float(np.mean(tokens)), 1),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-encoder re-ranking: token savings vs CPU time")
+    parser.add_argument("--qrels", help="JSONL of labelled queries (see benchmarks/eval_retrieval.py)")
+    parser.add_argument("--synthetic", type=int, default=0, help="Generate N known-item queries instead")
+    parser.add_argument("--k", type=int, default=3, help="Chunks kept after re-ranking")
+    parser.add_argument("--wide-k", type=int, default=10, help="Chunks sent without re-ranking")
+    parser.add_argument("--candidates", type=int, default=RERANK_CANDIDATES)
+    parser.add_argument("--batch-size", type=int, default=RERANK_BATCH_SIZE)
+    parser.add_argument("--budget-ms", type=float, default=100.0)
+    parser.add_argument("--model", default=RERANK_MODEL_NAME)
+    parser.add_argument("--out", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    from api.model_registry import get_cross_encoder
+
+    state = load_index_state()
+    qrels = load_qrels(args.qrels) if args.qrels else synthetic_qrels(state.chunks, args.synthetic or 200)
+    print(f"[INFO] {len(qrels)} queries over {len(state.chunks)} chunks, cross-encoder {args.model}")
+
+    # retrieval is the same for every method; do it once up front
+    fetch = max(args.candidates, args.wide_k)
+    results = search_batch([q["query"] for q in qrels], state.chunks, state.embeddings_tensor,
+                           top_k=fetch, index=state.index)
+    for qrel, candidates in zip(qrels, results):
+        qrel["candidates"] = candidates
+
+    reranker = Reranker(model_loader=lambda: get_cross_encoder(args.model), batch_size=args.batch_size, cache_size=0)
+    reranker.rerank(qrels[0]["query"], qrels[0]["candidates"][:2], 1)  # load the model outside the timings
+
+    def over_fetch(query, candidates):
+        return candidates[:args.wide_k], 0.0
+
+    def reranked(budget_ms=None):
+        def select(query, candidates):
+            start = timer()
+            deadline = start + budget_ms / 1000 if budget_ms is not None else None
+            chunks, _ = reranker.rerank(query, candidates[:args.candidates], args.k, deadline=deadline)
+            return chunks, timer() - start
+        return select
+
+    rows = [
+        run(f"dense top-{args.k}", qrels, lambda q, c: (c[:args.k], 0.0)),
+        run(f"over-fetch {args.wide_k}", qrels, over_fetch),
+        run(f"rerank {args.candidates}->{args.k}", qrels, reranked()),
+        run(f"rerank@{args.budget_ms:g}ms", qrels, reranked(args.budget_ms)),
+    ]
+
+    baseline_tokens = rows[1]["mean_tokens"]
+    print(f"\n{'method':<22}{'recall@k':>10}{'tokens':>10}{'saved':>8}{'p50 ms':>10}{'p95 ms':>10}")
+    for r in rows:
+        saved = 1 - r["mean_tokens"] / baseline_tokens if baseline_tokens else 0.0
+        r["tokens_saved_vs_over_fetch"] = round(saved, 4)
+        print(f"{r['method']:<22}{r['recall']:>10.4f}{r['mean_tokens']:>10.1f}{saved:>8.1%}"
+              f"{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}")
+    print(f"[INFO] Budget of {args.budget_ms:g} ms cut re-ranking short for {reranker.truncated} of {len(qrels)} queries")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "wide_k": args.wide_k, "candidates": args.candidates, "model": args.model,
+                       "budget_ms": args.budget_ms, "results": rows}, f, indent=2)
+        print(f"[INFO] Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
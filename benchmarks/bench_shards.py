@@ -0,0 +1,120 @@
+# benchmarks/bench_shards.py
+# Sharded exact search (api/shard_pool.py) against the in-process flat scan, over synthetic
+# corpora (benchmarks/synthetic_corpus.py): query latency as workers and shards are added,
+# and the memory of every worker, to show it stays flat (the vectors are memory-mapped
+# and shared through the page cache, not copied into each worker).
+#
+#   python -m benchmarks.bench_shards
+#   python -m benchmarks.bench_shards --sizes 1000000 --workers 1 2 4 8 --shards 0 16
+#   python -m benchmarks.bench_shards --dtype float16 --batch-sizes 1 32 --out shards.json
+#
+# Per corpus size n and query batch size b:
+#   inproc           FlatIndex over the memory-mapped store, in this process (what the API does by default)
+#   w=W,s=S          ShardPool with W workers and S shards (0 = one per worker)
+# Each row reports p50 / p95 latency, speedup over inproc, and per-worker anonymous / proportional
+# memory (anon: the worker's own heap; PSS: that plus its share of the mapped vectors pages).
+# Speedups need as many free cores as workers; workers beyond the core count only add overhead.
+# Results are keyed like benchmarks/suite.py, so --out files work with `suite --compare`.
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+# only light imports at module level: spawned workers import this module again
+from api.shard_pool import ShardPool
+from api.shard_worker import process_memory
+from api.store import VECTORS_FILE
+from benchmarks.synthetic_corpus import DEFAULT_DIR, corpus_dir, write_corpus
+
+
+def bench_inproc(results, n, store_dir, batch_sizes, k, repeat):
+    from api.store import load_store
+    from api.ann_index import FlatIndex
+    from benchmarks.suite import measure
+
+    _, embeddings = load_store(store_dir)
+    index = FlatIndex(embeddings)
+    rng = np.random.default_rng(1)
+    for b in batch_sizes:
+        queries = rng.standard_normal((b, embeddings.shape[1])).astype(np.float32)
+        results[f"shards/inproc/n={n}/b={b}"] = measure(lambda: index.search(queries, k), repeat)
+        report(f"inproc n={n} b={b}", results[f"shards/inproc/n={n}/b={b}"])
+
+
+def bench_pool(results, n, store_dir, workers, shards, batch_sizes, k, repeat, threads):
+    from benchmarks.suite import measure
+
+    path = os.path.join(store_dir, VECTORS_FILE)
+    dim = np.load(path, mmap_mode="r").shape[1]
+    pool = ShardPool([(path, 0, n)], workers, shards=shards, threads=threads)
+    try:
+        rng = np.random.default_rng(1)
+        for b in batch_sizes:
+            queries = rng.standard_normal((b, dim)).astype(np.float32)
+            stats = measure(lambda: pool.search(queries, k), repeat)
+            baseline = results.get(f"shards/inproc/n={n}/b={b}")
+            if baseline:
+                stats["speedup"] = round(baseline["p50_ms"] / stats["p50_ms"], 2)
+            # after the timed runs every worker has read all of its shards
+            memory = [m for m in pool.stats()["worker_memory"] if "anon_mb" in m]
+            if memory:
+                stats["worker_anon_mb"] = max(m["anon_mb"] for m in memory)
+                stats["worker_pss_mb"] = max(m["pss_mb"] for m in memory)
+                stats["workers_pss_mb_total"] = round(sum(m["pss_mb"] for m in memory), 1)
+            key = f"shards/w={pool.workers},s={len(pool.shards)}/n={n}/b={b}"
+            results[key] = stats
+            report(f"w={pool.workers} s={len(pool.shards)} n={n} b={b}", stats)
+    finally:
+        pool.close()
+
+
+def report(label, stats):
+    memory = ""
+    if "worker_anon_mb" in stats:
+        memory = (f"{stats['worker_anon_mb']:>12.1f}{stats['worker_pss_mb']:>10.1f}"
+                  f"{stats['workers_pss_mb_total']:>12.1f}")
+    speedup = f"{stats['speedup']:>8.2f}x" if "speedup" in stats else f"{'':>9}"
+    print(f"{label:<30}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{speedup}{memory}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Sharded multi-process exact search: latency and memory scaling")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000], help="Corpus sizes (chunks)")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32", help="Store dtype")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to try")
+    parser.add_argument("--shards", type=int, nargs="+", default=[0],
+                        help="Shard counts to try with every worker count (0 = one per worker)")
+    parser.add_argument("--threads", type=int, default=1, help="BLAS threads per worker")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32], help="Queries per call")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=30, help="Timed searches per measurement")
+    parser.add_argument("--data-dir", default=DEFAULT_DIR, help="Where synthetic corpora are generated (reused)")
+    parser.add_argument("--out", help="Write the results as JSON")
+    return parser
+
+
+def run(args):
+    results = {}
+    print(f"[INFO] {os.cpu_count()} CPUs, this process: {process_memory() or 'memory not available'}")
+    print(f"{'':<30}{'p50 ms':>10}{'p95 ms':>10}{'speedup':>9}{'anon MB':>12}{'PSS MB':>10}{'PSS total':>12}")
+    for n in args.sizes:
+        out_dir = corpus_dir(args.data_dir, n, args.dim) + ("" if args.dtype == "float32" else f"-{args.dtype}")
+        _, store_dir = write_corpus(out_dir, n, args.dim, csv_file=False, dtype=args.dtype)
+        bench_inproc(results, n, store_dir, args.batch_sizes, args.k, args.repeat)
+        for workers in args.workers:
+            for shards in args.shards:
+                bench_pool(results, n, store_dir, workers, shards, args.batch_sizes, args.k, args.repeat,
+                           args.threads)
+    return results
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    results = run(args)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"results": results}, f, indent=2)
+        print(f"[INFO] Results written to {args.out}")
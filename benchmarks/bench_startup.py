@@ -0,0 +1,158 @@
+# benchmarks/bench_startup.py
+# Cold start of the API: how long `import api.main` takes (and which modules it spends
+# that time on, from `python -X importtime`), and how long a fresh uvicorn process takes
+# to answer GET /health/live and to turn GET /health/ready 200.
+#
+#   python -m benchmarks.bench_startup
+#   python -m benchmarks.bench_startup --store embeddings/store --repeat 5 --out startup.json
+#   python -m benchmarks.bench_startup --no-server --top 30          # import profile only
+#
+# Every measurement runs in a new process, so nothing is cached in this one.
+#   import   wall time of `python -c "import api.main"` (interpreter start included)
+#   live     process start -> first 200 from /health/live
+#   ready    process start -> first 200 from /health/ready (index + embedding model loaded)
+# The import profile lists the modules with the largest cumulative import time and
+# flags heavy libraries (torch, sentence_transformers, ...) that api.main imported eagerly.
+# Also run by `python -m benchmarks.suite --startup`.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from time import perf_counter as timer, sleep
+
+import httpx
+
+from benchmarks.load_test import start_server, PROJECT_ROOT
+from benchmarks.suite import latency_stats
+
+# imported lazily by the API; any of these in the import profile is a regression
+HEAVY_MODULES = ("torch", "sentence_transformers", "transformers", "fitz", "spacy", "google.generativeai",
+                 "onnxruntime")
+
+
+def parse_importtime(stderr):
+    """`-X importtime` output -> list of (module, self_us, cumulative_us, depth) in import order."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def profile_import(module="api.main", top=20):
+    """One `python -X importtime -c "import <module>"`; returns wall seconds and the profile."""
+    start = timer()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=PROJECT_ROOT, capture_output=True, text=True)
+    wall = timer() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    modules = parse_importtime(proc.stderr)
+    by_cumulative = sorted(modules, key=lambda m: -m[2])
+    return wall, {
+        "module": module,
+        "cumulative_ms": next((m[2] / 1000 for m in modules if m[0] == module), None),
+        "modules_imported": len(modules),
+        "heavy_imports": sorted({m[0] for m in modules if m[0] in HEAVY_MODULES}),
+        "top_cumulative": [{"module": m[0], "cumulative_ms": m[2] / 1000, "self_ms": m[1] / 1000}
+                           for m in by_cumulative[:top]],
+        "top_self": [{"module": m[0], "self_ms": m[1] / 1000}
+                     for m in sorted(modules, key=lambda m: -m[1])[:top]],
+    }
+
+
+def boot(env, port, timeout=300):
+    """Start the API, poll the probes; returns (seconds to live, seconds to ready, /health/ready body)."""
+    live = None
+    start = timer()
+    proc = start_server(["api.main:app"], env, port)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        with httpx.Client(timeout=5.0) as client:
+            while timer() - start < timeout:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"API exited with status {proc.returncode} before it was ready")
+                try:
+                    if live is None and client.get(base_url + "/health/live").status_code == 200:
+                        live = timer() - start
+                    if live is not None:
+                        response = client.get(base_url + "/health/ready")
+                        if response.status_code == 200:
+                            return live, timer() - start, response.json()
+                        if response.json().get("phase") == "done":
+                            raise RuntimeError(f"API finished loading but isn't ready: {response.json()['errors']}")
+                except httpx.HTTPError:
+                    pass
+                sleep(0.02)
+        raise RuntimeError(f"API not ready within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def run(args):
+    """Results keyed like benchmarks/suite.py ("startup/<what>": latency stats)."""
+    results = {}
+    walls, profile = [], None
+    for _ in range(args.repeat):
+        wall, profile = profile_import(top=args.top)
+        walls.append(wall)
+    results["startup/import"] = {**latency_stats(walls), "cumulative_ms": profile["cumulative_ms"],
+                                 "heavy_imports": profile["heavy_imports"]}
+
+    if not args.no_server:
+        env = {"BACKGROUND_LOAD": "1", "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY") or "fake",
+               "LOG_SAMPLE_RATE": "0", "ANSWER_CACHE": "0"}
+        if args.store:
+            env["EMBED_STORE_DIR"] = os.path.abspath(args.store)
+        lives, readies, boot_info = [], [], None
+        for _ in range(args.repeat):
+            live, ready, boot_info = boot(env, args.port)
+            lives.append(live)
+            readies.append(ready)
+        results["startup/live"] = latency_stats(lives)
+        results["startup/ready"] = {**latency_stats(readies), "index_seconds": boot_info["index_seconds"],
+                                    "model_seconds": boot_info["model_seconds"],
+                                    "total_chunks": boot_info["total_chunks"]}
+    return results, profile
+
+
+def report(results, profile):
+    print(f"\nimport api.main: {profile['cumulative_ms']:.0f} ms in imports, {profile['modules_imported']} modules")
+    print(f"heavy libraries imported eagerly: {', '.join(profile['heavy_imports']) or 'none'}")
+    print(f"\n{'module (cumulative)':<48}{'cumul. ms':>12}{'self ms':>10}")
+    for m in profile["top_cumulative"]:
+        print(f"{m['module']:<48}{m['cumulative_ms']:>12.1f}{m['self_ms']:>10.1f}")
+    print(f"\n{'startup':<16}{'p50 ms':>10}{'p95 ms':>10}{'runs':>6}")
+    for key, r in results.items():
+        print(f"{key.split('/')[1]:<16}{r['p50_ms']:>10.0f}{r['p95_ms']:>10.0f}{r['runs']:>6}")
+    ready = results.get("startup/ready")
+    if ready:
+        print(f"\nlast boot: index {ready['index_seconds']:.2f}s, models {ready['model_seconds']:.2f}s, "
+              f"{ready['total_chunks']} chunks")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="API cold start: import profile, time to live and to ready")
+    parser.add_argument("--store", help="EMBED_STORE_DIR the API serves (default: the configured one)")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh processes per measurement")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--top", type=int, default=20, help="Modules listed in the import profile")
+    parser.add_argument("--no-server", action="store_true", help="Only profile the import")
+    parser.add_argument("--out", help="Write the results and the import profile as JSON")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    results, profile = run(args)
+    report(results, profile)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"results": results, "import_profile": profile}, f, indent=2)
+        print(f"[INFO] Results written to {args.out}")
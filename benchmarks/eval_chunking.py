@@ -0,0 +1,153 @@
+# benchmarks/eval_chunking.py
+# Compares chunking strategies (api/document_processor.Chunker) on the same manual:
+# chunk count and sizes, how many chunks exceed the embedding model's input length
+# (the rest of their text is silently dropped when embedding), the size of the
+# embedding matrix, and retrieval quality and prompt size of the top-k chunks.
+#
+#   python -m benchmarks.eval_chunking --synthetic 300
+#   python -m benchmarks.eval_chunking --qrels benchmarks/qrels.jsonl --k 5 \
+#       --strategies "sentences:toc=off" "tokens" "tokens:target=120,overlap=2" "tokens:toc=drop"
+#
+# Strategy specs are 'strategy[:key=value,...]' as for build_embeddings.py --chunking;
+# 'sentences:toc=off' is the original 10-sentences-per-page chunking. Pages are
+# extracted once and every strategy is embedded in memory, nothing is written.
+# Chunk ids differ between strategies, so only page-labelled qrels are used; a chunk
+# that continues onto the next page counts for every page it covers. --synthetic
+# samples word windows from the pages (not from any strategy's chunks).
+# Chunkers measure tokens with the embedding model's tokenizer, as ingestion does, and
+# chunk sizes are reported in those tokens.
+
+import argparse
+import json
+from time import perf_counter as timer
+
+import numpy as np
+import torch
+
+from api.config import PDF_PATH
+from api.document_processor import Chunker
+from api.context_builder import context_tokens
+from api.ingest import iter_pages
+from benchmarks.eval_retrieval import load_qrels
+
+DEFAULT_STRATEGIES = ["sentences:toc=off", "sentences", "tokens", "tokens:overlap=0,cross_page=0"]
+
+
+def synthetic_page_qrels(pages, num_queries, window=8, seed=0):
+    """Known-item queries: a random window of words from a random page, relevant = that page."""
+    rng = np.random.default_rng(seed)
+    candidates = [p for p in pages if len(" ".join(p["sentences"]).split()) > window]
+    qrels = []
+    for row in rng.choice(len(candidates), min(num_queries, len(candidates)), replace=False):
+        words = " ".join(candidates[row]["sentences"]).split()
+        start = int(rng.integers(0, len(words) - window))
+        qrels.append({"query": " ".join(words[start:start + window]), "pages": [candidates[row]["page_number"]]})
+    return qrels
+
+
+def covers(chunk, pages):
+    return any(chunk["page_number"] <= p <= chunk.get("page_end", chunk["page_number"]) for p in pages)
+
+
+def evaluate(spec, pages, qrels, query_vectors, model, k, batch_size):
+    chunker = Chunker.from_spec(spec).use_tokenizer(model)
+    start = timer()
+    chunks = chunker.chunk_pages(pages)
+    chunk_seconds = timer() - start
+
+    start = timer()
+    with torch.inference_mode():
+        vectors = model.encode([c["text"] for c in chunks], batch_size=batch_size, convert_to_tensor=True,
+                               device="cpu")
+    encode_seconds = timer() - start
+
+    tokens = np.array([len(model.tokenizer.tokenize(c["text"])) for c in chunks])
+    result = {
+        "strategy": spec,
+        "settings": chunker.describe(),
+        "chunks": len(chunks),
+        "mean_tokens": round(float(tokens.mean()), 1),
+        "p95_tokens": int(np.percentile(tokens, 95)),
+        "max_tokens": int(tokens.max()),
+        "total_tokens": int(tokens.sum()),
+        # over the model's limit with [CLS] / [SEP]: the tail of these chunks is never embedded
+        "over_model_limit": int((tokens > model.max_seq_length - 2).sum()),
+        "matrix_mb": round(vectors.shape[0] * vectors.shape[1] * 4 / 2 ** 20, 3),
+        "text_mb": round(sum(len(c["text"].encode("utf-8")) for c in chunks) / 2 ** 20, 3),
+        "chunk_seconds": round(chunk_seconds, 3),
+        "encode_seconds": round(encode_seconds, 3),
+        **chunker.stats,
+    }
+    if qrels:
+        scores = torch.from_numpy(query_vectors).to(vectors.dtype) @ vectors.T
+        top = torch.topk(scores, k=min(k, len(chunks)), dim=1).indices.tolist()
+        hits, reciprocal_ranks, prompt_tokens = [], [], []
+        for qrel, ids in zip(qrels, top):
+            retrieved = [chunks[i] for i in ids]
+            rank = next((r + 1 for r, c in enumerate(retrieved) if covers(c, qrel["pages"])), None)
+            hits.append(rank is not None)
+            reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+            prompt_tokens.append(context_tokens(retrieved))
+        result[f"recall@{k}"] = round(float(np.mean(hits)), 4)
+        result[f"mrr@{k}"] = round(float(np.mean(reciprocal_ranks)), 4)
+        result["prompt_tokens"] = round(float(np.mean(prompt_tokens)), 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunking strategies: chunk count, index size, retrieval quality")
+    parser.add_argument("--pdf", default=PDF_PATH)
+    parser.add_argument("--strategies", nargs="+", default=DEFAULT_STRATEGIES, help="Chunker specs to compare")
+    parser.add_argument("--qrels", help="JSONL of page-labelled queries (see benchmarks/eval_retrieval.py)")
+    parser.add_argument("--synthetic", type=int, default=0, help="Generate N known-item queries instead")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (default: all cores)")
+    parser.add_argument("--encode-batch", type=int, default=64)
+    parser.add_argument("--out", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    # validate every spec before the slow part
+    for spec in args.strategies:
+        try:
+            Chunker.from_spec(spec)
+        except ValueError as e:
+            parser.error(str(e))
+
+    from api.embedder import get_model
+    from api.retriever import encode_queries
+
+    pages = list(iter_pages(args.pdf, workers=args.workers))
+    print(f"[INFO] {len(pages)} pages extracted from {args.pdf}")
+
+    qrels = []
+    if args.qrels:
+        qrels = [q for q in load_qrels(args.qrels) if q.get("pages")]
+        print(f"[INFO] {len(qrels)} page-labelled queries (chunk-labelled ones are skipped)")
+    elif args.synthetic:
+        qrels = synthetic_page_qrels(pages, args.synthetic)
+    query_vectors = encode_queries([q["query"] for q in qrels]) if qrels else None
+
+    model = get_model()
+    results = []
+    for spec in args.strategies:
+        print(f"[INFO] Chunking and embedding with {spec}...")
+        results.append(evaluate(spec, pages, qrels, query_vectors, model, args.k, args.encode_batch))
+
+    quality = f"{'recall@' + str(args.k):>10}{'mrr@' + str(args.k):>8}{'prompt':>8}" if qrels else ""
+    print(f"\n{'strategy':<34}{'chunks':>8}{'mean tok':>9}{'max tok':>8}{'>limit':>7}{'matrix MB':>10}{quality}")
+    for r in results:
+        line = (f"{r['strategy']:<34}{r['chunks']:>8}{r['mean_tokens']:>9.1f}{r['max_tokens']:>8}"
+                f"{r['over_model_limit']:>7}{r['matrix_mb']:>10.3f}")
+        if qrels:
+            line += f"{r[f'recall@{args.k}']:>10.4f}{r[f'mrr@{args.k}']:>8.4f}{r['prompt_tokens']:>8.0f}"
+        print(line)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"pdf": args.pdf, "pages": len(pages), "k": args.k, "queries": len(qrels),
+                       "results": results}, f, indent=2)
+        print(f"[INFO] Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
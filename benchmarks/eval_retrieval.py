@@ -0,0 +1,137 @@
+# benchmarks/eval_retrieval.py
+# Retrieval quality and latency of dense-only, lexical-only (BM25) and hybrid retrieval.
+#
+#   python -m benchmarks.eval_retrieval --qrels benchmarks/qrels.jsonl --k 5
+#   python -m benchmarks.eval_retrieval --synthetic 200            # no labelled queries yet
+#
+# qrels.jsonl has one labelled query per line:
+#   {"query": "What does NP.21.3 say about the APU?", "pages": [212, 213]}
+#   {"query": "...", "chunk_ids": [1841], "doc_id": "737-800-rev12"}
+# A query counts as a hit when any retrieved chunk is on a relevant page (or is a
+# relevant chunk). --synthetic samples a word window out of random chunks as the
+# query (known-item search); it favours lexical retrieval, so prefer real qrels.
+#
+# Runs against whatever the API would load (single store or corpus shards).
+
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter as timer
+
+import numpy as np
+
+from api.index_state import load_index_state
+from api.retriever import search_batch, search_lexical, fuse_results
+from api.config import HYBRID_ALPHA, HYBRID_CANDIDATES
+
+
+def load_qrels(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synthetic_qrels(chunks, num_queries, window=8, seed=0):
+    """Known-item queries: a random window of words from a random chunk, relevant = its page."""
+    rng = np.random.default_rng(seed)
+    qrels = []
+    for row in rng.choice(len(chunks), min(num_queries, len(chunks)), replace=False):
+        words = chunks[row]["text"].split()
+        if len(words) < 3:
+            continue
+        start = int(rng.integers(0, max(1, len(words) - window)))
+        item = {"query": " ".join(words[start:start + window]), "pages": [chunks[row]["page_number"]]}
+        if "doc_id" in chunks[row]:
+            item["doc_id"] = chunks[row]["doc_id"]
+        qrels.append(item)
+    return qrels
+
+
+def is_relevant(chunk, qrel):
+    if qrel.get("doc_id") and chunk.get("doc_id") not in (None, qrel["doc_id"]):
+        return False
+    if "chunk_ids" in qrel:
+        return chunk["chunk_id"] in qrel["chunk_ids"]
+    return chunk["page_number"] in qrel.get("pages", [])
+
+
+def evaluate(name, retrieve, qrels, k):
+    """Recall@k (hit rate), MRR@k and per-query latency of one retrieval method."""
+    hits, reciprocal_ranks, latencies = [], [], []
+    for qrel in qrels:
+        start = timer()
+        results = retrieve(qrel["query"])[:k]
+        latencies.append(timer() - start)
+        rank = next((i + 1 for i, chunk in enumerate(results) if is_relevant(chunk, qrel)), None)
+        hits.append(rank is not None)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "method": name,
+        "queries": len(qrels),
+        f"recall@{k}": round(float(np.mean(hits)), 4),
+        f"mrr@{k}": round(float(np.mean(reciprocal_ranks)), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dense vs lexical vs hybrid retrieval evaluation")
+    parser.add_argument("--qrels", help="JSONL of labelled queries")
+    parser.add_argument("--synthetic", type=int, default=0, help="Generate N known-item queries instead")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=HYBRID_CANDIDATES,
+                        help="Candidates from each retriever before fusion")
+    parser.add_argument("--alpha", type=float, default=HYBRID_ALPHA, help="Dense weight for weighted fusion")
+    parser.add_argument("--out", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    state = load_index_state()
+    chunks, embeddings_tensor, index, bm25 = state.chunks, state.embeddings_tensor, state.index, state.bm25
+    if args.qrels:
+        qrels = load_qrels(args.qrels)
+    else:
+        qrels = synthetic_qrels(chunks, args.synthetic or 200)
+    print(f"[INFO] {len(qrels)} queries over {len(chunks)} chunks")
+
+    candidates = max(args.k, args.candidates)
+    # the API runs both retrievers of a hybrid query concurrently; do the same here
+    pool = ThreadPoolExecutor(max_workers=2)
+
+    def dense(query, k=args.k):
+        return search_batch([query], chunks, embeddings_tensor, top_k=k, index=index)[0]
+
+    def lexical(query, k=args.k):
+        return search_lexical(query, chunks, bm25, top_k=k)
+
+    def hybrid(method):
+        def retrieve(query):
+            dense_future = pool.submit(dense, query, candidates)
+            lexical_results = lexical(query, candidates)
+            return fuse_results(dense_future.result(), lexical_results, args.k, method=method, alpha=args.alpha)
+        return retrieve
+
+    methods = [("dense", dense)]
+    if bm25 is None:
+        print("[WARNING] No BM25 index found, only evaluating dense retrieval (run build_index.py --bm25-only)")
+    else:
+        methods += [("lexical", lexical), ("hybrid-rrf", hybrid("rrf")), ("hybrid-weighted", hybrid("weighted"))]
+
+    dense(qrels[0]["query"])  # load the model outside the timings
+    results = [evaluate(name, retrieve, qrels, args.k) for name, retrieve in methods]
+    pool.shutdown()
+
+    print(f"\n{'method':>16} {'recall@' + str(args.k):>10} {'mrr@' + str(args.k):>8} {'p50 ms':>9} {'p95 ms':>9}")
+    for r in results:
+        print(f"{r['method']:>16} {r[f'recall@{args.k}']:>10.4f} {r[f'mrr@{args.k}']:>8.4f} "
+              f"{r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "candidates": candidates, "alpha": args.alpha, "results": results}, f, indent=2)
+        print(f"[INFO] Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
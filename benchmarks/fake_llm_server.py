@@ -0,0 +1,163 @@
+# benchmarks/fake_llm_server.py
+# Local stand-in for the LLM APIs, for load tests that shouldn't spend quota.
+# Implements
+#   Gemini REST:  /v1beta/models/{model}:generateContent and :streamGenerateContent?alt=sse
+#   OpenAI-style: /v1/chat/completions (stream true/false), as served by Ollama / vLLM
+# with a fixed, configurable latency so the API's concurrency can be measured in isolation.
+# Answers are derived from a hash of the prompt, so the same prompt always gets the
+# same answer. --fail-every N answers every Nth request with 429 + Retry-After, to
+# exercise the API's retry path; --block-every N answers every Nth request with a
+# safety block, to exercise fallback routing.
+#
+#   python -m benchmarks.fake_llm_server --port 8001 --latency 1.0 --tokens 40
+#   GEMINI_API_ENDPOINT=http://127.0.0.1:8001 GEMINI_API_KEY=fake uvicorn api.main:app
+#   LLM_BACKEND=openai OPENAI_BASE_URL=http://127.0.0.1:8001/v1 uvicorn api.main:app
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "1.0"))
+TOKENS = int(os.getenv("FAKE_LLM_TOKENS", "40"))
+# time before the first token of a streamed answer
+FIRST_TOKEN_LATENCY = float(os.getenv("FAKE_LLM_FIRST_TOKEN_LATENCY", str(LATENCY / 4)))
+# every Nth request is rejected with 429 (0 = never)
+FAIL_EVERY = int(os.getenv("FAKE_LLM_FAIL_EVERY", "0"))
+RETRY_AFTER = os.getenv("FAKE_LLM_RETRY_AFTER", "0.1")
+# every Nth answered request is blocked by the "safety filter" (0 = never)
+BLOCK_EVERY = int(os.getenv("FAKE_LLM_BLOCK_EVERY", "0"))
+
+WORDS = ("the pump hydraulic system pressure switch panel valve engine light caution "
+         "procedure checklist check position flap bleed fuel apu gear").split()
+
+app = FastAPI(title="Fake LLM")
+_requests = itertools.count(1)
+_answered = itertools.count(1)
+
+
+def _tokens(prompt):
+    # deterministic answer so repeated runs are comparable
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    return [WORDS[digest[i % len(digest)] % len(WORDS)] + " " for i in range(TOKENS)]
+
+
+def _rate_limited():
+    """429 for every FAIL_EVERY-th request, None otherwise."""
+    if FAIL_EVERY and next(_requests) % FAIL_EVERY == 0:
+        return JSONResponse({"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota)."}},
+                            status_code=429, headers={"Retry-After": RETRY_AFTER})
+    return None
+
+
+def _blocked():
+    return bool(BLOCK_EVERY) and next(_answered) % BLOCK_EVERY == 0
+
+
+async def _paced(tokens):
+    """Yield (index, token) spread over LATENCY, the first one after FIRST_TOKEN_LATENCY."""
+    await asyncio.sleep(FIRST_TOKEN_LATENCY)
+    step = (LATENCY - FIRST_TOKEN_LATENCY) / max(1, len(tokens) - 1)
+    for i, token in enumerate(tokens):
+        if i:
+            await asyncio.sleep(step)
+        yield i, token
+
+
+def _response(text, finish_reason="STOP"):
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": text}], "role": "model"},
+            "finishReason": finish_reason,
+        }]
+    }
+
+
+@app.post("/v1beta/models/{model_action}")
+async def models(model_action: str, request: Request):
+    model, _, action = model_action.partition(":")
+    body = await request.json()
+    prompt = body["contents"][0]["parts"][0]["text"]
+    tokens = _tokens(prompt)
+    limited = _rate_limited()
+    if limited is not None:
+        return limited
+    if _blocked():
+        await asyncio.sleep(FIRST_TOKEN_LATENCY)
+        payload = {"candidates": [{"finishReason": "SAFETY"}]}
+        if action == "streamGenerateContent":
+            return StreamingResponse(iter([f"data: {json.dumps(payload)}\r\n\r\n"]), media_type="text/event-stream")
+        return payload
+
+    if action == "generateContent":
+        await asyncio.sleep(LATENCY)
+        return _response("".join(tokens))
+
+    if action == "streamGenerateContent":
+        async def events():
+            async for i, token in _paced(tokens):
+                finish = "STOP" if i == len(tokens) - 1 else None
+                payload = _response(token, finish) if finish else _response(token)
+                if not finish:
+                    del payload["candidates"][0]["finishReason"]
+                yield f"data: {json.dumps(payload)}\r\n\r\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    raise HTTPException(status_code=404, detail=f"Unknown action {action!r}")
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+    tokens = _tokens(prompt)
+    model = body.get("model", "fake")
+    limited = _rate_limited()
+    if limited is not None:
+        return limited
+    if _blocked():
+        await asyncio.sleep(FIRST_TOKEN_LATENCY)
+        tokens, finish = [], "content_filter"
+    else:
+        finish = "stop"
+
+    if not body.get("stream"):
+        await asyncio.sleep(LATENCY)
+        return {"id": "fake", "object": "chat.completion", "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": finish}]}
+
+    async def events():
+        if not tokens:
+            chunk = {"id": "fake", "object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": finish}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        async for i, token in _paced(tokens):
+            chunk = {"id": "fake", "object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": {"content": token},
+                                  "finish_reason": finish if i == len(tokens) - 1 else None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake Gemini / OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=LATENCY, help="Seconds per full answer")
+    parser.add_argument("--tokens", type=int, default=TOKENS, help="Tokens per answer")
+    parser.add_argument("--fail-every", type=int, default=FAIL_EVERY, help="Answer every Nth request with 429")
+    parser.add_argument("--block-every", type=int, default=BLOCK_EVERY, help="Safety-block every Nth answer")
+    args = parser.parse_args()
+
+    LATENCY, TOKENS, FAIL_EVERY, BLOCK_EVERY = args.latency, args.tokens, args.fail_every, args.block_every
+    FIRST_TOKEN_LATENCY = float(os.getenv("FAKE_LLM_FIRST_TOKEN_LATENCY", str(LATENCY / 4)))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
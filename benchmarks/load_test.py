@@ -0,0 +1,194 @@
+# benchmarks/load_test.py
+# Concurrency load test of /ask against a local fake LLM (benchmarks/fake_llm_server.py).
+# Starts the fake LLM and the API as subprocesses and compares
+#   sync   - ASYNC_LLM=0: blocking SDK call in the threadpool (the old behaviour)
+#   async  - ASYNC_LLM=1: awaited async HTTP call
+#   stream - /ask/stream, reporting time-to-first-byte of the answer
+#
+#   python -m benchmarks.load_test --requests 400 --concurrency 200 --llm-latency 1.0
+#   python -m benchmarks.load_test --backend openai --fail-every 10   # OpenAI-style API, 10% 429s
+#   python -m benchmarks.load_test --store benchmarks/data/n100000-d384/store --modes async --json out.json
+#
+# benchmarks/suite.py runs this against synthetic corpora and stores the figures with
+# the other benchmark results.
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from time import perf_counter as timer
+
+import httpx
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUESTIONS = [
+    "What is the hydraulic system?",
+    "How do I start the APU?",
+    "What are the engine start procedures?",
+    "Explain the autopilot disengage procedure",
+    "What does the master caution light indicate?",
+]
+
+
+def start_server(args, env, port):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", *args, "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=PROJECT_ROOT, env={**os.environ, **env},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return proc
+
+
+async def wait_ready(url, timeout=180):
+    deadline = timer() + timeout
+    async with httpx.AsyncClient() as client:
+        while timer() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def run_load(base_url, path, total, concurrency, stream=False):
+    """Fire `total` requests with at most `concurrency` in flight; returns latencies and TTFBs."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, ttfbs, errors = [], [], 0
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        async def one(i):
+            nonlocal errors
+            params = {"query": QUESTIONS[i % len(QUESTIONS)]}
+            async with semaphore:
+                start = timer()
+                try:
+                    if stream:
+                        async with client.stream("GET", path, params=params) as response:
+                            first = None
+                            async for line in response.aiter_lines():
+                                if first is None and line.startswith("event: token"):
+                                    first = timer() - start
+                            ttfbs.append(first if first is not None else timer() - start)
+                    else:
+                        response = await client.get(path, params=params)
+                        if response.status_code != 200:
+                            errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(timer() - start)
+
+        start = timer()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        wall = timer() - start
+
+    return np.array(latencies), np.array(ttfbs), errors, wall
+
+
+MODES = {
+    # name: (ASYNC_LLM, path, stream)
+    "sync": ("0", "/ask", False),
+    "async": ("1", "/ask", False),
+    "stream": ("1", "/ask/stream", True),
+}
+
+
+def summarize(latencies, ttfbs, errors, wall):
+    return {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / wall,
+        "p50_ms": float(np.percentile(latencies, 50) * 1e3),
+        "p95_ms": float(np.percentile(latencies, 95) * 1e3),
+        "p99_ms": float(np.percentile(latencies, 99) * 1e3),
+        "ttfb_p50_ms": float(np.percentile(ttfbs, 50) * 1e3) if len(ttfbs) else None,
+        "errors": errors,
+    }
+
+
+def report(name, result):
+    ttfb = f"{result['ttfb_p50_ms']:>10.0f}" if result["ttfb_p50_ms"] is not None else f"{'-':>10}"
+    print(f"{name:<8}{result['throughput_rps']:>10.1f}{result['p50_ms']:>10.0f}{result['p95_ms']:>10.0f}"
+          f"{result['p99_ms']:>10.0f}{ttfb}{result['errors']:>8}")
+
+
+async def main_async(args):
+    llm_port, api_port = args.port + 1, args.port
+    llm_env = {"FAKE_LLM_LATENCY": str(args.llm_latency), "FAKE_LLM_TOKENS": str(args.tokens),
+               "FAKE_LLM_FAIL_EVERY": str(args.fail_every)}
+    api_env = {
+        "LLM_BACKEND": args.backend,
+        "GEMINI_API_KEY": "fake",
+        "GEMINI_API_ENDPOINT": f"http://127.0.0.1:{llm_port}",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+        "LLM_MAX_CONNECTIONS": str(args.concurrency),
+        "LLM_MAX_CONCURRENCY": str(args.llm_concurrency or args.concurrency),
+        "LOG_SAMPLE_RATE": "0",
+        # the test repeats a handful of questions, which the answer cache would mostly serve
+        "ANSWER_CACHE": "1" if args.answer_cache else "0",
+    }
+    if args.store:
+        api_env["EMBED_STORE_DIR"] = os.path.abspath(args.store)
+
+    results = {}
+    llm = start_server(["benchmarks.fake_llm_server:app"], llm_env, llm_port)
+    try:
+        await wait_ready(f"http://127.0.0.1:{llm_port}/docs")
+        print(f"[INFO] {args.requests} requests, concurrency {args.concurrency}, {args.backend} backend, "
+              f"fake LLM latency {args.llm_latency}s")
+        print(f"{'mode':<8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ttfb ms':>10}{'errors':>8}")
+
+        for name in args.modes:
+            async_llm, path, stream = MODES[name]
+            api = start_server(["api.main:app"], {**api_env, "ASYNC_LLM": async_llm}, api_port)
+            try:
+                base_url = f"http://127.0.0.1:{api_port}"
+                await wait_ready(base_url + "/health/ready")
+                # one warm-up request so model/client setup isn't measured
+                await run_load(base_url, path, 1, 1, stream=stream)
+                results[name] = summarize(*await run_load(base_url, path, args.requests, args.concurrency,
+                                                          stream=stream))
+                report(name, results[name])
+            finally:
+                api.terminate()
+                api.wait()
+    finally:
+        llm.terminate()
+        llm.wait()
+    return results
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Concurrency load test of /ask with a fake LLM")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Fake LLM seconds per answer")
+    parser.add_argument("--tokens", type=int, default=40, help="Fake LLM tokens per answer")
+    parser.add_argument("--backend", choices=["gemini", "openai"], default="gemini", help="LLM_BACKEND of the API")
+    parser.add_argument("--llm-concurrency", type=int, default=0,
+                        help="LLM_MAX_CONCURRENCY of the API (default: --concurrency)")
+    parser.add_argument("--fail-every", type=int, default=0, help="Fake LLM answers every Nth request with 429")
+    parser.add_argument("--port", type=int, default=8100, help="API port (fake LLM uses port + 1)")
+    parser.add_argument("--store", help="Serve this embedding store (EMBED_STORE_DIR), e.g. a synthetic corpus")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--answer-cache", action="store_true", help="Leave the API's answer cache on")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    results = asyncio.run(main_async(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
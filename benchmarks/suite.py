@@ -0,0 +1,251 @@
+# benchmarks/suite.py
+# Reproducible benchmark suite: synthetic corpora of several sizes (benchmarks/synthetic_corpus.py),
+# micro-benchmarks of the retrieval path and, optionally, the end-to-end load test
+# (benchmarks/load_test.py, fake LLM). Results are written as JSON together with the
+# commit and machine they were measured on; against a baseline file, entries that got
+# slower than the tolerance are flagged and the exit status is 1.
+#
+#   python -m benchmarks.suite                                   # 10^3..10^5 chunks, micro-benchmarks
+#   python -m benchmarks.suite --sizes 1000 10000 100000 1000000 --e2e
+#   python -m benchmarks.suite --startup                          # + API cold start (benchmarks/bench_startup.py)
+#   python -m benchmarks.suite --baseline benchmarks/results/main.json --tolerance 0.15
+#   python -m benchmarks.suite --compare old.json new.json      # compare two stored runs
+#
+# Micro-benchmarks (per corpus size n, per query batch size b where it applies):
+#   load_csv / load_store   chunks.csv parse vs binary store open (+ reading every page), fresh process
+#   encode                  query encoding with the embedding model (independent of n)
+#   score                   query x corpus dot products
+#   topk                    top-k selection over the scores
+#   startup/import|live|ready   `import api.main`, and a fresh API process until /health/live and /health/ready
+# Latencies are reported as p50 / p95 / p99 / mean in milliseconds; e2e entries add req/s.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from time import perf_counter as timer
+
+import numpy as np
+import torch
+
+from benchmarks.synthetic_corpus import DEFAULT_DIR, corpus_dir, write_corpus
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(PROJECT_ROOT, "benchmarks", "results")
+
+_LOADER = r"""
+import json, sys
+from time import perf_counter as timer
+import torch  # imported up front so only the load itself is timed
+from api import embedder
+
+kind, path = sys.argv[1], sys.argv[2]
+start = timer()
+if kind == "csv":
+    embedder.EMBED_CSV_PATH = path
+    chunks, emb = embedder.load_embeddings_csv()
+else:
+    chunks, emb = embedder.load_embeddings_store(path)
+    # touch every page so the mmap is actually read, like the first queries would
+    float(emb.sum())
+print(json.dumps({"seconds": timer() - start, "chunks": len(chunks)}))
+"""
+
+
+def latency_stats(samples):
+    ms = np.asarray(samples) * 1e3
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)), "mean_ms": float(ms.mean()), "runs": len(ms)}
+
+
+def measure(fn, repeat, warmup=3):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = timer()
+        fn()
+        samples.append(timer() - start)
+    return latency_stats(samples)
+
+
+def time_load(kind, path, repeat):
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _LOADER, kind, path],
+                             cwd=PROJECT_ROOT, capture_output=True, text=True, check=True)
+        # the loaders print [INFO] lines; the result is the last line
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1])["seconds"])
+    return latency_stats(samples)
+
+
+def bench_encode(results, batch_sizes, repeat):
+    from api.retriever import encode_queries
+    from benchmarks.load_test import QUESTIONS
+
+    try:
+        encode_queries(QUESTIONS[:1])
+    except Exception as e:
+        print(f"[WARNING] Embedding model unavailable, skipping encode benchmark: {e}")
+        return
+    for b in batch_sizes:
+        queries = [QUESTIONS[i % len(QUESTIONS)] + f" ({i})" for i in range(b)]
+        results[f"encode/b={b}"] = measure(lambda: encode_queries(queries), repeat)
+        print(f"[INFO] encode b={b}: p50 {results[f'encode/b={b}']['p50_ms']:.2f} ms")
+
+
+def bench_corpus(results, n, csv_path, store_dir, batch_sizes, k, repeat, load_repeat):
+    from api.store import load_store
+
+    corpus_results = {}
+    if csv_path:
+        corpus_results[f"load_csv/n={n}"] = time_load("csv", csv_path, load_repeat)
+    corpus_results[f"load_store/n={n}"] = time_load("store", store_dir, load_repeat)
+
+    _, embeddings = load_store(store_dir)
+    rng = np.random.default_rng(1)
+    for b in batch_sizes:
+        q = torch.from_numpy(rng.standard_normal((b, embeddings.shape[1])).astype(np.float32))
+        q = q.to(embeddings.dtype)
+        scores = q @ embeddings.T
+        corpus_results[f"score/n={n}/b={b}"] = measure(lambda: q @ embeddings.T, repeat)
+        corpus_results[f"topk/n={n}/b={b}"] = measure(lambda: torch.topk(scores, k=min(k, n), dim=1), repeat)
+
+    for key, stats in corpus_results.items():
+        print(f"[INFO] {key:<28} p50 {stats['p50_ms']:>10.3f} ms   p95 {stats['p95_ms']:>10.3f} ms")
+    results.update(corpus_results)
+
+
+def bench_e2e(results, n, store_dir, args):
+    from benchmarks import load_test
+
+    load_args = load_test.build_parser().parse_args([
+        "--store", store_dir, "--requests", str(args.e2e_requests), "--concurrency", str(args.e2e_concurrency),
+        "--llm-latency", str(args.e2e_llm_latency), "--modes", *args.e2e_modes,
+    ])
+    for mode, result in asyncio.run(load_test.main_async(load_args)).items():
+        results[f"e2e/{mode}/n={n}"] = result
+
+
+def run_metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "args": {key: value for key, value in vars(args).items() if key not in ("compare", "baseline")},
+    }
+
+
+def compare(baseline, current, tolerance):
+    """Print entries present in both runs; returns the keys that regressed by more than tolerance."""
+    regressions = []
+    print(f"\n{'benchmark':<30}{'metric':>16}{'baseline':>12}{'current':>12}{'change':>10}")
+    for key in sorted(set(baseline) & set(current)):
+        old, new = baseline[key], current[key]
+        # latency: lower is better; throughput: higher is better
+        for metric, higher_is_better in (("p50_ms", False), ("throughput_rps", True)):
+            if old.get(metric) is None or new.get(metric) is None or not old[metric]:
+                continue
+            change = new[metric] / old[metric] - 1
+            worse = -change if higher_is_better else change
+            flag = "  REGRESSION" if worse > tolerance else ""
+            if flag:
+                regressions.append(key)
+            print(f"{key:<30}{metric:>16}{old[metric]:>12.3f}{new[metric]:>12.3f}{change:>+10.1%}{flag}")
+    for key in sorted(set(baseline) ^ set(current)):
+        print(f"{key:<30}  only in the {'baseline' if key in baseline else 'current run'}")
+    return regressions
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite with JSON results and regression check")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                        help="Synthetic corpus sizes (chunks)")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32], help="Queries per call")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=50, help="Timed runs per micro-benchmark")
+    parser.add_argument("--load-repeat", type=int, default=3, help="Fresh-process runs per load benchmark")
+    parser.add_argument("--csv-max", type=int, default=100_000, help="Largest corpus to also test as chunks.csv")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads (0 = torch default)")
+    parser.add_argument("--no-encode", action="store_true", help="Skip the encode benchmark (no model download)")
+    parser.add_argument("--e2e", action="store_true", help="Also run the load test against the API")
+    parser.add_argument("--e2e-size", type=int, default=10_000, help="Corpus size served in the load test")
+    parser.add_argument("--e2e-requests", type=int, default=400)
+    parser.add_argument("--e2e-concurrency", type=int, default=100)
+    parser.add_argument("--e2e-llm-latency", type=float, default=0.5)
+    parser.add_argument("--e2e-modes", nargs="+", default=["async", "stream"])
+    parser.add_argument("--startup", action="store_true", help="Also time the API's cold start")
+    parser.add_argument("--startup-repeat", type=int, default=3, help="Fresh API processes per startup benchmark")
+    parser.add_argument("--data-dir", default=DEFAULT_DIR, help="Where synthetic corpora are generated (reused)")
+    parser.add_argument("--out", help="Result file (default benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--baseline", help="Flag regressions against this result file")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed slowdown before flagging")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Only compare two existing result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(load_results(args.compare[0])["results"], load_results(args.compare[1])["results"],
+                              args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    results = {}
+    if not args.no_encode:
+        bench_encode(results, args.batch_sizes, args.repeat)
+
+    for n in args.sizes:
+        csv_path, store_dir = write_corpus(corpus_dir(args.data_dir, n, args.dim), n, args.dim,
+                                           csv_file=n <= args.csv_max)
+        bench_corpus(results, n, csv_path, store_dir, args.batch_sizes, args.k, args.repeat, args.load_repeat)
+
+    if args.e2e:
+        _, store_dir = write_corpus(corpus_dir(args.data_dir, args.e2e_size, args.dim), args.e2e_size, args.dim,
+                                    csv_file=False)
+        bench_e2e(results, args.e2e_size, store_dir, args)
+
+    if args.startup:
+        from benchmarks import bench_startup
+
+        startup_args = bench_startup.build_parser().parse_args(["--repeat", str(args.startup_repeat)])
+        startup, _ = bench_startup.run(startup_args)
+        results.update(startup)
+
+    run = {"meta": run_metadata(args), "results": results}
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{run['meta']['commit'] or 'nocommit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"[INFO] Results written to {out}")
+
+    if args.baseline:
+        regressions = compare(load_results(args.baseline)["results"], results, args.tolerance)
+        if regressions:
+            print(f"[WARNING] {len(set(regressions))} benchmark(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
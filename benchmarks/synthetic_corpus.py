@@ -0,0 +1,105 @@
+# benchmarks/synthetic_corpus.py
+# Synthetic corpora for the benchmark suite, in the same formats build_embeddings.py
+# writes: embeddings/chunks.csv (chunk_id, page_number, text, embedding) and the binary
+# store (api/store.py). Texts are manual-like word salad; vectors are clustered and
+# L2-normalised like sentence embeddings (see benchmarks/bench_ann.py). Everything is
+# generated and written in batches, so 10^6 chunks never sit in memory at once, and a
+# given (n, dim, seed) always produces the same corpus.
+#
+#   python -m benchmarks.synthetic_corpus --n 1000 10000 100000 1000000
+#   python -m benchmarks.synthetic_corpus --n 10000 --csv-max 10000 --out benchmarks/data
+
+import argparse
+import csv
+import os
+from time import perf_counter as timer
+
+import numpy as np
+
+from api.store import StoreWriter, store_exists, read_meta
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+WORDS = ("hydraulic pump pressure system engine start switch panel valve light caution warning "
+         "procedure checklist position flap bleed air fuel apu gear brake autopilot disengage "
+         "master flight control altitude heading speed thrust lever overhead forward aft left right "
+         "on off auto manual normal alternate standby battery generator bus power indicator").split()
+
+BATCH = 10_000
+CHUNKS_PER_PAGE = 8
+
+
+def corpus_dir(out_dir, n, dim):
+    return os.path.join(out_dir, f"n{n}-d{dim}")
+
+
+def _batches(n, dim, seed, clusters=256, noise=0.35):
+    """Yield (chunk_ids, page_numbers, texts, vectors) batches of the corpus."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    words = np.array(WORDS)
+    for start in range(0, n, BATCH):
+        size = min(BATCH, n - start)
+        ids = np.arange(start, start + size)
+        lengths = rng.integers(40, 120, size)
+        picks = rng.integers(0, len(words), int(lengths.sum()))
+        bounds = np.concatenate([[0], np.cumsum(lengths)])
+        texts = [" ".join(words[picks[bounds[i]:bounds[i + 1]]]).capitalize() + "." for i in range(size)]
+        data = centres[rng.integers(0, clusters, size)] + noise * rng.standard_normal((size, dim)).astype(np.float32)
+        vectors = data / np.linalg.norm(data, axis=1, keepdims=True)
+        yield ids, ids // CHUNKS_PER_PAGE + 1, texts, vectors
+
+
+def write_corpus(out_dir, n, dim=384, seed=0, csv_file=True, dtype="float32"):
+    """
+    Write a synthetic corpus of n chunks to out_dir/chunks.csv (when csv_file) and the
+    binary store out_dir/store. Existing files for the same corpus are kept.
+    Returns (csv_path or None, store_dir).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    csv_path = os.path.join(out_dir, "chunks.csv") if csv_file else None
+    store_dir = os.path.join(out_dir, "store")
+
+    if csv_path and not os.path.exists(csv_path):
+        start = timer()
+        tmp_path = csv_path + ".tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["chunk_id", "page_number", "text", "embedding"])
+            for ids, pages, texts, vectors in _batches(n, dim, seed):
+                writer.writerows(
+                    [int(i), int(p), t, ",".join(f"{x:.8f}" for x in v)]
+                    for i, p, t, v in zip(ids, pages, texts, vectors)
+                )
+        os.replace(tmp_path, csv_path)
+        print(f"[INFO] Wrote {csv_path} ({n} chunks) in {timer() - start:.1f}s")
+
+    spec = {"n": n, "dim": dim, "seed": seed}
+    if not (store_exists(store_dir) and read_meta(store_dir).get("synthetic") == spec
+            and read_meta(store_dir)["dtype"] == dtype):
+        start = timer()
+        writer = StoreWriter(store_dir, dim, dtype=dtype)
+        for ids, pages, texts, vectors in _batches(n, dim, seed):
+            writer.append(vectors, ids, pages, texts)
+        writer.close(extra_meta={"synthetic": spec})
+        print(f"[INFO] Wrote {store_dir} ({n} chunks, {dtype}) in {timer() - start:.1f}s")
+
+    return csv_path, store_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic corpora in the chunks.csv / store formats")
+    parser.add_argument("--n", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=384, help="Embedding size (all-MiniLM-L6-v2: 384)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv-max", type=int, default=100_000,
+                        help="Only write chunks.csv up to this many chunks (the CSV of 10^6 chunks is ~4 GB)")
+    parser.add_argument("--out", default=DEFAULT_DIR)
+    args = parser.parse_args()
+
+    for n in args.n:
+        write_corpus(corpus_dir(args.out, n, args.dim), n, args.dim, args.seed, csv_file=n <= args.csv_max)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,89 @@
 # build_embeddings.py
 
-from api.document_processor import load_pdf, split_sentences, chunk_sentences
-from api.embedder import compute_embeddings_csv
-from api.config import PDF_PATH
+import argparse
+import os
+
+import httpx
+
+from api.ingest import run_ingestion, run_incremental_ingestion, print_ingestion_report
+from api.embedder import EMBED_STORE_DIR, EMBED_CSV_PATH, EMBED_STORE_DTYPE
+from api.config import PDF_PATH, CORPUS_MANIFEST, EMBED_SHARDS_DIR
+from api.corpus import load_corpus_manifest, shard_dir
+from api.document_processor import table_of_contents, Chunker
 
 if __name__ == "__main__":
-    print("[STEP 1] Loading PDF...")
-    pages = load_pdf(PDF_PATH)
+    parser = argparse.ArgumentParser(description="Extract, chunk and embed the manual")
+    parser.add_argument("--pdf", default=PDF_PATH)
+    parser.add_argument("--store", default=EMBED_STORE_DIR)
+    parser.add_argument("--dtype", default=None, choices=["float32", "float16"],
+                        help=f"Store dtype (default: {EMBED_STORE_DTYPE}, or the existing store's with --incremental)")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (default: all cores)")
+    parser.add_argument("--pages-per-task", type=int, default=16, help="Pages per worker task")
+    parser.add_argument("--encode-batch", type=int, default=256, help="Chunks per encode/write batch")
+    parser.add_argument("--no-csv", action="store_true", help="Only write the binary store")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-embed chunks that changed since the last build")
+    parser.add_argument("--corpus", nargs="?", const=CORPUS_MANIFEST, default=None,
+                        help=f"Build one shard per document of a corpus manifest (default: {CORPUS_MANIFEST})")
+    parser.add_argument("--doc", action="append", default=None,
+                        help="With --corpus, only (re)build these doc_ids (repeatable)")
+    parser.add_argument("--chunking", default=None,
+                        help="Chunker spec, e.g. 'tokens:target=180,overlap=1,toc=drop' or 'sentences' "
+                             "(default: the CHUNK_* settings; compare specs with benchmarks.eval_chunking)")
+    parser.add_argument("--reload-url", default=None,
+                        help="Running API to hot-swap the new index into, e.g. http://localhost:8000")
+    args = parser.parse_args()
+
+    if args.chunking:
+        try:
+            Chunker.from_spec(args.chunking)
+        except ValueError as e:
+            parser.error(str(e))
 
-    print("[STEP 2] Splitting into sentences...")
-    pages = split_sentences(pages)
+    options = dict(
+        workers=args.workers,
+        pages_per_task=args.pages_per_task,
+        encode_batch_size=args.encode_batch,
+    )
 
-    print("[STEP 3] Chunking...")
-    chunks = chunk_sentences(pages)
+    def build(pdf_path, store_dir, **extra):
+        # a fresh chunker per document: chunks never continue from one PDF into the next
+        extra["chunker"] = Chunker.from_spec(args.chunking) if args.chunking else Chunker()
+        # Extraction + sentence splitting run in worker processes while the main
+        # process chunks, encodes and writes, one fixed-size batch at a time.
+        # The nearest-neighbour index is built before the new store is swapped in.
+        if args.incremental:
+            print("[STEP 1-5] Re-indexing changed pages and chunks (streaming)...")
+            stats = run_incremental_ingestion(pdf_path, store_dir=store_dir, dtype=args.dtype, **options, **extra)
+        else:
+            print("[STEP 1-5] Loading PDF, splitting, chunking, embedding and indexing (streaming)...")
+            stats = run_ingestion(pdf_path, store_dir=store_dir, dtype=args.dtype or EMBED_STORE_DTYPE,
+                                  **options, **extra)
+        print_ingestion_report(stats)
 
-    print("[STEP 4] Computing & saving embeddings to CSV...")
-    compute_embeddings_csv(chunks)
+    if args.corpus:
+        # one shard per document; the CSV export only exists for the single-manual setup
+        documents = load_corpus_manifest(args.corpus)
+        if args.doc:
+            unknown = set(args.doc) - {d["doc_id"] for d in documents}
+            if unknown:
+                parser.error(f"Unknown doc_id(s) {sorted(unknown)} in {args.corpus}")
+            documents = [d for d in documents if d["doc_id"] in args.doc]
+        for doc in documents:
+            print(f"\n[INFO] Document {doc['doc_id']} ({doc['pdf']})")
+            build(doc["pdf"], shard_dir(doc["doc_id"]), write_csv=False, extra_meta={
+                "doc_id": doc["doc_id"],
+                "title": doc["title"],
+                "chapters": table_of_contents(doc["pdf"]),
+            })
+        print(f"\n  Embeddings generated successfully! {len(documents)} shards in {EMBED_SHARDS_DIR}")
+    else:
+        build(args.pdf, args.store, csv_path=EMBED_CSV_PATH, write_csv=not args.no_csv,
+              extra_meta={"chapters": table_of_contents(args.pdf)})
+        print(f"\n  Embeddings generated successfully! Saved to {args.store}"
+              + ("" if args.no_csv else f" and {EMBED_CSV_PATH}"))
 
-    print("\n  Embeddings generated successfully! Saved to embeddings/chunks.csv")
+    if args.reload_url:
+        response = httpx.post(args.reload_url.rstrip("/") + "/admin/reload", timeout=600,
+                              headers={"X-Admin-Token": os.getenv("ADMIN_TOKEN", "")})
+        print(f"[INFO] Reload of {args.reload_url}: {response.status_code} {response.text}")
@@ -0,0 +1,20 @@
+# build_index.py
+# (Re)build the nearest-neighbour and BM25 indexes over an existing embedding
+# store without re-embedding the manual.
+
+import argparse
+
+from api.embedder import build_store_index, build_bm25_index, EMBED_STORE_DIR
+from api.config import INDEX_KIND, IVF_NLIST
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the retrieval index next to the embedding store")
+    parser.add_argument("--store", default=EMBED_STORE_DIR, help="Embedding store directory")
+    parser.add_argument("--kind", default=INDEX_KIND, choices=["flat", "ivf", "sq8", "binary"])
+    parser.add_argument("--nlist", type=int, default=IVF_NLIST, help="IVF clusters (0 = ~4*sqrt(N))")
+    parser.add_argument("--bm25-only", action="store_true", help="Only rebuild the BM25 lexical index")
+    args = parser.parse_args()
+
+    if not args.bm25_only:
+        build_store_index(args.store, kind=args.kind, nlist=args.nlist)
+    build_bm25_index(args.store)
@@ -0,0 +1,17 @@
+# convert_embeddings.py
+# One-shot conversion of embeddings/chunks.csv into the binary memory-mapped store.
+
+import argparse
+
+from api.embedder import convert_csv_to_store, build_bm25_index, EMBED_CSV_PATH, EMBED_STORE_DIR
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert chunks.csv to the binary embedding store")
+    parser.add_argument("--csv", default=EMBED_CSV_PATH, help="Path to the source chunks.csv")
+    parser.add_argument("--out", default=EMBED_STORE_DIR, help="Store directory to write")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"],
+                        help="Storage dtype for the embedding matrix")
+    args = parser.parse_args()
+
+    convert_csv_to_store(args.csv, args.out, dtype=args.dtype)
+    build_bm25_index(args.out)
@@ -0,0 +1,21 @@
+# gunicorn.conf.py
+# Multi-worker deployment that shares one copy of the embedding model:
+#
+#   PRELOAD_MODEL=1 gunicorn api.main:app -c gunicorn.conf.py
+#
+# preload_app imports api.main in the parent, which (with PRELOAD_MODEL=1) loads the index,
+# warms the model and freezes the GC; workers are then forked and share those pages.
+
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Split the cores between workers instead of every worker using all of them
+    import torch
+    threads = int(os.getenv("EMBED_NUM_THREADS", "0")) or max(1, (os.cpu_count() or 1) // workers)
+    torch.set_num_threads(threads)
@@ -0,0 +1,201 @@
+# replay_queries.py
+# Work with the query log the API writes (QUERY_LOG_PATH, see api/query_log.py):
+#   top      print the most frequent queries of the log
+#   prewarm  send the most frequent recent queries to a running instance once it is ready,
+#            filling its caches before real traffic arrives (retrieval only unless --answers)
+#   replay   send the logged requests to an instance with their original spacing, N x faster,
+#            and report throughput and tail latency (capacity test before a deploy)
+#
+#   python replay_queries.py top logs/queries.jsonl --top 20
+#   python replay_queries.py prewarm logs/queries.jsonl --url http://localhost:8000 --top 200 --hours 24
+#   python replay_queries.py replay logs/queries.jsonl --url http://localhost:8000 --speed 10 --out replay.json
+#
+# Replay is open-loop: requests leave on the log's schedule whether or not earlier ones
+# have been answered, as real users would send them; --max-in-flight only protects the
+# client, and a request held back by it shows up as send lag. Use --retrieval-only to
+# leave the LLM out, or point the instance at benchmarks/fake_llm_server.py. --out writes
+# the figures keyed like benchmarks/suite.py, so `suite --compare` works on them.
+
+import argparse
+import asyncio
+import json
+from collections import Counter
+from time import perf_counter as timer
+from time import time
+
+import httpx
+import numpy as np
+
+from api.query_log import read_log, top_queries, request_params
+
+
+def load_records(args):
+    since = time() - args.hours * 3600 if args.hours else None
+    records = list(read_log(args.log, since=since))
+    if not records:
+        raise SystemExit(f"[ERROR] No queries in {args.log}" + (f" from the last {args.hours}h" if since else ""))
+    return records
+
+
+def latency_stats(seconds):
+    ms = np.asarray(seconds) * 1e3
+    if not len(ms):
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    return {"p50_ms": round(float(np.percentile(ms, 50)), 2), "p95_ms": round(float(np.percentile(ms, 95)), 2),
+            "p99_ms": round(float(np.percentile(ms, 99)), 2), "max_ms": round(float(ms.max()), 2)}
+
+
+async def wait_ready(client, timeout):
+    """Wait for GET /health/ready to answer 200."""
+    deadline = timer() + timeout
+    while timer() < deadline:
+        try:
+            if (await client.get("/health/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(1.0)
+    raise SystemExit(f"[ERROR] {client.base_url} not ready after {timeout}s")
+
+
+def cmd_top(args):
+    for record in top_queries(load_records(args), args.top):
+        print(f"{record['count']:>8}  {record['query']}")
+
+
+async def cmd_prewarm(args):
+    queries = top_queries(load_records(args), args.top)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    statuses = Counter()
+
+    async with httpx.AsyncClient(base_url=args.url.rstrip("/"), timeout=args.timeout) as client:
+        await wait_ready(client, args.ready_timeout)
+
+        async def one(record):
+            params = request_params(record)
+            if not args.answers:
+                params["retrieval_only"] = True
+            async with semaphore:
+                try:
+                    statuses[(await client.get("/ask", params=params)).status_code] += 1
+                except httpx.HTTPError:
+                    statuses["error"] += 1
+
+        start = timer()
+        await asyncio.gather(*(one(record) for record in queries))
+    print(f"[INFO] Pre-warmed {len(queries)} queries in {timer() - start:.1f}s "
+          f"({'answers' if args.answers else 'retrieval only'}), status codes: {dict(statuses)}")
+
+
+async def cmd_replay(args):
+    records = sorted(load_records(args), key=lambda r: r.get("ts", 0))[:args.limit or None]
+    first = records[0].get("ts", 0)
+    span = (records[-1].get("ts", 0) - first) / args.speed
+    print(f"[INFO] Replaying {len(records)} requests over {span:.1f}s ({args.speed}x), "
+          f"offered {len(records) / span if span else float('inf'):.1f} req/s")
+
+    semaphore = asyncio.Semaphore(args.max_in_flight)
+    latencies, lags, statuses = [], [], Counter()
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(base_url=args.url.rstrip("/"), timeout=args.timeout, limits=limits) as client:
+        await wait_ready(client, args.ready_timeout)
+
+        async def one(record, due):
+            params = request_params(record)
+            if args.retrieval_only:
+                params["retrieval_only"] = True
+            try:
+                sent = timer()
+                lags.append(sent - due)
+                response = await client.get("/ask", params=params)
+                statuses[response.status_code] += 1
+                if response.status_code == 200:
+                    latencies.append(timer() - sent)
+            except httpx.HTTPError:
+                statuses["error"] += 1
+            finally:
+                semaphore.release()
+
+        start = timer()
+        tasks = []
+        for record in records:
+            due = start + (record.get("ts", 0) - first) / args.speed
+            delay = due - timer()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(one(record, due)))
+        await asyncio.gather(*tasks)
+        elapsed = timer() - start
+
+    answered = statuses.get(200, 0)
+    result = {
+        "speed": args.speed,
+        "requests": len(records),
+        "offered_rps": round(len(records) / span, 2) if span else None,
+        "throughput_rps": round(answered / elapsed, 2) if elapsed else None,
+        "seconds": round(elapsed, 2),
+        "status": {str(code): count for code, count in sorted(statuses.items(), key=str)},
+        "error_rate": round(1 - answered / len(records), 4),
+        **latency_stats(latencies),
+        "send_lag_p95_ms": latency_stats(lags)["p95_ms"],
+    }
+    # the same requests as the log saw them, for reference
+    logged = [r["latency_ms"] / 1000 for r in records if r.get("status", 200) == 200 and "latency_ms" in r]
+    if logged:
+        result["logged_p50_ms"] = latency_stats(logged)["p50_ms"]
+        result["logged_p95_ms"] = latency_stats(logged)["p95_ms"]
+
+    print(f"[INFO] {answered}/{len(records)} answered in {elapsed:.1f}s: {result['throughput_rps']} req/s, "
+          f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+          f"max {result['max_ms']} ms")
+    print(f"[INFO] Status codes: {result['status']}, send lag p95 {result['send_lag_p95_ms']} ms")
+    if logged:
+        print(f"[INFO] As logged: p50 {result['logged_p50_ms']} ms, p95 {result['logged_p95_ms']} ms")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"results": {f"replay/x{args.speed:g}": result}}, f, indent=2)
+        print(f"[INFO] Results written to {args.out}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Query log: most frequent queries, cache pre-warm, replay")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_command(name, help_text):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("log", help="Query log (QUERY_LOG_PATH, e.g. logs/queries.jsonl)")
+        command.add_argument("--hours", type=float, default=0, help="Only the last N hours of the log (0 = all)")
+        return command
+
+    top = add_command("top", "Print the most frequent queries")
+    top.add_argument("--top", type=int, default=20)
+
+    for name, help_text in (("prewarm", "Send the most frequent queries to a running instance"),
+                            ("replay", "Replay the log against an instance, N x faster")):
+        command = add_command(name, help_text)
+        command.add_argument("--url", default="http://localhost:8000", help="API base URL")
+        command.add_argument("--timeout", type=float, default=120, help="Per-request timeout (s)")
+        command.add_argument("--ready-timeout", type=float, default=300, help="Wait for /health/ready (s)")
+
+    prewarm = commands.choices["prewarm"]
+    prewarm.add_argument("--top", type=int, default=100, help="Most frequent queries to send")
+    prewarm.add_argument("--answers", action="store_true",
+                         help="Full /ask requests, so answers are cached too (one LLM call per uncached query)")
+    prewarm.add_argument("--concurrency", type=int, default=8)
+
+    replay = commands.choices["replay"]
+    replay.add_argument("--speed", type=float, default=1.0, help="Time compression (10 = ten times the logged rate)")
+    replay.add_argument("--limit", type=int, default=0, help="Only the first N requests (0 = all)")
+    replay.add_argument("--retrieval-only", action="store_true", help="Ask with retrieval_only=true (no LLM calls)")
+    replay.add_argument("--max-in-flight", type=int, default=1000, help="Client-side cap on open requests")
+    replay.add_argument("--out", help="Write the results as JSON")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    if args.command == "top":
+        cmd_top(args)
+    else:
+        asyncio.run(cmd_prewarm(args) if args.command == "prewarm" else cmd_replay(args))